@@ -0,0 +1,113 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+"""
+Micro-benchmark of the S3 key building of storages
+
+Compares the key builder with the previous implementation, which rebuilt keys from configuration
+on every call and then cleaned them with debug log formatting:
+
+    python -m benchmarks.keys --calls-per-request 6 --randomize
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from hashlib import sha1
+from os.path import join
+
+from thumbor.config import Config
+from thumbor.context import Context
+from thumbor.utils import logger
+
+import tc_aws  # noqa, defines TC_AWS_* settings
+from tc_aws.aws.keys import clean_key
+from tc_aws.storages.s3_storage import Storage
+
+PATHS = ['s.glbimg.com/some/image_%d.jpg' % index for index in range(100)]
+
+
+def legacy_key(context, path):
+    """
+    Previous AwsStorage._normalize_path followed by Bucket._clean_key, kept as a reference
+    """
+    config = context.config
+    path = path.lstrip('/')
+    path_segments = [path]
+
+    root_path = getattr(config, 'TC_AWS_STORAGE_ROOT_PATH')
+    if root_path and root_path != '':
+        path_segments.insert(0, root_path)
+
+    if config.AUTO_WEBP and hasattr(context, 'request') and context.request.accepts_webp:
+        path_segments.append("webp")
+
+    if config.TC_AWS_RANDOMIZE_KEYS:
+        path_segments.insert(0, sha1(".".join(path_segments).encode('utf-8')).hexdigest())
+
+    normalized_path = join(path_segments[0], *path_segments[1:]).lstrip('/') if len(path_segments) > 1 else path_segments[0]
+    if normalized_path.endswith('/'):
+        normalized_path += config.TC_AWS_ROOT_IMAGE_NAME
+
+    logger.debug('Cleaning key: {path!r}'.format(path=normalized_path))
+    key = normalized_path
+    while '//' in key:
+        logger.debug(key)
+        key = key.replace('//', '/')
+
+    if '/' == key[0]:
+        key = key[1:]
+
+    logger.debug('Cleansed key: {key!r}'.format(key=key))
+    return key
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the S3 key building of storages')
+    parser.add_argument('--calls-per-request', type=int, default=6,
+                        help='Keys built for the same path by a request')
+    parser.add_argument('--randomize', action='store_true', help='Enables TC_AWS_RANDOMIZE_KEYS')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    config = Config(TC_AWS_STORAGE_BUCKET='bucket', TC_AWS_STORAGE_ROOT_PATH='root',
+                    TC_AWS_RANDOMIZE_KEYS=args.randomize)
+    context = Context(config=config)
+
+    def legacy():
+        for path in PATHS:
+            Storage(context)
+            for _ in range(args.calls_per_request):
+                clean_key(legacy_key(context, path))
+
+    def builder():
+        for path in PATHS:
+            # A storage is instantiated per request
+            storage = Storage(context)
+            for _ in range(args.calls_per_request):
+                clean_key(storage._normalize_path(path))
+
+    for path in PATHS:
+        assert legacy_key(context, path) == Storage(context)._normalize_path(path)
+
+    keys = len(PATHS) * args.calls_per_request
+    results = {}
+    for name, function in (('legacy', legacy), ('builder', builder)):
+        best = min(timeit.repeat(function, number=10, repeat=args.repeat)) / 10
+        results[name] = dict(keys_per_second=keys / best, microseconds_per_key=best / keys * 1e6)
+
+    json.dump(dict(
+        calls_per_request=args.calls_per_request,
+        randomize=args.randomize,
+        results=results,
+        speedup=results['builder']['keys_per_second'] / results['legacy']['keys_per_second'],
+    ), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+"""
+Load-test of the loader, storage and result storage against a local S3 stand-in
+
+Each scenario runs a number of operations at a given concurrency and object size, and reports
+throughput, latency percentiles and the peak RSS of the benchmark process as JSON:
+
+    python -m benchmarks.run --concurrency 1 10 50 --sizes 10240 1048576 --output results.json
+
+A moto server is started unless --endpoint points to an already running stand-in (or to S3 itself).
+Peak RSS is the process' high-water mark so far, run a single scenario per invocation to isolate it.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from ast import literal_eval
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import botocore.session
+from thumbor.config import Config
+from thumbor.context import Context, RequestParameters, ServerParameters
+
+from tc_aws.aws.bucket import Bucket
+from tc_aws.loaders import s3_loader
+from tc_aws.result_storages.s3_storage import Storage as ResultStorage
+from tc_aws.storages.s3_storage import Storage
+
+SCENARIOS = ('loader', 'storage_get', 'storage_put', 'result_storage_get', 'result_storage_put')
+BUCKET = 'tc-aws-benchmark'
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile
+    :param list sorted_values: Sorted values
+    :param float percent: Percentile, between 0 and 100
+    """
+    if not sorted_values:
+        return None
+
+    rank = max(int(round(percent / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def peak_rss():
+    """
+    Peak resident set size of the process, in bytes
+    :rtype: int
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def start_stand_in(host, port):
+    """
+    Starts a moto server and waits for it to answer
+    :return: The server process and its endpoint
+    :rtype: tuple
+    """
+    endpoint = 'http://%s:%d' % (host, port)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'moto.server', '-H', host, '-p', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    for _ in range(60):
+        try:
+            urlopen(endpoint, timeout=1)
+            return process, endpoint
+        except HTTPError:
+            # Answering, even with an error
+            return process, endpoint
+        except OSError:
+            time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError('S3 stand-in did not start on %s' % endpoint)
+
+
+def build_config(endpoint, overrides):
+    """
+    Builds thumbor's configuration for the benchmark bucket
+    :param string endpoint: S3 endpoint
+    :param dict overrides: Settings overriding the defaults
+    :rtype: Config
+    """
+    settings = dict(
+        TC_AWS_ENDPOINT=endpoint,
+        TC_AWS_LOADER_BUCKET=BUCKET,
+        TC_AWS_STORAGE_BUCKET=BUCKET,
+        TC_AWS_RESULT_STORAGE_BUCKET=BUCKET,
+        TC_AWS_STORAGE_ROOT_PATH='storage',
+        TC_AWS_RESULT_STORAGE_ROOT_PATH='result_storage',
+    )
+    settings.update(overrides)
+    return Config(**settings)
+
+
+def build_context(config, url=None):
+    server = ServerParameters(8888, 'localhost', 'thumbor.conf', None, 'info', None)
+    server.security_key = 'benchmark'
+
+    context = Context(server=server, config=config)
+    context.request = RequestParameters(url=url)
+    return context
+
+
+async def prepare(client, config, scenario, size, objects):
+    """
+    Uploads the objects read by a scenario
+    :return: Paths of the objects, cycled through by the scenario
+    :rtype: list
+    """
+    data = os.urandom(size)
+    paths = ['%s/%d/%d.jpg' % (scenario, size, index) for index in range(objects)]
+
+    if scenario == 'loader':
+        for path in paths:
+            client.put_object(Bucket=BUCKET, Key=path, Body=data)
+    elif scenario == 'storage_get':
+        for path in paths:
+            await Storage(build_context(config)).put(path, data)
+    elif scenario == 'result_storage_get':
+        for path in paths:
+            await ResultStorage(build_context(config, path)).put(data)
+
+    return paths
+
+
+def operation(config, scenario, data, paths):
+    """
+    Returns the coroutine function performing the index-th operation of a scenario
+    It returns the number of bytes transferred, raising if the operation failed.
+    """
+    async def load(index):
+        result = await s3_loader.load(build_context(config), paths[index % len(paths)])
+        if not result.successful:
+            raise RuntimeError(result.error)
+        return len(result.buffer)
+
+    async def storage_get(index):
+        buffer = await Storage(build_context(config)).get(paths[index % len(paths)])
+        if buffer is None:
+            raise RuntimeError('not found')
+        return len(buffer)
+
+    async def storage_put(index):
+        if await Storage(build_context(config)).put('storage_put/%d.jpg' % index, data) is None:
+            raise RuntimeError('not stored')
+        return len(data)
+
+    async def result_storage_get(index):
+        result = await ResultStorage(build_context(config)).get(paths[index % len(paths)])
+        if result is None:
+            raise RuntimeError('not found')
+        return len(result.buffer)
+
+    async def result_storage_put(index):
+        path = 'result_storage_put/%d.jpg' % index
+        if await ResultStorage(build_context(config, path)).put(data) is None:
+            raise RuntimeError('not stored')
+        return len(data)
+
+    return dict(
+        loader=load,
+        storage_get=storage_get,
+        storage_put=storage_put,
+        result_storage_get=result_storage_get,
+        result_storage_put=result_storage_put,
+    )[scenario]
+
+
+async def run_scenario(client, config, scenario, concurrency, size, requests, objects):
+    """
+    Runs requests operations of a scenario, concurrency of them at once
+    :return: The scenario's results
+    :rtype: dict
+    """
+    paths = await prepare(client, config, scenario, size, objects)
+    perform = operation(config, scenario, os.urandom(size), paths)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    transferred = []
+    errors = []
+
+    async def measure(index):
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                transferred.append(await perform(index))
+            except Exception as err:
+                errors.append(repr(err))
+                return
+            latencies.append((time.perf_counter() - started_at) * 1000)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*[measure(index) for index in range(requests)])
+    duration = time.perf_counter() - started_at
+
+    latencies.sort()
+    return dict(
+        scenario=scenario,
+        concurrency=concurrency,
+        size=size,
+        requests=requests,
+        errors=len(errors),
+        first_error=errors[0] if errors else None,
+        duration_seconds=duration,
+        throughput_ops=len(latencies) / duration,
+        throughput_bytes=sum(transferred) / duration,
+        latency_ms=dict(
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            p99=percentile(latencies, 99),
+            mean=sum(latencies) / len(latencies) if latencies else None,
+            max=latencies[-1] if latencies else None,
+        ),
+        peak_rss_bytes=peak_rss(),
+    )
+
+
+async def run(args, endpoint, overrides):
+    config = build_config(endpoint, overrides)
+    client = botocore.session.get_session().create_client('s3', endpoint_url=endpoint, region_name=config.TC_AWS_REGION)
+    client.create_bucket(Bucket=BUCKET)
+
+    try:
+        return await run_scenarios(args, client, config)
+    finally:
+        for shared_client in Bucket._clients.values():
+            await shared_client.close()
+
+
+async def run_scenarios(args, client, config):
+    results = []
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            for concurrency in args.concurrency:
+                result = await run_scenario(client, config, scenario, concurrency, size, args.requests, args.objects)
+                results.append(result)
+                print(
+                    '%(scenario)s size=%(size)d concurrency=%(concurrency)d: %(throughput_ops).1f ops/s' % result,
+                    'p50=%.1fms p99=%.1fms' % (result['latency_ms']['p50'] or 0, result['latency_ms']['p99'] or 0),
+                    'errors=%d' % result['errors'],
+                    file=sys.stderr,
+                )
+
+    return results
+
+
+def parse_setting(setting):
+    name, _, value = setting.partition('=')
+    try:
+        return name, literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks tc_aws against a local S3 stand-in')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 10, 50])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10240, 1048576], help='Object sizes in bytes')
+    parser.add_argument('--requests', type=int, default=200, help='Operations per scenario')
+    parser.add_argument('--objects', type=int, default=20, help='Distinct objects read by get scenarios')
+    parser.add_argument('--set', nargs='*', default=[], metavar='SETTING=VALUE',
+                        help='Thumbor settings, e.g. TC_AWS_LOADER_CACHE_MAX_BYTES=0')
+    parser.add_argument('--endpoint', help='Endpoint of a running S3 stand-in, a moto server is started if omitted')
+    parser.add_argument('--port', type=int, default=5005, help='Port of the started moto server')
+    parser.add_argument('--output', help='File the JSON report is written to, stdout if omitted')
+    args = parser.parse_args(argv)
+
+    overrides = dict(parse_setting(setting) for setting in args.set)
+
+    process = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        for name, value in (('AWS_ACCESS_KEY_ID', 'benchmark'), ('AWS_SECRET_ACCESS_KEY', 'benchmark')):
+            os.environ.setdefault(name, value)
+        process, endpoint = start_stand_in('localhost', args.port)
+
+    try:
+        results = asyncio.get_event_loop().run_until_complete(run(args, endpoint, overrides))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        endpoint=args.endpoint or 'moto',
+        settings=overrides,
+        results=results,
+    )
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -55,6 +55,11 @@ setup(
         "Programming Language :: Python :: 3.8",
     ],
     keywords='thumbor aws',
+    entry_points={
+        'console_scripts': [
+            'tc-aws-sweep-results=tc_aws.result_storages.sweeper:main',
+        ],
+    },
     install_requires=[
         'python-dateutil>=2.8,<2.9',
         'thumbor>=7.0.0a2,<8',
@@ -22,3 +22,78 @@ Config.define('TC_AWS_ENDPOINT', None, 'Custom AWS API endpoint', 'S3')
 Config.define('TC_AWS_MAX_RETRY', 0, 'Max retries for get image from S3 bucket', 'S3')
 Config.define('TC_AWS_RANDOMIZE_KEYS', False, 'Should S3 keys be randomized? Defaults to False for BC, for performance, should be set to True', 'S3')
 Config.define('TC_AWS_ROOT_IMAGE_NAME', '', 'When resizing a URL that ends in a slash, what should the corresponding cache key be?', 'S3')
+Config.define('TC_AWS_LOADER_COALESCE_REQUESTS', True, 'Should concurrent loads of the same S3 object share a single request?', 'S3')
+Config.define('TC_AWS_LOADER_CACHE_MAX_BYTES', 0, 'Size in bytes of the in-process cache for loaded S3 objects, 0 disables it', 'S3')
+Config.define('TC_AWS_LOADER_CACHE_TTL', 0, 'Seconds before a loader cache entry expires, 0 means entries only get evicted when the cache is full', 'S3')
+Config.define('TC_AWS_DISK_CACHE_PATH', None, 'Local directory caching S3 objects for the loader and storage, None disables it', 'S3')
+Config.define('TC_AWS_DISK_CACHE_MAX_BYTES', 1073741824, 'Maximum size in bytes of the local disk cache', 'S3')
+Config.define('TC_AWS_DISK_CACHE_TTL', 3600, 'Seconds after which objects of the local disk cache are checked against S3 again, 0 never checks them', 'S3')
+Config.define('TC_AWS_CONDITIONAL_EXPIRATION_CHECK', False, 'Check expiration with a conditional request before downloading results and detector data', 'S3')
+Config.define('TC_AWS_MAX_POOL_CONNECTIONS', None, 'Maximum number of pooled connections to S3, botocore default if None', 'S3')
+Config.define('TC_AWS_CONNECT_TIMEOUT', None, 'Seconds before connection attempts to S3 time out, botocore default if None', 'S3')
+Config.define('TC_AWS_READ_TIMEOUT', None, 'Seconds before socket reads from S3 time out, botocore default if None', 'S3')
+Config.define('TC_AWS_KEEPALIVE_TIMEOUT', None, 'Seconds idle connections to S3 are kept alive, botocore default if None', 'S3')
+Config.define('TC_AWS_LOADER_MAX_RETRY', None, 'Max retries for get image from S3 bucket for loader, overrides TC_AWS_MAX_RETRY', 'S3')
+Config.define('TC_AWS_STORAGE_MAX_RETRY', None, 'Max retries for get image from S3 bucket for Storage, overrides TC_AWS_MAX_RETRY', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_MAX_RETRY', None, 'Max retries for get image from S3 bucket for result Storage, overrides TC_AWS_MAX_RETRY', 'S3')
+Config.define('TC_AWS_LOADER_MAX_POOL_CONNECTIONS', None, 'Maximum number of pooled connections to S3 for loader, overrides TC_AWS_MAX_POOL_CONNECTIONS', 'S3')
+Config.define('TC_AWS_STORAGE_MAX_POOL_CONNECTIONS', None, 'Maximum number of pooled connections to S3 for Storage, overrides TC_AWS_MAX_POOL_CONNECTIONS', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_MAX_POOL_CONNECTIONS', None, 'Maximum number of pooled connections to S3 for result Storage, overrides TC_AWS_MAX_POOL_CONNECTIONS', 'S3')
+Config.define('TC_AWS_LOADER_CONNECT_TIMEOUT', None, 'Seconds before connection attempts to S3 time out for loader, overrides TC_AWS_CONNECT_TIMEOUT', 'S3')
+Config.define('TC_AWS_STORAGE_CONNECT_TIMEOUT', None, 'Seconds before connection attempts to S3 time out for Storage, overrides TC_AWS_CONNECT_TIMEOUT', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_CONNECT_TIMEOUT', None, 'Seconds before connection attempts to S3 time out for result Storage, overrides TC_AWS_CONNECT_TIMEOUT', 'S3')
+Config.define('TC_AWS_LOADER_READ_TIMEOUT', None, 'Seconds before socket reads from S3 time out for loader, overrides TC_AWS_READ_TIMEOUT', 'S3')
+Config.define('TC_AWS_STORAGE_READ_TIMEOUT', None, 'Seconds before socket reads from S3 time out for Storage, overrides TC_AWS_READ_TIMEOUT', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_READ_TIMEOUT', None, 'Seconds before socket reads from S3 time out for result Storage, overrides TC_AWS_READ_TIMEOUT', 'S3')
+Config.define('TC_AWS_LOADER_KEEPALIVE_TIMEOUT', None, 'Seconds idle connections to S3 are kept alive for loader, overrides TC_AWS_KEEPALIVE_TIMEOUT', 'S3')
+Config.define('TC_AWS_STORAGE_KEEPALIVE_TIMEOUT', None, 'Seconds idle connections to S3 are kept alive for Storage, overrides TC_AWS_KEEPALIVE_TIMEOUT', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_KEEPALIVE_TIMEOUT', None, 'Seconds idle connections to S3 are kept alive for result Storage, overrides TC_AWS_KEEPALIVE_TIMEOUT', 'S3')
+Config.define('TC_AWS_LOADER_RANGED_GET_THRESHOLD', 0, 'Size in bytes above which the loader downloads objects as parallel byte ranges, 0 disables it', 'S3')
+Config.define('TC_AWS_LOADER_RANGED_GET_PART_SIZE', 8388608, 'Size in bytes of the byte ranges downloaded in parallel by the loader', 'S3')
+Config.define('TC_AWS_LOADER_RANGED_GET_CONCURRENCY', 4, 'Maximum number of byte ranges the loader downloads at once for a single object', 'S3')
+Config.define('TC_AWS_MULTIPART_UPLOAD_THRESHOLD', 0, 'Size in bytes above which Storage and result Storage upload objects in parts, 0 disables it', 'S3')
+Config.define('TC_AWS_MULTIPART_UPLOAD_PART_SIZE', 8388608, 'Size in bytes of the uploaded parts, raised to 5MB if smaller', 'S3')
+Config.define('TC_AWS_MULTIPART_UPLOAD_CONCURRENCY', 4, 'Maximum number of parts uploaded at once for a single object', 'S3')
+Config.define('TC_AWS_NEGATIVE_CACHE_TTL', 0, 'Seconds keys found missing in S3 are remembered as such, 0 disables it', 'S3')
+Config.define('TC_AWS_NEGATIVE_CACHE_SIZE', 10000, 'Maximum number of keys remembered as missing', 'S3')
+Config.define('TC_AWS_STORAGE_WRITE_BEHIND', False, 'Should Storage writes be queued and performed in background?', 'S3')
+Config.define('TC_AWS_STORAGE_WRITE_BEHIND_QUEUE_SIZE', 1000, 'Maximum number of Storage writes waiting in the write-behind queue', 'S3')
+Config.define('TC_AWS_STORAGE_WRITE_BEHIND_WORKERS', 4, 'Number of workers performing queued Storage writes', 'S3')
+Config.define('TC_AWS_STORAGE_WRITE_BEHIND_OVERFLOW', 'block', 'What to do when the write-behind queue is full: block, drop_oldest or drop_new', 'S3')
+Config.define('TC_AWS_STORAGE_WRITE_BEHIND_FLUSH_TIMEOUT', 30, 'Seconds allowed to perform queued Storage writes on shutdown, None for no limit', 'S3')
+Config.define('TC_AWS_DELETE_CONCURRENCY', 4, 'Maximum number of DeleteObjects batches sent at once when removing many objects', 'S3')
+Config.define('TC_AWS_STORAGE_SIDECARS_IN_METADATA', False, 'Store crypto and detector data as metadata of the image instead of separate objects', 'S3')
+Config.define('TC_AWS_HEAD_CACHE_TTL', 0, 'Seconds metadata of S3 objects is remembered to answer exists checks locally, 0 disables it', 'S3')
+Config.define('TC_AWS_HEAD_CACHE_SIZE', 10000, 'Maximum number of S3 objects whose metadata is remembered', 'S3')
+Config.define('TC_AWS_RETRY_BASE_DELAY', 0, 'Minimum seconds between retries to S3, made with decorrelated jitter backoff. 0 uses botocore backoff', 'S3')
+Config.define('TC_AWS_RETRY_MAX_DELAY', 2, 'Maximum seconds between retries to S3', 'S3')
+Config.define('TC_AWS_CIRCUIT_BREAKER_ERROR_RATE', 0, 'Share of failing S3 calls, between 0 and 1, opening the circuit of a bucket so that calls fail fast. 0 disables it', 'S3')
+Config.define('TC_AWS_CIRCUIT_BREAKER_SLOW_CALL', None, 'Seconds above which S3 calls count as failing for the circuit breaker, None to only count errors', 'S3')
+Config.define('TC_AWS_CIRCUIT_BREAKER_WINDOW', 30, 'Seconds of S3 calls the circuit breaker error rate is computed over', 'S3')
+Config.define('TC_AWS_CIRCUIT_BREAKER_MIN_CALLS', 20, 'Minimum number of S3 calls in the window before a circuit can open', 'S3')
+Config.define('TC_AWS_CIRCUIT_BREAKER_OPEN_SECONDS', 10, 'Seconds a circuit stays open before a probe call is let through to S3', 'S3')
+Config.define('TC_AWS_HEDGE_DELAY', 0, 'Seconds after which a slow S3 GET gets a second identical request, the first to answer being used. 0 disables it', 'S3')
+Config.define('TC_AWS_HEDGE_PERCENTILE', None, 'Percentile of observed S3 GET latencies after which to hedge instead of TC_AWS_HEDGE_DELAY, e.g. 95', 'S3')
+Config.define('TC_AWS_HEDGE_MAX_RATE', 0.05, 'Maximum share of S3 GET requests which get hedged, between 0 and 1', 'S3')
+Config.define('TC_AWS_GET_DEADLINE', None, 'Seconds allowed to download an object from S3, body included, no limit if None', 'S3')
+Config.define('TC_AWS_PUT_DEADLINE', None, 'Seconds allowed to store, update or delete an object in S3, no limit if None', 'S3')
+Config.define('TC_AWS_HEAD_DEADLINE', None, 'Seconds allowed to retrieve metadata of an object or a page of a listing from S3, no limit if None', 'S3')
+Config.define('TC_AWS_PRESIGN_DEADLINE', None, 'Seconds allowed to sign an S3 URL, no limit if None', 'S3')
+Config.define('TC_AWS_LOADER_GET_DEADLINE', None, 'Seconds allowed to download an object from S3 for loader, overrides TC_AWS_GET_DEADLINE', 'S3')
+Config.define('TC_AWS_LOADER_HEAD_DEADLINE', None, 'Seconds allowed to retrieve metadata of an object from S3 for loader, overrides TC_AWS_HEAD_DEADLINE', 'S3')
+Config.define('TC_AWS_STORAGE_GET_DEADLINE', None, 'Seconds allowed to download an object from S3 for Storage, overrides TC_AWS_GET_DEADLINE', 'S3')
+Config.define('TC_AWS_STORAGE_PUT_DEADLINE', None, 'Seconds allowed to store, update or delete an object in S3 for Storage, overrides TC_AWS_PUT_DEADLINE', 'S3')
+Config.define('TC_AWS_STORAGE_HEAD_DEADLINE', None, 'Seconds allowed to retrieve metadata of an object from S3 for Storage, overrides TC_AWS_HEAD_DEADLINE', 'S3')
+Config.define('TC_AWS_STORAGE_PRESIGN_DEADLINE', None, 'Seconds allowed to sign an S3 URL for Storage, overrides TC_AWS_PRESIGN_DEADLINE', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_GET_DEADLINE', None, 'Seconds allowed to download an object from S3 for result Storage, overrides TC_AWS_GET_DEADLINE', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_PUT_DEADLINE', None, 'Seconds allowed to store, update or delete an object in S3 for result Storage, overrides TC_AWS_PUT_DEADLINE', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_HEAD_DEADLINE', None, 'Seconds allowed to retrieve metadata of an object from S3 for result Storage, overrides TC_AWS_HEAD_DEADLINE', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_PRESIGN_DEADLINE', None, 'Seconds allowed to sign an S3 URL for result Storage, overrides TC_AWS_PRESIGN_DEADLINE', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_REDIRECT', False, 'Redirect clients to fresh results in S3 instead of serving them through thumbor', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_REDIRECT_BASE_URL', None, 'Base URL, such as a CDN in front of the result Storage bucket, results are redirected to. Presigned S3 URLs if None', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_REDIRECT_EXPIRY', 3600, 'Seconds presigned URLs results are redirected to stay valid, redirects being cached for MAX_AGE at most this long', 'S3')
+Config.define('TC_AWS_RESULT_STORAGE_REDIRECT_MIN_BYTES', 0, 'Size in bytes below which results are served through thumbor rather than redirected to', 'S3')
+Config.define('TC_AWS_PRESIGN_CACHE_WINDOW', 0, 'Seconds of the time windows within which a presigned URL is reused for the same key, URLs staying valid for their expiry after the window. 0 signs URLs on each call', 'S3')
+Config.define('TC_AWS_PRESIGN_CACHE_SIZE', 10000, 'Maximum number of presigned URLs remembered', 'S3')
+Config.define('TC_AWS_LOADER_REPLICAS', [], "Replicas the loader fails over to, as dicts with 'bucket', 'region' and 'endpoint' keys defaulting to the loaded bucket's, nearest first", 'S3')
+Config.define('TC_AWS_LOADER_REPLICAS_RACE', False, 'Load from the bucket and all its replicas at once, using the first successful download', 'S3')
@@ -0,0 +1,140 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from io import SEEK_CUR, SEEK_END, SEEK_SET, BytesIO, RawIOBase
+
+from botocore.exceptions import IncompleteReadError
+
+
+class BufferedBody(object):
+    """
+    Body of a response which has already been read, such as an object assembled from ranges
+    """
+    def __init__(self, buffer):
+        """
+        Constructor
+        :param bytes buffer: The body's content
+        """
+        self.buffer = buffer
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def read(self):
+        return self.buffer
+
+
+class MemoryBody(RawIOBase):
+    """
+    Readable file over a slice of a buffer, so that parts of an upload are sent without being copied
+    """
+    def __init__(self, view):
+        """
+        Constructor
+        :param memoryview view: The content to send
+        """
+        super(MemoryBody, self).__init__()
+        self._view = view
+        self._position = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self._view) - self._position)
+        buffer[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset, whence=SEEK_SET):
+        if whence == SEEK_CUR:
+            offset += self._position
+        elif whence == SEEK_END:
+            offset += len(self._view)
+
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+async def read_body(file_key):
+    """
+    Reads the body of a GetObject response in a single buffer
+    The buffer is allocated once from ContentLength and filled as chunks arrive,
+    so chunks are neither accumulated nor joined.
+    :param dict file_key: GetObject response
+    :return: The object's content
+    :rtype: bytes
+    """
+    body = file_key['Body']
+    if isinstance(body, BufferedBody):
+        return body.buffer
+
+    content_length = file_key.get('ContentLength')
+    if not content_length:
+        async with body as stream:
+            return await stream.read()
+
+    buffer = allocate_buffer(content_length)
+    await read_body_into(file_key, buffer, 0)
+
+    # Returns the underlying bytes without copying them
+    return buffer.getvalue()
+
+
+def allocate_buffer(size):
+    """
+    Allocates a buffer at its final size at once
+    :param int size: Size of the buffer
+    :rtype: BytesIO
+    """
+    buffer = BytesIO()
+    if size:
+        buffer.seek(size - 1)
+        buffer.write(b'\0')
+        buffer.seek(0)
+
+    return buffer
+
+
+async def read_body_into(file_key, buffer, offset):
+    """
+    Writes the body of a GetObject response into a buffer as chunks arrive
+    :param dict file_key: GetObject response
+    :param BytesIO buffer: Buffer to fill
+    :param int offset: Position of the body in the buffer
+    """
+    content_length = file_key['ContentLength']
+
+    amount_read = 0
+    async with file_key['Body'] as stream:
+        while amount_read < content_length:
+            chunk = await stream.readany()
+            if not chunk:
+                break
+
+            if amount_read + len(chunk) > content_length:
+                amount_read += len(chunk)
+                break
+
+            # Other bodies may be written concurrently, always seek first
+            buffer.seek(offset + amount_read)
+            buffer.write(chunk)
+            amount_read += len(chunk)
+
+    if amount_read != content_length:
+        raise IncompleteReadError(actual_bytes=amount_read, expected_bytes=content_length)
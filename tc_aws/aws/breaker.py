@@ -0,0 +1,163 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from collections import deque
+from time import monotonic
+
+from botocore.exceptions import BotoCoreError
+from thumbor.utils import logger
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(BotoCoreError):
+    """
+    Raised instead of calling S3 while the circuit of a bucket is open
+    """
+    fmt = 'Circuit of S3 bucket {name} is open, failing fast'
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a failing bucket for a while, so that requests fail fast instead of waiting out timeouts
+    The circuit opens when the failing share of the calls made in the last window seconds reaches
+    error_rate, calls slower than slow_call_seconds counting as failures. It is then half-opened after
+    open_seconds: a single probe call is let through, closing the circuit if it succeeds. Calls let through
+    before the circuit opened which complete meanwhile are ignored.
+    """
+    _state = None
+    _instances = {}
+
+    @staticmethod
+    def __new__(cls, name, error_rate, slow_call_seconds=None, window=30, min_calls=20, open_seconds=10):
+        key = (name, error_rate, slow_call_seconds, window, min_calls, open_seconds)
+
+        if not cls._instances.get(key):
+            cls._instances[key] = super(CircuitBreaker, cls).__new__(cls)
+
+        return cls._instances[key]
+
+    def __init__(self, name, error_rate, slow_call_seconds=None, window=30, min_calls=20, open_seconds=10):
+        """
+        Constructor
+        :param string name: Name of the circuit, breakers are shared per name and settings
+        :param float error_rate: Share of failing calls, between 0 and 1, opening the circuit
+        :param float slow_call_seconds: Seconds above which a successful call counts as failing, never if None
+        :param int window: Seconds of calls the error rate is computed over
+        :param int min_calls: Minimum number of calls in the window before the circuit can open
+        :param int open_seconds: Seconds the circuit stays open before a probe call is let through
+        """
+        if self._state is None:
+            self.name = name
+            self.error_rate = error_rate
+            self.slow_call_seconds = slow_call_seconds
+            self.window = window
+            self.min_calls = min_calls
+            self.open_seconds = open_seconds
+            self._state = CLOSED
+            self._calls = deque()
+            self._failures = 0
+            self._opened_at = None
+            self._probe = None
+
+    @property
+    def state(self):
+        """
+        State of the circuit: closed, open or half_open
+        :rtype: string
+        """
+        if self._state == OPEN and monotonic() - self._opened_at >= self.open_seconds:
+            return HALF_OPEN
+
+        return self._state
+
+    def before_call(self):
+        """
+        Lets a call through, or raises CircuitOpenError if the circuit is open
+        :return: Token identifying the probe call when half-open, to pass to record or cancelled, None otherwise
+        :rtype: object
+        """
+        state = self.state
+
+        if state == CLOSED:
+            return None
+
+        if state == HALF_OPEN and self._probe is None:
+            self._state = HALF_OPEN
+            self._probe = object()
+            return self._probe
+
+        raise CircuitOpenError(name=self.name)
+
+    def record(self, failed, seconds, probe=None):
+        """
+        Records the outcome of a call let through
+        :param bool failed: Whether the call failed
+        :param float seconds: Duration of the call
+        :param object probe: Token returned by before_call for the call
+        """
+        failed = failed or (self.slow_call_seconds is not None and seconds > self.slow_call_seconds)
+
+        if self._state == HALF_OPEN:
+            # Only the probe's outcome decides, other calls were let through before the circuit opened
+            if probe is not None and probe is self._probe:
+                self._probe = None
+                if failed:
+                    self._open()
+                else:
+                    logger.info('Circuit of S3 bucket %s closed', self.name)
+                    self._reset(CLOSED)
+            return
+
+        if self._state == OPEN:
+            # Let through before the circuit opened
+            return
+
+        now = monotonic()
+        self._calls.append((now, failed))
+        self._failures += failed
+        self._expire(now)
+
+        if self._failures and len(self._calls) >= self.min_calls and \
+                self._failures >= self.error_rate * len(self._calls):
+            self._open()
+
+    def cancelled(self, probe=None):
+        """
+        Records that a call let through was cancelled, letting another probe through if it was one
+        :param object probe: Token returned by before_call for the call
+        """
+        if probe is not None and probe is self._probe:
+            self._probe = None
+
+    def stats(self):
+        """
+        Returns statistics of the circuit
+        :rtype: dict
+        """
+        return dict(
+            state=self.state,
+            calls=len(self._calls),
+            failures=self._failures,
+        )
+
+    def _open(self):
+        logger.warning('Circuit of S3 bucket %s opened for %s seconds', self.name, self.open_seconds)
+        self._reset(OPEN)
+        self._opened_at = monotonic()
+
+    def _reset(self, state):
+        self._state = state
+        self._calls.clear()
+        self._failures = 0
+        self._probe = None
+
+    def _expire(self, now):
+        while self._calls and self._calls[0][0] <= now - self.window:
+            _, failed = self._calls.popleft()
+            self._failures -= failed
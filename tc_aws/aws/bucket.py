@@ -4,18 +4,55 @@
 # Use of this source code is governed by the MIT license that can be
 # found in the LICENSE file.
 
+import asyncio
+import inspect
+from functools import partial
+from math import ceil
+from time import time
+
 import aiobotocore
-from botocore.client import Config
+from aiobotocore.config import AioConfig
+from botocore.exceptions import BotoCoreError, ClientError
 from thumbor.utils import logger
 from thumbor.engines import BaseEngine
 
+from .body import BufferedBody, MemoryBody, allocate_buffer, read_body, read_body_into
+from .breaker import CircuitBreaker, CircuitOpenError
+from .cache import LRUCache
+from .deadline import within_deadline
+from .hedge import DEFAULT_MAX_RATE, Hedger
+from .keys import clean_key
+from .metrics import Measure
+from .retry import decorrelated_jitter, is_retryable
+
+# Maximum number of keys of a DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+# Maximum number of keys of a ListObjectsV2 page
+LIST_PAGE_SIZE = 1000
+
+# Minimum size of the parts of a multipart upload, but the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Leading characters of randomized keys, a SHA-1 hex digest
+HEX_SHARDS = '0123456789abcdef'
+
+# Fields of HeadObject responses kept by the head cache
+HEAD_FIELDS = ('ETag', 'ContentLength', 'LastModified', 'ContentType', 'Metadata')
+
 
 class Bucket(object):
     _client = None
+    _hedger = None
+    _metrics = None
+    _clients = {}
     _instances = {}
+    _session = None
 
     @staticmethod
     def __new__(cls, bucket, region, endpoint, *args, **kwargs):
+        # Metrics are provided by each request's context, they don't make another bucket
+        kwargs.pop('metrics', None)
         key = (bucket, region, endpoint) + args + tuple(kwargs.items())
 
         if not cls._instances.get(key):
@@ -26,78 +63,407 @@ class Bucket(object):
     """
     This handles all communication with AWS API
     """
-    def __init__(self, bucket, region, endpoint, max_retry=None):
+    def __init__(self, bucket, region, endpoint, max_retry=None, max_pool_connections=None,
+                 connect_timeout=None, read_timeout=None, keepalive_timeout=None,
+                 negative_cache_ttl=None, negative_cache_size=None, head_cache_ttl=None, head_cache_size=None,
+                 retry_base_delay=None, retry_max_delay=None, circuit_breaker_error_rate=None,
+                 circuit_breaker_slow_call=None, circuit_breaker_window=None, circuit_breaker_min_calls=None,
+                 circuit_breaker_open_seconds=None, hedge_delay=None, hedge_percentile=None, hedge_max_rate=None,
+                 get_deadline=None, put_deadline=None, head_deadline=None, presign_deadline=None,
+                 presign_cache_window=None, presign_cache_size=None, component=None, metrics=None):
         """
         Constructor
         :param string bucket: The bucket name
         :param string region: The AWS API region to use
         :param string endpoint: A specific endpoint to use
+        :param int max_retry: Maximum number of retries
+        :param int max_pool_connections: Maximum number of pooled connections
+        :param float connect_timeout: Seconds before connection attempts time out
+        :param float read_timeout: Seconds before socket reads time out
+        :param float keepalive_timeout: Seconds idle connections are kept alive
+        :param int negative_cache_ttl: Seconds missing keys are remembered as such, never if None or 0
+        :param int negative_cache_size: Maximum number of remembered missing keys
+        :param int head_cache_ttl: Seconds metadata of objects is remembered, never if None or 0
+        :param int head_cache_size: Maximum number of objects whose metadata is remembered
+        :param float retry_base_delay: Minimum seconds between retries, which are then made with decorrelated jitter
+                                       backoff instead of botocore's, if not None or 0
+        :param float retry_max_delay: Maximum seconds between retries
+        :param float circuit_breaker_error_rate: Share of failing calls opening the circuit of the bucket,
+                                                 no circuit breaker if None or 0
+        :param float circuit_breaker_slow_call: Seconds above which calls count as failing for the circuit breaker
+        :param int circuit_breaker_window: Seconds of calls the error rate is computed over
+        :param int circuit_breaker_min_calls: Minimum number of calls in the window before the circuit can open
+        :param int circuit_breaker_open_seconds: Seconds the circuit stays open before probing the bucket again
+        :param float hedge_delay: Seconds after which a slow GetObject gets a second identical request,
+                                  never if None or 0
+        :param float hedge_percentile: Percentile of observed GetObject latencies after which to hedge instead,
+                                       once enough latencies are observed
+        :param float hedge_max_rate: Maximum share of GetObject requests which get hedged
+        :param float get_deadline: Seconds allowed to download an object, body included, no limit if None or 0
+        :param float put_deadline: Seconds allowed to store, update or delete objects, no limit if None or 0
+        :param float head_deadline: Seconds allowed to retrieve metadata of an object or a page of a listing,
+                                    no limit if None or 0
+        :param float presign_deadline: Seconds allowed to sign an URL, no limit if None or 0
+        :param int presign_cache_window: Seconds of the time windows within which presigned URLs are reused,
+                                         URLs are signed on each call if None or 0
+        :param int presign_cache_size: Maximum number of presigned URLs remembered
+        :param string component: Component using the bucket (loader, storage or result_storage), for metrics
+        :param BaseMetrics metrics: Thumbor's metrics, the ones previously given are kept if None
         :return: The created bucket
         """
         self._bucket = bucket
+        # Buckets of the same name behind other regions or endpoints, such as replicas, hold other objects
+        self._location = (region, endpoint, bucket)
+        if metrics is not None:
+            # Shared by the server, whereas request contexts drop them once responded to while their
+            # background writes still go through the bucket
+            self._metrics = metrics
+        self._metrics_prefix = '.'.join(
+            ['s3'] + ([component] if component else []) + [bucket.replace('.', '_')]
+        )
 
-        config = None
-        if max_retry is not None:
-            config = Config(
-                retries=dict(
-                    max_attempts=max_retry
-                )
+        self._missing_keys = None
+        if negative_cache_ttl:
+            # Shared by all buckets, so that any put to the same location forgets the key was missing
+            self._missing_keys = LRUCache('missing_keys', negative_cache_size, negative_cache_ttl)
+
+        self._heads = None
+        if head_cache_ttl:
+            self._heads = LRUCache('heads', head_cache_size, head_cache_ttl)
+
+        self._breaker = None
+        if circuit_breaker_error_rate:
+            # Shared by all components calling the same bucket
+            self._breaker = CircuitBreaker(
+                '%s/%s' % (endpoint or region, bucket),
+                circuit_breaker_error_rate,
+                circuit_breaker_slow_call,
+                circuit_breaker_window,
+                circuit_breaker_min_calls,
+                circuit_breaker_open_seconds,
             )
 
+        self._presign_cache_window = presign_cache_window
+        self._presigned_urls = None
+        if presign_cache_window:
+            self._presigned_urls = LRUCache('presigned_urls', presign_cache_size)
+
+        self._deadlines = dict(
+            get=get_deadline,
+            put=put_deadline,
+            head=head_deadline,
+            presign=presign_deadline,
+        )
+
+        if self._hedger is None and hedge_delay:
+            self._hedger = Hedger(
+                hedge_delay,
+                hedge_percentile,
+                DEFAULT_MAX_RATE if hedge_max_rate is None else hedge_max_rate,
+            )
+
+        self._max_retry = 0
+        self._retry_base_delay = retry_base_delay
+        self._retry_max_delay = retry_max_delay
+        if retry_base_delay and max_retry:
+            # Retried by the bucket rather than by botocore
+            self._max_retry, max_retry = max_retry, 0
+
         if self._client is None:
-            self._client = aiobotocore.get_session().create_client(
+            self._client = self._get_client(region, endpoint, max_retry, max_pool_connections,
+                                            connect_timeout, read_timeout, keepalive_timeout)
+
+    @classmethod
+    def _get_client(cls, region, endpoint, max_retry, max_pool_connections,
+                    connect_timeout, read_timeout, keepalive_timeout):
+        """
+        Returns the client shared by all buckets with the same region, endpoint and client config
+        Sharing it reuses pooled connections, TLS sessions and credentials across buckets.
+        :return: The shared client
+        """
+        key = (region, endpoint, max_retry, max_pool_connections, connect_timeout, read_timeout, keepalive_timeout)
+
+        if key not in cls._clients:
+            options = {}
+            if max_retry is not None:
+                options['retries'] = dict(
+                    max_attempts=max_retry
+                )
+
+            if max_pool_connections is not None:
+                options['max_pool_connections'] = max_pool_connections
+
+            if connect_timeout is not None:
+                options['connect_timeout'] = connect_timeout
+
+            if read_timeout is not None:
+                options['read_timeout'] = read_timeout
+
+            if keepalive_timeout is not None:
+                options['connector_args'] = dict(
+                    keepalive_timeout=keepalive_timeout
+                )
+
+            if cls._session is None:
+                cls._session = aiobotocore.get_session()
+
+            cls._clients[key] = cls._session.create_client(
                 's3',
                 region_name=region,
                 endpoint_url=endpoint,
-                config=config
+                config=AioConfig(**options) if options else None
             )
 
+        return cls._clients[key]
+
     async def exists(self, path):
         """
         Checks if an object exists at a given path
         :param string path: Path or 'key' to retrieve AWS object
         """
+        key = clean_key(path)
+        if self._is_missing(key):
+            return False
+
+        if self._get_cached_head(key) is not None:
+            return True
+
         try:
-            await self._client.head_object(
-                Bucket=self._bucket,
-                Key=self._clean_key(path),
-            )
-        except Exception:
+            with self._measure('exists') as measure:
+                try:
+                    response = await self._within_deadline('head', self._call(
+                        self._client.head_object,
+                        Bucket=self._bucket,
+                        Key=key,
+                    ))
+                except ClientError as err:
+                    measure.response = err.response
+                    self._remember_if_missing(key, err)
+                    return False
+                except Exception:
+                    measure.failed = True
+                    return False
+
+                measure.response = response
+        except CircuitOpenError:
             return False
+
+        self._remember_head(key, response)
         return True
 
-    async def get(self, path):
+    async def head(self, path):
+        """
+        Returns metadata of object at given path, without its content
+        :param string path: Path or 'key' to retrieve AWS object
+        """
+        key = clean_key(path)
+        self._raise_if_missing(key, 'HeadObject')
+
+        head = self._get_cached_head(key)
+        if head is not None:
+            return head
+
+        try:
+            with self._measure('head') as measure:
+                measure.response = await self._within_deadline('head', self._call(
+                    self._client.head_object,
+                    Bucket=self._bucket,
+                    Key=key,
+                ))
+        except ClientError as err:
+            self._remember_if_missing(key, err)
+            raise
+
+        self._remember_head(key, measure.response)
+        return measure.response
+
+    async def get(self, path, if_modified_since=None):
         """
         Returns object at given path
         :param string path: Path or 'key' to retrieve AWS object
+        :param datetime if_modified_since: Only transfer the object if modified after this date,
+                                           a 304 ClientError is raised otherwise
+        """
+        key = clean_key(path)
+        self._raise_if_missing(key, 'GetObject')
+
+        args = dict(
+            Bucket=self._bucket,
+            Key=key,
+        )
+
+        if if_modified_since is not None:
+            args['IfModifiedSince'] = if_modified_since
+
+        async def fetch():
+            if self._hedger is not None:
+                response = await self._hedger.run(partial(self._call, self._client.get_object, **args), measure)
+            else:
+                response = await self._call(self._client.get_object, **args)
+
+            if self._deadlines['get']:
+                # Read within the deadline as well, a stuck read must not outlive it
+                try:
+                    response['Body'] = BufferedBody(await read_body(response))
+                except BaseException:
+                    response['Body'].close()
+                    raise
+
+            return response
+
+        try:
+            with self._measure('get') as measure:
+                response = measure.response = await self._within_deadline('get', fetch())
+                measure.bytes_in = response.get('ContentLength', 0)
+        except ClientError as err:
+            self._remember_if_missing(key, err)
+            raise
+
+        # Primes exists and head, usually called again for the same key
+        self._remember_head(key, response)
+        return response
+
+    async def get_ranged(self, path, threshold, part_size, concurrency):
+        """
+        Returns object at given path, downloading large objects as concurrent byte ranges
+        The first range tells the object's size: objects up to threshold bytes are fetched
+        by this single request, the remaining bytes of larger ones by parallel requests.
+        :param string path: Path or 'key' to retrieve AWS object
+        :param int threshold: Size of the first range, above which ranges are fetched in parallel
+        :param int part_size: Size of the following ranges
+        :param int concurrency: Maximum number of ranges fetched at once
+        :return: The GetObject response, with an already read body
+        """
+        key = clean_key(path)
+        self._raise_if_missing(key, 'GetObject')
+
+        # Measured as a whole, including all ranges
+        with self._measure('get_ranged') as measure:
+            return await self._within_deadline(
+                'get',
+                self._get_ranged(key, threshold, part_size, concurrency, measure),
+            )
+
+    async def _get_ranged(self, key, threshold, part_size, concurrency, measure):
         """
+        Downloads object at given key as concurrent byte ranges
+        :param string key: Cleaned key
+        :param int threshold: Size of the first range, above which ranges are fetched in parallel
+        :param int part_size: Size of the following ranges
+        :param int concurrency: Maximum number of ranges fetched at once
+        :param Measure measure: Measure of the download
+        :return: The GetObject response, with an already read body
+        """
+        try:
+            first_part = await self._call(
+                self._client.get_object,
+                Bucket=self._bucket,
+                Key=key,
+                Range='bytes=0-%d' % (threshold - 1),
+            )
+        except ClientError as err:
+            if err.response.get('ResponseMetadata', {}).get('HTTPStatusCode') != 416:
+                self._remember_if_missing(key, err)
+                raise
+            # Empty objects can't be requested by range
+            measure.response = err.response
+            return await self.get(key)
+
+        content_range = first_part.pop('ContentRange', None)
+        size = int(content_range.split('/')[-1]) if content_range else first_part['ContentLength']
+
+        measure.response = first_part
+        measure.bytes_in = size
 
-        return await self._client.get_object(
+        if size <= first_part['ContentLength']:
+            first_part['Body'] = BufferedBody(await read_body(first_part))
+            return first_part
+
+        buffer = allocate_buffer(size)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        part_args = dict(
             Bucket=self._bucket,
-            Key=self._clean_key(path),
+            Key=key,
+        )
+
+        if first_part.get('ETag'):
+            # Fails if the object gets replaced while downloading
+            part_args['IfMatch'] = first_part['ETag']
+
+        async def fetch_part(start):
+            async with semaphore:
+                part = await self._call(
+                    self._client.get_object,
+                    Range='bytes=%d-%d' % (start, min(start + part_size, size) - 1),
+                    **part_args
+                )
+                await read_body_into(part, buffer, start)
+
+        parts = [asyncio.ensure_future(read_body_into(first_part, buffer, 0))]
+        parts.extend(
+            asyncio.ensure_future(fetch_part(start))
+            for start in range(first_part['ContentLength'], size, part_size)
         )
 
+        try:
+            await asyncio.gather(*parts)
+        except BaseException:
+            for part in parts:
+                part.cancel()
+            raise
+
+        first_part['ContentLength'] = size
+        first_part['Body'] = BufferedBody(buffer.getvalue())
+        return first_part
+
     async def get_url(self, path, method='GET', expiry=3600):
         """
         Generates the presigned url for given key & methods
+        With a presign cache window, the same URL is returned for a key until the end of the current
+        window, so that downstream caches see a single URL. It is signed to stay valid for expiry
+        seconds after the window ends, then signed again in the next window.
         :param string path: Path or 'key' for requested object
         :param string method: Method for requested URL
         :param int expiry: URL validity time
         """
+        key = clean_key(path)
+        expires_in = expiry
+        window_end = None
 
-        url = await self._client.generate_presigned_url(
-            ClientMethod='get_object',
-            Params={
-                'Bucket': self._bucket,
-                'Key': self._clean_key(path),
-            },
-            ExpiresIn=expiry,
-            HttpMethod=method,
-        )
+        if self._presigned_urls is not None:
+            now = time()
+            # Aligned to the epoch, so that windows end at the same time in all processes
+            window_end = (now // self._presign_cache_window + 1) * self._presign_cache_window
+            cached = self._presigned_urls.get((self._location, key, method, expiry))
+            if cached is not None and cached[1] == window_end:
+                return cached[0]
+
+            expires_in = expiry + int(ceil(window_end - now))
+
+        # Signed locally, without calling S3
+        with self._measure('get_url', guarded=False):
+            url = self._client.generate_presigned_url(
+                ClientMethod='get_object',
+                Params={
+                    'Bucket': self._bucket,
+                    'Key': key,
+                },
+                ExpiresIn=expires_in,
+                HttpMethod=method,
+            )
+
+            # Signing is a coroutine in later aiobotocore versions, credentials may have to be refreshed first
+            if inspect.isawaitable(url):
+                url = await self._within_deadline('presign', url)
+
+        if window_end is not None:
+            self._presigned_urls.set((self._location, key, method, expiry), (url, window_end), 1)
 
         return url
 
-    async def put(self, path, data, metadata=None, reduced_redundancy=False, encrypt_key=False):
+    async def put(self, path, data, metadata=None, reduced_redundancy=False, encrypt_key=False,
+                  multipart_threshold=None, multipart_part_size=None, multipart_concurrency=None):
         """
         Stores data at given path
         :param string path: Path or 'key' for created/updated object
@@ -105,14 +471,16 @@ class Bucket(object):
         :param dict metadata: Metadata to store with this data
         :param bool reduced_redundancy: Whether to reduce storage redundancy or not?
         :param bool encrypt_key: Encrypt data?
+        :param int multipart_threshold: Size above which data is sent as a multipart upload, never if None or 0
+        :param int multipart_part_size: Size of the uploaded parts, raised to MIN_PART_SIZE if smaller
+        :param int multipart_concurrency: Maximum number of parts uploaded at once
         """
         storage_class = 'REDUCED_REDUNDANCY' if reduced_redundancy else 'STANDARD'
         content_type = BaseEngine.get_mimetype(data) or 'application/octet-stream'
 
         args = dict(
             Bucket=self._bucket,
-            Key=self._clean_key(path),
-            Body=data,
+            Key=clean_key(path),
             ContentType=content_type,
             StorageClass=storage_class,
         )
@@ -123,27 +491,407 @@ class Bucket(object):
         if metadata is not None:
             args['Metadata'] = metadata
 
-        return await self._client.put_object(**args)
+        with self._measure('put') as measure:
+            if multipart_threshold and len(data) > multipart_threshold:
+                part_size = max(multipart_part_size or MIN_PART_SIZE, MIN_PART_SIZE)
+                upload = self._put_multipart(args, data, part_size, multipart_concurrency)
+            else:
+                upload = self._call(self._client.put_object, Body=data, **args)
+
+            response = await self._within_deadline('put', upload)
+
+            measure.response = response
+            measure.bytes_out = len(data)
+
+        if self._missing_keys is not None:
+            self._missing_keys.delete((self._location, args['Key']))
+
+        self._forget_head(args['Key'])
+        return response
+
+    async def update_metadata(self, path, metadata, reduced_redundancy=False, encrypt_key=False):
+        """
+        Replaces user metadata of object at given path, copying the object onto itself
+        :param string path: Path or 'key' of updated object
+        :param dict metadata: New metadata
+        :param bool reduced_redundancy: Whether to reduce storage redundancy or not?
+        :param bool encrypt_key: Encrypt data?
+        """
+        key = clean_key(path)
+        head = await self.head(key)
+
+        args = dict(
+            Bucket=self._bucket,
+            Key=key,
+            CopySource=dict(Bucket=self._bucket, Key=key),
+            CopySourceIfMatch=head['ETag'],
+            MetadataDirective='REPLACE',
+            Metadata=metadata,
+            ContentType=head.get('ContentType', 'application/octet-stream'),
+            StorageClass='REDUCED_REDUNDANCY' if reduced_redundancy else 'STANDARD',
+        )
+
+        if encrypt_key:
+            args['ServerSideEncryption'] = 'AES256'
+
+        self._forget_head(key)
+
+        with self._measure('update_metadata') as measure:
+            measure.response = await self._within_deadline('put', self._call(self._client.copy_object, **args))
+
+        return measure.response
+
+    async def _put_multipart(self, args, data, part_size, concurrency):
+        """
+        Stores data as concurrently uploaded parts, aborting the upload on failure
+        :param dict args: CreateMultipartUpload arguments
+        :param bytes data: Data to write
+        :param int part_size: Size of the uploaded parts, at least MIN_PART_SIZE
+        :param int concurrency: Maximum number of parts uploaded at once
+        """
+        upload = await self._call(self._client.create_multipart_upload, **args)
+        upload_args = dict(
+            Bucket=self._bucket,
+            Key=args['Key'],
+            UploadId=upload['UploadId'],
+        )
+        semaphore = asyncio.Semaphore(concurrency)
+        view = memoryview(data)
+
+        async def upload_part(number, start):
+            async with semaphore:
+                part = await self._call(
+                    self._client.upload_part,
+                    PartNumber=number,
+                    Body=MemoryBody(view[start:start + part_size]),
+                    **upload_args
+                )
+                return dict(ETag=part['ETag'], PartNumber=number)
+
+        parts = [
+            asyncio.ensure_future(upload_part(number, start))
+            for number, start in enumerate(range(0, len(data), part_size), 1)
+        ]
+
+        try:
+            uploaded_parts = await asyncio.gather(*parts)
+
+            return await self._call(
+                self._client.complete_multipart_upload,
+                MultipartUpload=dict(Parts=uploaded_parts),
+                **upload_args
+            )
+        except BaseException:
+            # Parts of an upload which is neither completed nor aborted stay in the bucket
+            for part in parts:
+                part.cancel()
+
+            try:
+                await self._call(self._client.abort_multipart_upload, **upload_args)
+            except Exception as err:
+                logger.warning('Unable to abort multipart upload of %s: %s', args['Key'], err)
+            raise
 
     async def delete(self, path):
         """
         Deletes key at given path
         :param string path: Path or 'key' to delete
         """
-        return await self._client.delete_object(
+        key = clean_key(path)
+        self._forget_head(key)
+
+        with self._measure('delete') as measure:
+            measure.response = await self._within_deadline('put', self._call(
+                self._client.delete_object,
+                Bucket=self._bucket,
+                Key=key,
+            ))
+
+        return measure.response
+
+    async def delete_many(self, paths, concurrency=4):
+        """
+        Deletes keys at given paths, in batches of DELETE_BATCH_SIZE keys deleted concurrently
+        :param list paths: Paths or 'keys' to delete
+        :param int concurrency: Maximum number of batches deleted at once
+        :return: Error message of each key which could not be deleted, empty if all were
+        :rtype: dict
+        """
+        keys = list(dict.fromkeys(clean_key(path) for path in paths))
+        for key in keys:
+            self._forget_head(key)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def delete_batch(batch):
+            async with semaphore:
+                try:
+                    with self._measure('delete_many') as measure:
+                        response = measure.response = await self._within_deadline('put', self._call(
+                            self._client.delete_objects,
+                            Bucket=self._bucket,
+                            Delete={
+                                'Objects': [{'Key': key} for key in batch],
+                                'Quiet': True,
+                            },
+                        ))
+                except (BotoCoreError, ClientError) as err:
+                    return {key: str(err) for key in batch}
+
+            return {error['Key']: error.get('Message', error.get('Code')) for error in response.get('Errors', [])}
+
+        failures = {}
+        for batch_failures in await asyncio.gather(*[
+            delete_batch(keys[start:start + DELETE_BATCH_SIZE])
+            for start in range(0, len(keys), DELETE_BATCH_SIZE)
+        ]):
+            failures.update(batch_failures)
+
+        return failures
+
+    async def iter_objects(self, prefix='', shards=None, concurrency=8, page_size=LIST_PAGE_SIZE,
+                           start_after=None, stop_after=None):
+        """
+        Iterates over objects whose key starts with prefix, as they are listed
+        Objects are listed in key order, unless shards are given: the keyspace is then split by
+        split_keyspace, and its ranges are listed concurrently, objects being iterated over in no
+        particular order. Only a few pages are held in memory at once.
+        :param string prefix: Prefix of the listed keys
+        :param string shards: Leading characters of keys after prefix, such as HEX_SHARDS for randomized keys
+        :param int concurrency: Maximum number of ranges listed at once
+        :param int page_size: Maximum number of keys of a ListObjectsV2 page
+        :param string start_after: Key after which to start listing, from the first if None
+        :param string stop_after: Key after which to stop listing, until the last if None
+        :return: Async iterator over ListObjectsV2 Contents entries: Key, Size, LastModified, ETag...
+        """
+        if not shards:
+            async for page in self._list_pages(prefix, start_after, stop_after, page_size):
+                for listed_object in page:
+                    yield listed_object
+            return
+
+        pages = asyncio.Queue(maxsize=concurrency * 2)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def list_range(start_after, stop_after):
+            try:
+                async with semaphore:
+                    async for page in self._list_pages(prefix, start_after, stop_after, page_size):
+                        await pages.put(page)
+            except Exception as err:
+                await pages.put(err)
+            else:
+                await pages.put(None)
+
+        ranges = [
+            asyncio.ensure_future(list_range(range_start_after, range_stop_after))
+            for range_start_after, range_stop_after in split_keyspace(prefix, shards, start_after, stop_after)
+        ]
+
+        try:
+            remaining = len(ranges)
+            while remaining:
+                page = await pages.get()
+
+                if page is None:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for listed_object in page:
+                        yield listed_object
+        finally:
+            for listed_range in ranges:
+                listed_range.cancel()
+
+    async def _list_pages(self, prefix, start_after, stop_after, page_size):
+        """
+        Iterates over pages of objects whose key starts with prefix, in key order
+        :param string prefix: Prefix of the listed keys
+        :param string start_after: Key after which to start listing, from the first if None
+        :param string stop_after: Key after which to stop listing, until the last if None
+        :param int page_size: Maximum number of keys of a page
+        :return: Async iterator over lists of ListObjectsV2 Contents entries
+        """
+        args = dict(
             Bucket=self._bucket,
-            Key=self._clean_key(path),
+            Prefix=prefix,
+            MaxKeys=page_size,
         )
 
-    def _clean_key(self, path):
-        logger.debug('Cleaning key: {path!r}'.format(path=path))
-        key = path
-        while '//' in key:
-            logger.debug(key)
-            key = key.replace('//', '/')
+        if start_after is not None:
+            args['StartAfter'] = start_after
+
+        while True:
+            with self._measure('list') as measure:
+                response = measure.response = await self._within_deadline(
+                    'head', self._call(self._client.list_objects_v2, **args)
+                )
+
+            page = response.get('Contents', [])
+            if stop_after is not None and page and page[-1]['Key'] > stop_after:
+                page = [listed_object for listed_object in page if listed_object['Key'] <= stop_after]
+                if page:
+                    yield page
+                return
+
+            if page:
+                yield page
+
+            if not response.get('IsTruncated'):
+                return
+
+            args['ContinuationToken'] = response['NextContinuationToken']
+
+    async def _within_deadline(self, operation, awaitable):
+        """
+        Awaits an operation, raising DeadlineExceededError if it exceeds the deadline of its kind
+        The operation is cancelled then, releasing its connection.
+        :param string operation: Kind of operation: get, put, head or presign
+        :param awaitable: The operation
+        :return: The operation's result
+        """
+        return await within_deadline(awaitable, self._deadlines[operation], operation)
+
+    async def _call(self, method, **kwargs):
+        """
+        Calls an S3 API method, retrying transient failures with decorrelated jitter backoff
+        Retries are counted in the RetryAttempts of the response metadata, as botocore does.
+        :param method: Client method to call
+        :return: The method's response
+        :rtype: dict
+        """
+        retries = 0
+        delay = self._retry_base_delay
+
+        while True:
+            try:
+                response = await method(**kwargs)
+            except Exception as err:
+                if retries >= self._max_retry or not is_retryable(err):
+                    if retries and isinstance(err, ClientError):
+                        self._count_retries(err.response, retries)
+                    raise
+
+                retries += 1
+                body = kwargs.get('Body')
+                if hasattr(body, 'seek'):
+                    # Sent again from its start
+                    body.seek(0)
+
+                delay = decorrelated_jitter(self._retry_base_delay, self._retry_max_delay, delay)
+                logger.debug('Retrying %s in %.3fs after: %s', method.__name__, delay, err)
+                await asyncio.sleep(delay)
+                continue
+
+            if retries:
+                self._count_retries(response, retries)
+
+            return response
 
-        if '/' == key[0]:
-            key = key[1:]
+    @staticmethod
+    def _count_retries(response, retries):
+        """
+        Adds retries made by the bucket to those botocore reports in a response
+        :param dict response: Response, or error response, of the retried call
+        :param int retries: Number of retries
+        """
+        metadata = response.setdefault('ResponseMetadata', {})
+        metadata['RetryAttempts'] = metadata.get('RetryAttempts', 0) + retries
+
+    def _measure(self, operation, guarded=True):
+        """
+        Measures an operation through thumbor's metrics
+        Entering it raises CircuitOpenError if the operation is guarded and the bucket's circuit is open.
+        :param string operation: Name of the operation
+        :param bool guarded: Whether the operation goes through the circuit breaker
+        :rtype: Measure
+        """
+        return Measure(self._metrics, self._metrics_prefix, operation, self._breaker if guarded else None)
+
+    def _is_missing(self, key):
+        """
+        Tells whether key was recently found missing
+        :param string key: Cleaned key
+        :rtype: bool
+        """
+        return self._missing_keys is not None and self._missing_keys.get((self._location, key)) is not None
+
+    def _raise_if_missing(self, key, operation_name):
+        """
+        Raises the error S3 would return if key was recently found missing
+        :param string key: Cleaned key
+        :param string operation_name: Name of the short-circuited operation
+        """
+        if self._is_missing(key):
+            raise self._client.exceptions.NoSuchKey({
+                'Error': {
+                    'Code': 'NoSuchKey',
+                    'Message': 'The specified key does not exist.',
+                    'Key': key,
+                },
+                'ResponseMetadata': {
+                    'HTTPStatusCode': 404,
+                },
+            }, operation_name)
+
+    def _remember_if_missing(self, key, err):
+        """
+        Remembers key as missing if the error is a 404
+        :param string key: Cleaned key
+        :param ClientError err: Error returned by S3
+        """
+        if self._missing_keys is not None and \
+                err.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 404:
+            self._missing_keys.set((self._location, key), True, 1)
+
+    def _get_cached_head(self, key):
+        """
+        Returns recently retrieved metadata of key
+        :param string key: Cleaned key
+        :return: HeadObject response fields, None if unknown
+        :rtype: dict
+        """
+        if self._heads is None:
+            return None
+
+        head = self._heads.get((self._location, key))
+        return dict(head) if head is not None else None
+
+    def _remember_head(self, key, response):
+        """
+        Remembers metadata of key from a HeadObject or GetObject response
+        :param string key: Cleaned key
+        :param dict response: The response
+        """
+        if self._heads is not None:
+            head = {field: response[field] for field in HEAD_FIELDS if field in response}
+            self._heads.set((self._location, key), head, 1)
+
+    def _forget_head(self, key):
+        """
+        Forgets metadata of key, about to change
+        :param string key: Cleaned key
+        """
+        if self._heads is not None:
+            self._heads.delete((self._location, key))
+
+
+def split_keyspace(prefix, shards, start_after=None, stop_after=None):
+    """
+    Splits the keys starting with prefix into ranges, before each of the shards following prefix
+    Keys starting with other characters still fall into one of the ranges, which cover all keys.
+    :param string prefix: Prefix of the keys
+    :param string shards: Leading characters of keys after prefix, such as HEX_SHARDS
+    :param string start_after: Key after which the first range starts, from the first key if None
+    :param string stop_after: Key after which the last range stops, until the last key if None
+    :return: Ranges as tuples of the key after which they start and the one after which they stop, if any
+    :rtype: list
+    """
+    bounds = [
+        prefix + shard for shard in sorted(set(shards))[1:]
+        if (start_after is None or prefix + shard > start_after) and (stop_after is None or prefix + shard < stop_after)
+    ]
+    bounds = [start_after] + bounds + [stop_after]
 
-        logger.debug('Cleansed key: {key!r}'.format(key=key))
-        return key
+    return list(zip(bounds, bounds[1:]))
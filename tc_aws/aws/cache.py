@@ -0,0 +1,112 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from collections import OrderedDict
+from time import monotonic
+
+
+class LRUCache(object):
+    """
+    In-process cache bounded by the total size of its values, evicting the least recently used ones
+    """
+    _entries = None
+    _instances = {}
+
+    @staticmethod
+    def __new__(cls, name, max_bytes, ttl=None):
+        key = (name, max_bytes, ttl)
+
+        if not cls._instances.get(key):
+            cls._instances[key] = super(LRUCache, cls).__new__(cls)
+
+        return cls._instances[key]
+
+    def __init__(self, name, max_bytes, ttl=None):
+        """
+        Constructor
+        :param string name: Name of the cache, caches are shared per name and settings
+        :param int max_bytes: Maximum total size of the cached values
+        :param int ttl: Seconds after which an entry expires, never if None or 0
+        """
+        if self._entries is None:
+            self.name = name
+            self.max_bytes = max_bytes
+            self.ttl = ttl
+            self._entries = OrderedDict()
+            self._resident_bytes = 0
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+    def get(self, key):
+        """
+        Returns cached value, marking it as recently used
+        :param key: Cache key
+        :return: The cached value or None
+        """
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self._misses += 1
+            return None
+
+        value, size, expires_at = entry
+        if expires_at is not None and expires_at <= monotonic():
+            self._remove(key)
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def set(self, key, value, size):
+        """
+        Caches value, evicting least recently used entries to stay within budget
+        :param key: Cache key
+        :param value: Value to cache
+        :param int size: Size of the value in bytes
+        """
+        if key in self._entries:
+            self._remove(key)
+
+        if size > self.max_bytes:
+            return
+
+        expires_at = monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (value, size, expires_at)
+        self._resident_bytes += size
+
+        while self._resident_bytes > self.max_bytes:
+            evicted_key = next(iter(self._entries))
+            self._remove(evicted_key)
+            self._evictions += 1
+
+    def delete(self, key):
+        """
+        Removes key from cache
+        :param key: Cache key
+        """
+        if key in self._entries:
+            self._remove(key)
+
+    def stats(self):
+        """
+        Returns cache statistics
+        :return: Hits, misses, evictions, number of entries and resident bytes
+        :rtype: dict
+        """
+        return dict(
+            hits=self._hits,
+            misses=self._misses,
+            evictions=self._evictions,
+            entries=len(self._entries),
+            resident_bytes=self._resident_bytes,
+        )
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._resident_bytes -= size
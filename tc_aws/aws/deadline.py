@@ -0,0 +1,47 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+
+from botocore.exceptions import BotoCoreError
+
+
+class DeadlineExceededError(BotoCoreError):
+    """
+    Raised when an S3 operation did not complete within its deadline
+    """
+    fmt = 'S3 {operation} did not complete within its deadline of {deadline} seconds'
+
+
+async def within_deadline(awaitable, deadline, operation):
+    """
+    Awaits an operation, cancelling it if it does not complete in time
+    Unlike asyncio.wait_for, timeouts raised by the operation itself are not mistaken for the deadline.
+    :param awaitable: The operation
+    :param float deadline: Seconds the operation is allowed to take, no limit if None or 0
+    :param string operation: Name of the operation, for the error message
+    :return: The operation's result
+    """
+    if not deadline:
+        return await awaitable
+
+    task = asyncio.ensure_future(awaitable)
+
+    try:
+        done, _ = await asyncio.wait([task], timeout=deadline)
+    except BaseException:
+        task.cancel()
+        raise
+
+    if not done:
+        task.cancel()
+        # Lets the operation release its connection, without raising its cancellation
+        await asyncio.wait([task])
+        if not task.cancelled():
+            task.exception()
+        raise DeadlineExceededError(operation=operation, deadline=deadline)
+
+    return task.result()
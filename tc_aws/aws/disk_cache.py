@@ -0,0 +1,234 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+import os
+from collections import OrderedDict
+from datetime import datetime
+from hashlib import sha1
+from tempfile import mkstemp
+from time import time
+
+from dateutil.tz import tzutc
+from thumbor.utils import logger
+
+TEMP_PREFIX = '.tmp'
+
+
+class DiskCache(object):
+    """
+    Size-bounded local disk cache for S3 objects, evicting the least recently used ones
+    Files are read, written and removed in the default executor so that the IOLoop never waits for the disk.
+    The index lives on the IOLoop and is only updated there. The size budget is tracked per process, so the
+    directory must not be shared between processes.
+    Files are stamped with the last modification date of their object, and their change time tells when they
+    were last known to match S3: entries older than ttl are returned as stale, to be revalidated.
+    """
+    _index = None
+    _instances = {}
+
+    @staticmethod
+    def __new__(cls, path, max_bytes, ttl=None):
+        key = (path, max_bytes, ttl)
+
+        if not cls._instances.get(key):
+            cls._instances[key] = super(DiskCache, cls).__new__(cls)
+
+        return cls._instances[key]
+
+    def __init__(self, path, max_bytes, ttl=None):
+        """
+        Constructor, the index is rebuilt from files already in the cache directory on first use
+        :param string path: Directory holding cached files
+        :param int max_bytes: Maximum total size of the cached files
+        :param int ttl: Seconds after which entries are stale, never if None or 0
+        """
+        if self._index is None:
+            self.path = path
+            self.max_bytes = max_bytes
+            self.ttl = ttl
+            self._index = OrderedDict()
+            self._resident_bytes = 0
+            self._loading = None
+
+    async def get(self, bucket, key):
+        """
+        Reads cached object
+        :param string bucket: Bucket name
+        :param string key: Key of the object
+        :return: A tuple with the object's content, last modification date and whether it is fresh,
+                 None if not cached
+        :rtype: tuple
+        """
+        await self._load()
+
+        digest = self._digest(bucket, key)
+        if digest not in self._index:
+            return None
+
+        cached = await self._run(self._read_file, digest)
+        if cached is None:
+            # Evicted by another process sharing the directory
+            self._forget(digest)
+            return None
+
+        self._index.move_to_end(digest)
+        return cached
+
+    async def put(self, bucket, key, data, last_modified=None):
+        """
+        Atomically stores object in cache, evicting least recently used files to stay within budget
+        :param string bucket: Bucket name
+        :param string key: Key of the object
+        :param bytes data: Object content
+        :param datetime last_modified: Object's last modification date, defaults to now
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        await self._load()
+
+        digest = self._digest(bucket, key)
+
+        try:
+            await self._run(self._write_file, digest, data, last_modified)
+        except OSError as err:
+            logger.warning('[DISK CACHE] Unable to cache %s/%s: %s', bucket, key, err)
+            return
+
+        self._forget(digest)
+        self._index[digest] = len(data)
+        self._resident_bytes += len(data)
+        await self._evict()
+
+    async def refresh(self, bucket, key):
+        """
+        Marks a stale object as fresh again, once it was found unchanged in S3
+        :param string bucket: Bucket name
+        :param string key: Key of the object
+        """
+        await self._load()
+
+        digest = self._digest(bucket, key)
+        if digest in self._index:
+            await self._run(self._touch_file, digest)
+
+    async def delete(self, bucket, key):
+        """
+        Removes object from cache
+        :param string bucket: Bucket name
+        :param string key: Key of the object
+        """
+        await self._load()
+
+        digest = self._digest(bucket, key)
+        self._forget(digest)
+        await self._run(self._remove_files, [digest])
+
+    async def _load(self):
+        """
+        Rebuilds the index from the cache directory, once
+        """
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load_index())
+
+        await asyncio.shield(self._loading)
+
+    async def _load_index(self):
+        for _, digest, size in sorted(await self._run(self._scan)):
+            self._index[digest] = size
+            self._resident_bytes += size
+
+        await self._evict()
+
+    async def _evict(self):
+        evicted = []
+        while self._resident_bytes > self.max_bytes:
+            digest = next(iter(self._index))
+            self._forget(digest)
+            evicted.append(digest)
+
+        if evicted:
+            await self._run(self._remove_files, evicted)
+
+    def _forget(self, digest):
+        size = self._index.pop(digest, None)
+        if size is not None:
+            self._resident_bytes -= size
+
+    @staticmethod
+    async def _run(function, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, function, *args)
+
+    def _scan(self):
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    if name.startswith(TEMP_PREFIX):
+                        # Leftover of an interrupted write
+                        os.remove(file_path)
+                        continue
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_atime, name, stat.st_size))
+
+        return entries
+
+    def _read_file(self, digest):
+        try:
+            with open(self._file_path(digest), 'rb') as cached_file:
+                stat = os.fstat(cached_file.fileno())
+                buffer = cached_file.read()
+        except FileNotFoundError:
+            return None
+
+        fresh = not self.ttl or time() - stat.st_ctime < self.ttl
+        return buffer, datetime.fromtimestamp(stat.st_mtime, tzutc()), fresh
+
+    def _touch_file(self, digest):
+        file_path = self._file_path(digest)
+        try:
+            stat = os.stat(file_path)
+            # Only updates the change time
+            os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        except FileNotFoundError:
+            pass
+
+    def _write_file(self, digest, data, last_modified):
+        file_path = self._file_path(digest)
+        directory = os.path.dirname(file_path)
+
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = mkstemp(prefix=TEMP_PREFIX, dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+
+            if last_modified is not None:
+                mtime = last_modified.timestamp()
+                os.utime(temp_path, (mtime, mtime))
+
+            os.replace(temp_path, file_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _remove_files(self, digests):
+        for digest in digests:
+            try:
+                os.remove(self._file_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _file_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    @staticmethod
+    def _digest(bucket, key):
+        return sha1('/'.join([bucket, key]).encode('utf-8')).hexdigest()
@@ -0,0 +1,147 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+from collections import deque
+from time import monotonic
+
+from botocore.exceptions import ClientError
+
+# Number of recent latencies the observed percentile is computed over
+LATENCY_SAMPLES = 1000
+
+# Number of latencies recorded between two computations of the observed percentile
+PERCENTILE_REFRESH = 100
+
+# Maximum number of hedges which can be issued in a burst
+MAX_HEDGE_BUDGET = 10
+
+# Share of requests which get hedged at most by default
+DEFAULT_MAX_RATE = 0.05
+
+
+class Hedger(object):
+    """
+    Sends a second identical request when the first one is slow, using whichever answers first
+    Hedges are issued after delay seconds, or after the observed percentile of latencies once enough
+    of them are known, and capped to max_rate of the requests.
+    """
+    def __init__(self, delay, percentile=None, max_rate=DEFAULT_MAX_RATE):
+        """
+        Constructor
+        :param float delay: Seconds before hedging, until enough latencies are observed if percentile is set
+        :param float percentile: Percentile of observed latencies, between 0 and 100, after which to hedge
+        :param float max_rate: Maximum share of requests which get hedged, between 0 and 1
+        """
+        self.delay = delay
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._recorded = 0
+        self._observed_delay = None
+        self._budget = 1.0
+        self._requests = 0
+        self._issued = 0
+        self._won = 0
+
+    @property
+    def current_delay(self):
+        """
+        Seconds after which requests are currently hedged
+        :rtype: float
+        """
+        return self._observed_delay if self._observed_delay is not None else self.delay
+
+    async def run(self, request, measure=None):
+        """
+        Performs a request, hedging it if it is slow
+        S3 error responses are answers like any other, but a request failing without answer, because of
+        a connection error for instance, only fails if the other one fails as well.
+        :param request: Coroutine function performing the request
+        :param Measure measure: Measure of the request, told whether a hedge was issued and won
+        :return: Response of the first request to answer
+        :rtype: dict
+        """
+        self._requests += 1
+        self._budget = min(self._budget + self.max_rate, MAX_HEDGE_BUDGET)
+        started_at = monotonic()
+
+        first = asyncio.ensure_future(request())
+        pending = {first}
+
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.current_delay)
+
+            if not done and self._budget >= 1:
+                self._budget -= 1
+                self._issued += 1
+                pending.add(asyncio.ensure_future(request()))
+                if measure is not None:
+                    measure.hedge = 'issued'
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for request_future in done:
+                    exception = request_future.exception()
+                    if exception is not None and not isinstance(exception, ClientError):
+                        error = error or exception
+                        continue
+
+                    if request_future is not first:
+                        self._won += 1
+                        if measure is not None:
+                            measure.hedge = 'won'
+
+                    self._discard(done - {request_future})
+                    self._record(monotonic() - started_at)
+                    return request_future.result()
+
+            raise error
+        finally:
+            for request_future in pending:
+                request_future.cancel()
+
+    def stats(self):
+        """
+        Returns statistics of hedging
+        :rtype: dict
+        """
+        return dict(
+            requests=self._requests,
+            issued=self._issued,
+            won=self._won,
+            delay=self.current_delay,
+        )
+
+    def _record(self, latency):
+        """
+        Records the latency of a request, refreshing the observed percentile from time to time
+        :param float latency: Seconds the request took
+        """
+        if self.percentile is None:
+            return
+
+        self._latencies.append(latency)
+        self._recorded += 1
+
+        if self._recorded % PERCENTILE_REFRESH == 0:
+            latencies = sorted(self._latencies)
+            rank = int(round(self.percentile / 100.0 * len(latencies))) - 1
+            self._observed_delay = latencies[min(max(rank, 0), len(latencies) - 1)]
+
+    @staticmethod
+    def _discard(request_futures):
+        """
+        Releases responses of requests which completed but lost
+        :param set request_futures: Completed requests
+        """
+        for request_future in request_futures:
+            if request_future.exception() is None:
+                body = request_future.result().get('Body')
+                if body is not None:
+                    body.close()
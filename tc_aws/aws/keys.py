@@ -0,0 +1,115 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from hashlib import sha1
+from os.path import join
+from weakref import WeakKeyDictionary
+
+from thumbor.utils import logger
+
+
+class KeyBuilder(object):
+    """
+    Builds the S3 keys of storage paths, compiled once from configuration
+    """
+    _root_image_name = None
+    _instances = {}
+
+    @staticmethod
+    def __new__(cls, root_path, randomize, root_image_name, auto_webp=False):
+        key = (root_path, randomize, root_image_name, auto_webp)
+
+        if not cls._instances.get(key):
+            cls._instances[key] = super(KeyBuilder, cls).__new__(cls)
+
+        return cls._instances[key]
+
+    def __init__(self, root_path, randomize, root_image_name, auto_webp=False):
+        """
+        Constructor
+        :param string root_path: Prefix of all keys
+        :param bool randomize: Whether keys start with a digest, spreading them across S3 partitions
+        :param string root_image_name: Name of images whose path ends with a slash
+        :param bool auto_webp: Whether WebP variants are stored for requests accepting them
+        """
+        if self._root_image_name is None:
+            self.root_path = root_path or ''
+            self.randomize = bool(randomize)
+            self.auto_webp = bool(auto_webp)
+            self._root_image_name = root_image_name or ''
+
+    @classmethod
+    def from_config(cls, config, prefix):
+        """
+        Returns the key builder of a component, compiled once per configuration
+        :param Config config: Thumbor's configuration
+        :param string prefix: Component's configuration prefix, such as TC_AWS_STORAGE
+        :rtype: KeyBuilder
+        """
+        builders = _builders.get(config)
+        if builders is None:
+            builders = _builders[config] = {}
+
+        builder = builders.get(prefix)
+        if builder is None:
+            builder = builders[prefix] = cls(
+                getattr(config, '%s_ROOT_PATH' % prefix),
+                config.TC_AWS_RANDOMIZE_KEYS,
+                config.TC_AWS_ROOT_IMAGE_NAME,
+                config.AUTO_WEBP,
+            )
+
+        return builder
+
+    def build(self, path, webp=False):
+        """
+        Builds the key of a path
+        :param string path: Path to build the key of
+        :param bool webp: Whether the key is the one of the WebP variant
+        :return: Clean S3 key
+        :rtype: string
+        """
+        segments = [path.lstrip('/')]
+
+        if self.root_path:
+            segments.insert(0, self.root_path)
+
+        if webp:
+            segments.append('webp')
+
+        if self.randomize:
+            segments.insert(0, sha1('.'.join(segments).encode('utf-8')).hexdigest())
+
+        key = join(*segments).lstrip('/') if len(segments) > 1 else segments[0]
+        if key.endswith('/'):
+            key += self._root_image_name
+
+        return clean_key(key)
+
+
+# Builders by configuration and component, configurations are not reloaded
+_builders = WeakKeyDictionary()
+
+
+def clean_key(path):
+    """
+    Removes duplicate and leading slashes from an S3 key
+    :param string path: Key to clean
+    :return: Clean key
+    :rtype: string
+    """
+    if '//' not in path and not path.startswith('/'):
+        return path
+
+    key = path
+    while '//' in key:
+        key = key.replace('//', '/')
+
+    if key.startswith('/'):
+        key = key[1:]
+
+    logger.debug('Cleansed key: %r -> %r', path, key)
+    return key
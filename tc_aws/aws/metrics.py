@@ -0,0 +1,108 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+from time import monotonic
+
+from botocore.exceptions import ClientError
+
+
+class Measure(object):
+    """
+    Times and counts an S3 operation through thumbor's metrics
+    Metrics are named <prefix>.<operation>.time for the latency, <prefix>.<operation>.<status> for
+    the count per status class, <prefix>.<operation>.retries and <prefix>.bytes_in / bytes_out.
+    Operations refused by an open circuit are counted as <prefix>.<operation>.circuit_open, and hedged
+    requests as <prefix>.<operation>.hedge.issued and <prefix>.<operation>.hedge.won.
+    """
+    def __init__(self, metrics, prefix, operation, breaker=None):
+        """
+        Constructor
+        :param BaseMetrics metrics: Thumbor's metrics, nothing is recorded if None
+        :param string prefix: Metric name prefix, such as s3.loader.my-bucket
+        :param string operation: Name of the operation, such as get
+        :param CircuitBreaker breaker: Circuit breaker the operation goes through, if any
+        """
+        self.metrics = metrics
+        self.prefix = prefix
+        self.operation = operation
+        self.breaker = breaker
+        self.response = None
+        self.failed = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.hedge = None
+        self._started_at = None
+        self._probe = None
+
+    def __enter__(self):
+        if self.breaker is not None:
+            try:
+                self._probe = self.breaker.before_call()
+            except Exception:
+                if self.metrics is not None:
+                    self.metrics.incr('%s.%s.circuit_open' % (self.prefix, self.operation))
+                raise
+
+        self._started_at = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if isinstance(exc_val, ClientError):
+            self.response = exc_val.response
+        elif exc_val is not None:
+            self.failed = True
+
+        if self.breaker is not None:
+            if isinstance(exc_val, asyncio.CancelledError):
+                self.breaker.cancelled(self._probe)
+            else:
+                self.breaker.record(self.status in ('5xx', 'error'), monotonic() - self._started_at, self._probe)
+
+        if self.metrics is not None:
+            self._record()
+
+        return False
+
+    def _record(self):
+        name = '%s.%s' % (self.prefix, self.operation)
+
+        self.metrics.timing('%s.time' % name, (monotonic() - self._started_at) * 1000)
+        self.metrics.incr('%s.%s' % (name, self.status))
+
+        retries = (self.response or {}).get('ResponseMetadata', {}).get('RetryAttempts')
+        if retries:
+            self.metrics.incr('%s.retries' % name, retries)
+
+        if self.hedge is not None:
+            self.metrics.incr('%s.hedge.issued' % name)
+            if self.hedge == 'won':
+                self.metrics.incr('%s.hedge.won' % name)
+
+        if self.bytes_in:
+            self.metrics.incr('%s.bytes_in' % self.prefix, self.bytes_in)
+
+        if self.bytes_out:
+            self.metrics.incr('%s.bytes_out' % self.prefix, self.bytes_out)
+
+    @property
+    def status(self):
+        """
+        Status class of the response, error if there was none because the operation failed
+        and ok for operations without response such as signing an URL
+        :rtype: string
+        """
+        if self.failed:
+            return 'error'
+
+        if self.response is None:
+            return 'ok'
+
+        status_code = self.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        if status_code is None:
+            return 'ok'
+
+        return '%dxx' % (status_code // 100)
@@ -0,0 +1,206 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+from time import monotonic
+
+from botocore.exceptions import ClientError
+
+from .retry import is_retryable
+
+# Weight of the latest latency in the moving average of a replica's latencies
+LATENCY_SMOOTHING = 0.2
+
+# Seconds a replica which failed is only tried after healthy ones
+FAILURE_COOLDOWN = 10
+
+# Share of reads which first try a replica not read from yet, so that its latency gets measured
+PROBE_RATE = 0.01
+
+
+class ReplicaSet(object):
+    """
+    Replicas of the same objects, read from the preferred one and failing over to the others
+    Healthy replicas are preferred to ones which failed recently, then the fastest ones according to
+    a moving average of their latencies. Replicas not read from yet come next in their configured order,
+    the nearest one being expected first. So that they get measured, PROBE_RATE of the reads first try
+    the healthy replica not read from yet which was tried the least, rather than the preferred one.
+    """
+    _latencies = None
+    _instances = {}
+
+    @staticmethod
+    def __new__(cls, targets):
+        key = tuple(targets)
+
+        if not cls._instances.get(key):
+            cls._instances[key] = super(ReplicaSet, cls).__new__(cls)
+
+        return cls._instances[key]
+
+    def __init__(self, targets):
+        """
+        Constructor
+        :param list targets: Bucket, region and endpoint of each replica, nearest first
+        """
+        if self._latencies is None:
+            self.targets = list(targets)
+            self._latencies = [None] * len(self.targets)
+            self._failed_at = [None] * len(self.targets)
+            self._reads = [0] * len(self.targets)
+            self._failures = [0] * len(self.targets)
+            self._probe_budget = 0.0
+
+    def ordered(self):
+        """
+        Returns the indexes of the replicas, preferred first
+        :rtype: list
+        """
+        def preference(index):
+            latency = self._latencies[index]
+            return not self.is_healthy(index), latency is None, latency or 0, index
+
+        return sorted(range(len(self.targets)), key=preference)
+
+    def is_healthy(self, index):
+        """
+        Tells whether a replica did not fail recently
+        :param int index: Index of the replica
+        :rtype: bool
+        """
+        failed_at = self._failed_at[index]
+        return failed_at is None or monotonic() - failed_at >= FAILURE_COOLDOWN
+
+    async def fetch(self, buckets, fetch, race=False):
+        """
+        Reads from the preferred replica, failing over to the next ones on error
+        In race mode, all replicas are read from at once and the first successful read is used.
+        :param list buckets: Bucket of each replica
+        :param fetch: Coroutine function reading from a Bucket
+        :param bool race: Read from all replicas at once
+        :return: Result of the first successful read
+        """
+        order = self.ordered()
+        if race:
+            return await self._race(buckets, fetch, order)
+
+        order = self._probe(order)
+
+        errors = []
+        for index in order:
+            try:
+                return await self._fetch_one(buckets, fetch, index)
+            except Exception as err:
+                errors.append(err)
+
+        raise self._select_error(errors)
+
+    def stats(self):
+        """
+        Returns statistics of each replica
+        :rtype: list
+        """
+        return [
+            dict(
+                target='/'.join(str(part) for part in target),
+                latency=self._latencies[index],
+                healthy=self.is_healthy(index),
+                reads=self._reads[index],
+                failures=self._failures[index],
+            )
+            for index, target in enumerate(self.targets)
+        ]
+
+    def _probe(self, order):
+        """
+        Moves a healthy replica not read from yet first, for PROBE_RATE of the reads
+        Replicas answering that objects are missing never get a latency, the one tried the least is probed.
+        :param list order: Indexes of the replicas, preferred first
+        :return: Indexes of the replicas in the order they are tried
+        :rtype: list
+        """
+        self._probe_budget = min(self._probe_budget + PROBE_RATE, 1.0)
+
+        unmeasured = [
+            index for index in order[1:]
+            if self._latencies[index] is None and self.is_healthy(index)
+        ]
+        if not unmeasured or self._probe_budget < 1:
+            return order
+
+        self._probe_budget -= 1
+        probed = min(unmeasured, key=lambda index: self._reads[index])
+        return [probed] + [index for index in order if index != probed]
+
+    async def _race(self, buckets, fetch, order):
+        """
+        Reads from all replicas at once, cancelling the other reads once one succeeds
+        :param list buckets: Bucket of each replica
+        :param fetch: Coroutine function reading from a Bucket
+        :param list order: Indexes of the replicas, preferred first
+        :return: Result of the first successful read
+        """
+        pending = {asyncio.ensure_future(self._fetch_one(buckets, fetch, index)): index for index in order}
+        errors = {}
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for read in done:
+                    index = pending.pop(read)
+                    if read.exception() is None:
+                        return read.result()
+
+                    errors[index] = read.exception()
+        finally:
+            for read in pending:
+                read.cancel()
+
+        raise self._select_error([errors[index] for index in order])
+
+    async def _fetch_one(self, buckets, fetch, index):
+        """
+        Reads from a replica, recording its latency or failure
+        :param list buckets: Bucket of each replica
+        :param fetch: Coroutine function reading from a Bucket
+        :param int index: Index of the replica
+        :return: Result of the read
+        """
+        started_at = monotonic()
+        self._reads[index] += 1
+
+        try:
+            result = await fetch(buckets[index])
+        except Exception as err:
+            # Missing objects, not replicated yet for instance, don't make a replica unhealthy
+            if not isinstance(err, ClientError) or is_retryable(err):
+                self._failures[index] += 1
+                self._failed_at[index] = monotonic()
+            raise
+
+        latency = monotonic() - started_at
+        previous = self._latencies[index]
+        self._latencies[index] = latency if previous is None else \
+            previous + LATENCY_SMOOTHING * (latency - previous)
+        self._failed_at[index] = None
+
+        return result
+
+    @staticmethod
+    def _select_error(errors):
+        """
+        Returns the error to raise when all replicas failed
+        Objects are only reported missing if all replicas answered so.
+        :param list errors: Errors of the replicas, preferred first
+        :rtype: Exception
+        """
+        for err in errors:
+            if not isinstance(err, ClientError) or \
+                    err.response.get('ResponseMetadata', {}).get('HTTPStatusCode') != 404:
+                return err
+
+        return errors[0]
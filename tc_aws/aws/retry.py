@@ -0,0 +1,43 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+from random import uniform
+
+import aiohttp
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+# Error codes S3 answers when requests are sent too fast
+THROTTLING_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'RequestTimeout')
+
+# Errors of requests which did not get a response
+TRANSIENT_ERRORS = (ConnectionError, HTTPClientError, aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+
+def is_retryable(err):
+    """
+    Tells whether a failed request may succeed if sent again
+    :param Exception err: Error raised by the request
+    :rtype: bool
+    """
+    if isinstance(err, ClientError):
+        status_code = err.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return status_code >= 500 or status_code == 429 or \
+            err.response.get('Error', {}).get('Code') in THROTTLING_CODES
+
+    return isinstance(err, TRANSIENT_ERRORS)
+
+
+def decorrelated_jitter(base, cap, previous):
+    """
+    Returns the delay before the next attempt, randomly chosen between base and three times the previous delay
+    Unlike exponential backoff, delays of concurrent callers don't synchronize, spreading retries over time.
+    :param float base: Minimum delay in seconds, also the delay before the first attempt
+    :param float cap: Maximum delay in seconds
+    :param float previous: Previous delay in seconds
+    :rtype: float
+    """
+    return min(cap, uniform(base, previous * 3))
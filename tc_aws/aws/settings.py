@@ -0,0 +1,60 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+
+def get_setting(config, prefix, name, default=None):
+    """
+    Retrieves a setting which can be overridden per component
+    E.g. TC_AWS_LOADER_READ_TIMEOUT takes precedence over TC_AWS_READ_TIMEOUT for the loader.
+    :param Config config: Thumbor's configuration
+    :param string prefix: Component's configuration prefix, such as TC_AWS_LOADER
+    :param string name: Setting name, without prefix
+    :param default: Default value if neither is set
+    :return: Resolved setting value
+    """
+    value = config.get('%s_%s' % (prefix, name))
+    if value is None:
+        value = config.get('TC_AWS_%s' % name)
+
+    return default if value is None else value
+
+
+def get_bucket_options(config, prefix):
+    """
+    Builds the options of a component's Bucket
+    :param Config config: Thumbor's configuration
+    :param string prefix: Component's configuration prefix, such as TC_AWS_LOADER
+    :return: Keyword arguments for Bucket
+    :rtype: dict
+    """
+    return dict(
+        max_retry=get_setting(config, prefix, 'MAX_RETRY'),
+        max_pool_connections=get_setting(config, prefix, 'MAX_POOL_CONNECTIONS'),
+        connect_timeout=get_setting(config, prefix, 'CONNECT_TIMEOUT'),
+        read_timeout=get_setting(config, prefix, 'READ_TIMEOUT'),
+        keepalive_timeout=get_setting(config, prefix, 'KEEPALIVE_TIMEOUT'),
+        negative_cache_ttl=config.get('TC_AWS_NEGATIVE_CACHE_TTL'),
+        negative_cache_size=config.get('TC_AWS_NEGATIVE_CACHE_SIZE'),
+        head_cache_ttl=config.get('TC_AWS_HEAD_CACHE_TTL'),
+        head_cache_size=config.get('TC_AWS_HEAD_CACHE_SIZE'),
+        retry_base_delay=config.get('TC_AWS_RETRY_BASE_DELAY'),
+        retry_max_delay=config.get('TC_AWS_RETRY_MAX_DELAY'),
+        circuit_breaker_error_rate=config.get('TC_AWS_CIRCUIT_BREAKER_ERROR_RATE'),
+        circuit_breaker_slow_call=config.get('TC_AWS_CIRCUIT_BREAKER_SLOW_CALL'),
+        circuit_breaker_window=config.get('TC_AWS_CIRCUIT_BREAKER_WINDOW'),
+        circuit_breaker_min_calls=config.get('TC_AWS_CIRCUIT_BREAKER_MIN_CALLS'),
+        circuit_breaker_open_seconds=config.get('TC_AWS_CIRCUIT_BREAKER_OPEN_SECONDS'),
+        hedge_delay=config.get('TC_AWS_HEDGE_DELAY'),
+        hedge_percentile=config.get('TC_AWS_HEDGE_PERCENTILE'),
+        hedge_max_rate=config.get('TC_AWS_HEDGE_MAX_RATE'),
+        get_deadline=get_setting(config, prefix, 'GET_DEADLINE'),
+        put_deadline=get_setting(config, prefix, 'PUT_DEADLINE'),
+        head_deadline=get_setting(config, prefix, 'HEAD_DEADLINE'),
+        presign_deadline=get_setting(config, prefix, 'PRESIGN_DEADLINE'),
+        presign_cache_window=config.get('TC_AWS_PRESIGN_CACHE_WINDOW'),
+        presign_cache_size=config.get('TC_AWS_PRESIGN_CACHE_SIZE'),
+        component=prefix[len('TC_AWS_'):].lower(),
+    )
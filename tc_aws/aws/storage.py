@@ -4,12 +4,13 @@
 # Use of this source code is governed by the MIT license that can be
 # found in the LICENSE file.
 
-from os.path import join
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil.tz import tzutc
-from hashlib import sha1
 
 from .bucket import Bucket
+from .disk_cache import DiskCache
+from .keys import KeyBuilder
+from .settings import get_bucket_options
 
 class AwsStorage():
     """
@@ -32,7 +33,22 @@ class AwsStorage():
         :rtype: Bucket
         """
         return Bucket(self._get_config('BUCKET'), self.context.config.get('TC_AWS_REGION'),
-                      self.context.config.get('TC_AWS_ENDPOINT'))
+                      self.context.config.get('TC_AWS_ENDPOINT'), metrics=self.context.metrics,
+                      **get_bucket_options(self.context.config, self.config_prefix))
+
+    @property
+    def disk_cache(self):
+        """
+        Instantiates local disk cache based on configuration
+        :return: The disk cache, None if disabled
+        :rtype: DiskCache
+        """
+        path = self.context.config.get('TC_AWS_DISK_CACHE_PATH')
+        if not path:
+            return None
+
+        return DiskCache(path, self.context.config.get('TC_AWS_DISK_CACHE_MAX_BYTES'),
+                         self.context.config.get('TC_AWS_DISK_CACHE_TTL'))
 
     def __init__(self, context, config_prefix):
         """
@@ -42,15 +58,17 @@ class AwsStorage():
         """
         self.config_prefix = config_prefix
         self.context = context
+        self._keys = {}
 
-    async def get(self, path):
+    async def get(self, path, if_modified_since=None):
         """
         Gets data at path
         :param string path: Path for data
+        :param datetime if_modified_since: Only transfer data modified after this date
         """
         file_abspath = self._normalize_path(path)
 
-        return await self.storage.get(file_abspath)
+        return await self.storage.get(file_abspath, if_modified_since=if_modified_since)
 
     def is_expired(self, key):
         """
@@ -73,6 +91,22 @@ class AwsStorage():
             #If our key is bad just say we're expired
             return True
 
+    def _get_expiration_limit(self):
+        """
+        Computes the date objects must have been modified after to still be fresh,
+        so that expired objects are not downloaded at all
+        :return: The limit, None if expiration is only checked after download
+        :rtype: datetime
+        """
+        if not self.context.config.get('TC_AWS_CONDITIONAL_EXPIRATION_CHECK', False):
+            return None
+
+        expire_in_seconds = self.storage_expiration_seconds
+        if expire_in_seconds is None or expire_in_seconds == 0:
+            return None
+
+        return datetime.now(tzutc()) - timedelta(seconds=expire_in_seconds)
+
     async def _put_object(self, object_data, path, metadata=None):
         """
         Stores data at given path
@@ -88,6 +122,9 @@ class AwsStorage():
             metadata=metadata,
             reduced_redundancy=self.context.config.get('TC_AWS_STORAGE_RRS', False),
             encrypt_key=self.context.config.get('TC_AWS_STORAGE_SSE', False),
+            multipart_threshold=self.context.config.get('TC_AWS_MULTIPART_UPLOAD_THRESHOLD', 0),
+            multipart_part_size=self.context.config.get('TC_AWS_MULTIPART_UPLOAD_PART_SIZE'),
+            multipart_concurrency=self.context.config.get('TC_AWS_MULTIPART_UPLOAD_CONCURRENCY'),
         )
 
     def _get_config(self, config_key):
@@ -102,31 +139,16 @@ class AwsStorage():
     def _normalize_path(self, path):
         """
         Adapts path based on configuration (root_path for instance)
+        Keys are memoized for the lifetime of the storage, that is a request.
         :param string path: Path to adapt
         :return: Adapted path
         :rtype: string
         """
-        path = path.lstrip('/')  # Remove leading '/'
-        path_segments = [path]
-
-        root_path = self._get_config('ROOT_PATH')
-        if root_path and root_path is not '':
-            path_segments.insert(0, root_path)
-
-        if self.is_auto_webp:
-            path_segments.append("webp")
-
-        if self._should_randomize_key():
-            path_segments.insert(0, self._generate_digest(path_segments))
-
-        normalized_path = join(path_segments[0], *path_segments[1:]).lstrip('/') if len(path_segments) > 1 else path_segments[0]
-        if normalized_path.endswith('/'):
-            normalized_path += self.context.config.TC_AWS_ROOT_IMAGE_NAME
-
-        return normalized_path
+        key = self._keys.get(path)
 
-    def _should_randomize_key(self):
-        return self.context.config.TC_AWS_RANDOMIZE_KEYS
+        if key is None:
+            builder = KeyBuilder.from_config(self.context.config, self.config_prefix)
+            webp = builder.auto_webp and hasattr(self.context, 'request') and self.context.request.accepts_webp
+            key = self._keys[path] = builder.build(path, webp)
 
-    def _generate_digest(self, segments):
-        return sha1(".".join(segments).encode('utf-8')).hexdigest()
+        return key
@@ -0,0 +1,185 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+import atexit
+from time import monotonic
+
+from thumbor.utils import logger
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEW = 'drop_new'
+
+
+class WriteBehindQueue(object):
+    """
+    Bounded queue of writes performed in background by a pool of workers
+    """
+    _pending = None
+    _instances = {}
+
+    @staticmethod
+    def __new__(cls, max_size, workers, overflow=OVERFLOW_BLOCK, flush_timeout=None):
+        key = (max_size, workers, overflow, flush_timeout)
+
+        if not cls._instances.get(key):
+            cls._instances[key] = super(WriteBehindQueue, cls).__new__(cls)
+
+        return cls._instances[key]
+
+    def __init__(self, max_size, workers, overflow=OVERFLOW_BLOCK, flush_timeout=None):
+        """
+        Constructor
+        :param int max_size: Maximum number of queued writes
+        :param int workers: Number of background workers
+        :param string overflow: What to do when the queue is full: block, drop_oldest or drop_new
+        :param int flush_timeout: Seconds allowed to flush the queue on exit, unlimited if None
+        """
+        if self._pending is None:
+            if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEW):
+                raise RuntimeError("Invalid write-behind overflow policy: %s" % overflow)
+
+            self.max_size = max_size
+            self.workers = workers
+            self.overflow = overflow
+            self.flush_timeout = flush_timeout
+            self._pending = {}
+            self._queue = None
+            self._loop = None
+            self._tasks = []
+            self._writing = {}
+            self._written = 0
+            self._failures = 0
+            self._dropped = 0
+            self._lag = 0.0
+
+    async def put(self, key, data, write):
+        """
+        Queues a write
+        :param tuple key: Bucket and key being written
+        :param bytes data: Data being written, served by get_pending until written
+        :param callable write: Coroutine function performing the write
+        :return: Whether the write was queued
+        :rtype: bool
+        """
+        self._start()
+
+        if self._queue.full():
+            if self.overflow == OVERFLOW_DROP_NEW:
+                self._dropped += 1
+                logger.warning('[WRITE BEHIND] Queue is full, dropping write of %s', key)
+                return False
+
+            if self.overflow == OVERFLOW_DROP_OLDEST:
+                oldest = self._queue.get_nowait()
+                self._queue.task_done()
+                self._forget(oldest)
+                self._dropped += 1
+                logger.warning('[WRITE BEHIND] Queue is full, dropping write of %s', oldest[0])
+
+        item = (key, data, write, monotonic())
+        self._pending[key] = item
+        await self._queue.put(item)
+
+        return True
+
+    def get_pending(self, key):
+        """
+        Returns data queued for writing at key
+        :param tuple key: Bucket and key
+        :return: The data, None if no write is pending
+        :rtype: bytes
+        """
+        item = self._pending.get(key)
+        return item[1] if item is not None else None
+
+    async def flush(self):
+        """
+        Waits for all queued writes to be performed
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """
+        Flushes the queue and stops the workers
+        """
+        try:
+            await asyncio.wait_for(self.flush(), self.flush_timeout)
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+            self._tasks = []
+            self._queue = None
+            self._loop = None
+            atexit.unregister(self._close_at_exit)
+
+    def stats(self):
+        """
+        Returns queue statistics
+        :return: Queue depth, lag in seconds of the last write, written, failed and dropped writes
+        :rtype: dict
+        """
+        return dict(
+            depth=self._queue.qsize() if self._queue is not None else 0,
+            lag=self._lag,
+            written=self._written,
+            failures=self._failures,
+            dropped=self._dropped,
+        )
+
+    def _start(self):
+        if self._queue is not None:
+            return
+
+        self._loop = asyncio.get_event_loop()
+        self._queue = asyncio.Queue(self.max_size)
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        atexit.register(self._close_at_exit)
+
+    async def _work(self):
+        while True:
+            item = await self._queue.get()
+            key, _, write, queued_at = item
+
+            # Writes to the same key are performed in the order they were queued
+            previous = self._writing.get(key)
+            done = self._writing[key] = asyncio.Event()
+
+            try:
+                if previous is not None:
+                    await previous.wait()
+
+                await write()
+                self._written += 1
+            except Exception as err:
+                self._failures += 1
+                logger.exception('[WRITE BEHIND] Unable to store %s: %s', key, err)
+            finally:
+                done.set()
+                if self._writing.get(key) is done:
+                    del self._writing[key]
+
+                self._lag = monotonic() - queued_at
+                self._forget(item)
+                self._queue.task_done()
+
+    def _forget(self, item):
+        if self._pending.get(item[0]) is item:
+            del self._pending[item[0]]
+
+    def _close_at_exit(self):
+        # Thumbor stops its loop on shutdown without closing it, queued writes can still be sent
+        loop = self._loop
+        if loop is None or loop.is_closed() or loop.is_running():
+            return
+
+        try:
+            loop.run_until_complete(self.close())
+        except Exception as err:
+            logger.error('[WRITE BEHIND] Unable to flush %d queued writes: %s', len(self._pending), err)
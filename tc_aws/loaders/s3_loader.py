@@ -3,14 +3,24 @@
 # Copyright (c) 2015, thumbor-community
 # Use of this source code is governed by the MIT license that can be
 # found in the LICENSE file.
+import asyncio
+from functools import partial
 from urllib.parse import unquote
 
 import thumbor.loaders.http_loader as http_loader
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from thumbor.utils import logger
 from thumbor.loaders import LoaderResult
 
+from ..aws.body import read_body
 from ..aws.bucket import Bucket
+from ..aws.cache import LRUCache
+from ..aws.deadline import DeadlineExceededError
+from ..aws.disk_cache import DiskCache
+from ..aws.replicas import ReplicaSet
+from ..aws.settings import get_bucket_options
+
+_inflight_fetches = {}
 
 
 async def load(context, url):
@@ -29,17 +39,16 @@ async def load(context, url):
                               error=LoaderResult.ERROR_NOT_FOUND)
         return result
 
-    loader = Bucket(
-        bucket,
-        context.config.get('TC_AWS_REGION'),
-        context.config.get('TC_AWS_ENDPOINT'),
-        context.config.get('TC_AWS_MAX_RETRY')
-    )
+    options = get_bucket_options(context.config, 'TC_AWS_LOADER')
+    loaders = [
+        Bucket(*target, metrics=context.metrics, **options)
+        for target in _get_targets(context, bucket)
+    ]
 
     result = LoaderResult()
 
     try:
-        file_key = await loader.get(key)
+        buffer, metadata = await _get_object(context, bucket, key, loaders)
     except ClientError as err:
         logger.error(
             "ERROR retrieving image from S3 {0}: {1}".
@@ -61,17 +70,265 @@ async def load(context, url):
 
         result.error = LoaderResult.ERROR_UPSTREAM
         return result
+    except DeadlineExceededError as err:
+        logger.error("ERROR retrieving image from S3 {0}: {1}".format(key, str(err)))
+
+        result.successful = False
+        result.error = LoaderResult.ERROR_TIMEOUT
+        return result
+    except BotoCoreError as err:
+        logger.error("ERROR retrieving image from S3 {0}: {1}".format(key, str(err)))
+
+        result.successful = False
+        result.error = LoaderResult.ERROR_UPSTREAM
+        return result
 
     result.successful = True
-    async with file_key['Body'] as stream:
-        result.buffer = await stream.read()
+    result.buffer = buffer
+    result.metadata.update(metadata)
+
+    return result
 
-    result.metadata.update(
-        size=file_key['ContentLength'],
-        updated_at=file_key['LastModified'],
+
+def get_replica_stats(context, bucket=None):
+    """
+    Returns statistics of the replicas the loader reads from
+    :param Context context: Thumbor's context
+    :param string bucket: Bucket name, TC_AWS_LOADER_BUCKET if None
+    :return: Statistics of each replica, None if no replica is configured
+    :rtype: list
+    """
+    targets = _get_targets(context, bucket or context.config.get('TC_AWS_LOADER_BUCKET'))
+    return ReplicaSet(targets).stats() if len(targets) > 1 else None
+
+
+def get_cache_stats(context):
+    """
+    Returns statistics of the loader's memory cache
+    :param Context context: Thumbor's context
+    :return: Cache statistics, None if the cache is disabled
+    :rtype: dict
+    """
+    cache = _get_memory_cache(context)
+    return cache.stats() if cache is not None else None
+
+
+async def _get_object(context, bucket, key, loaders):
+    """
+    Retrieves object content and metadata, from memory cache when possible
+    :param Context context: Thumbor's context
+    :param string bucket: Bucket name
+    :param string key: Key of the object
+    :param list loaders: Buckets to download from, the loader bucket then its replicas
+    :return: A tuple with the object's content and its metadata
+    :rtype: tuple
+    """
+    cache = _get_memory_cache(context)
+    if cache is not None:
+        cached = cache.get((bucket, key))
+        if cached is not None:
+            return cached
+
+    if context.config.get('TC_AWS_LOADER_COALESCE_REQUESTS', default=True):
+        return await _coalesced_fetch(context, bucket, key, loaders)
+
+    return await _fetch_object(context, bucket, key, loaders)
+
+
+def _get_memory_cache(context):
+    """
+    Returns the loader's memory cache based on configuration
+    :param Context context: Thumbor's context
+    :return: The cache, None if disabled
+    :rtype: LRUCache
+    """
+    max_bytes = context.config.get('TC_AWS_LOADER_CACHE_MAX_BYTES', default=0)
+    if not max_bytes:
+        return None
+
+    return LRUCache('loader', max_bytes, context.config.get('TC_AWS_LOADER_CACHE_TTL', default=0))
+
+
+def _get_disk_cache(context):
+    """
+    Returns the local disk cache based on configuration
+    :param Context context: Thumbor's context
+    :return: The cache, None if disabled
+    :rtype: DiskCache
+    """
+    path = context.config.get('TC_AWS_DISK_CACHE_PATH', default=None)
+    if not path:
+        return None
+
+    return DiskCache(path, context.config.get('TC_AWS_DISK_CACHE_MAX_BYTES'),
+                     context.config.get('TC_AWS_DISK_CACHE_TTL'))
+
+
+async def _fetch_object(context, bucket, key, loaders):
+    """
+    Downloads object content and metadata, from local disk cache when possible
+    :param Context context: Thumbor's context
+    :param string bucket: Bucket name
+    :param string key: Key of the object
+    :param list loaders: Buckets to download from, the loader bucket then its replicas
+    :return: A tuple with the object's content and its metadata
+    :rtype: tuple
+    """
+    disk_cache = _get_disk_cache(context)
+    cached = await disk_cache.get(bucket, key) if disk_cache is not None else None
+
+    if cached is not None and not cached[2]:
+        cached = await _revalidate(disk_cache, bucket, key, loaders[0], cached)
+
+    if cached is not None:
+        buffer, last_modified, _ = cached
+    else:
+        if len(loaders) > 1:
+            replicas = ReplicaSet(_get_targets(context, bucket))
+            buffer, last_modified = await replicas.fetch(
+                loaders,
+                partial(_download, context, key),
+                race=context.config.get('TC_AWS_LOADER_REPLICAS_RACE', default=False),
+            )
+        else:
+            buffer, last_modified = await _download(context, key, loaders[0])
+
+        if disk_cache is not None:
+            await disk_cache.put(bucket, key, buffer, last_modified)
+
+    metadata = dict(
+        size=len(buffer),
+        updated_at=last_modified,
     )
 
-    return result
+    memory_cache = _get_memory_cache(context)
+    if memory_cache is not None:
+        memory_cache.set((bucket, key), (buffer, metadata), len(buffer))
+
+    return buffer, metadata
+
+
+async def _revalidate(disk_cache, bucket, key, loader, cached):
+    """
+    Checks that a stale disk cache entry still matches S3, with a conditional request
+    The entry is served as is if S3 cannot be reached.
+    :param DiskCache disk_cache: The disk cache
+    :param string bucket: Bucket name
+    :param string key: Key of the object
+    :param Bucket loader: Bucket to check
+    :param tuple cached: The stale entry
+    :return: The entry, or the object as now stored in S3
+    :rtype: tuple
+    """
+    buffer, last_modified, _ = cached
+
+    try:
+        file_key = await loader.get(key, if_modified_since=last_modified)
+        buffer = await read_body(file_key)
+    except ClientError as err:
+        status_code = err.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+
+        if status_code == 304:
+            await disk_cache.refresh(bucket, key)
+        elif status_code == 404:
+            await disk_cache.delete(bucket, key)
+            raise
+        else:
+            logger.warning('Unable to revalidate cached %s, serving it: %s', key, err)
+
+        return cached
+    except BotoCoreError as err:
+        logger.warning('Unable to revalidate cached %s, serving it: %s', key, err)
+        return cached
+
+    last_modified = file_key.get('LastModified')
+    await disk_cache.put(bucket, key, buffer, last_modified)
+
+    return buffer, last_modified, True
+
+
+async def _download(context, key, loader):
+    """
+    Downloads object content from a bucket
+    :param Context context: Thumbor's context
+    :param string key: Key of the object
+    :param Bucket loader: Bucket to download from
+    :return: A tuple with the object's content and its last modification date
+    :rtype: tuple
+    """
+    ranged_threshold = context.config.get('TC_AWS_LOADER_RANGED_GET_THRESHOLD', default=0)
+    if ranged_threshold:
+        file_key = await loader.get_ranged(
+            key,
+            ranged_threshold,
+            context.config.get('TC_AWS_LOADER_RANGED_GET_PART_SIZE'),
+            context.config.get('TC_AWS_LOADER_RANGED_GET_CONCURRENCY'),
+        )
+    else:
+        file_key = await loader.get(key)
+
+    buffer = await read_body(file_key)
+
+    return buffer, file_key.get('LastModified')
+
+
+async def _coalesced_fetch(context, bucket, key, loaders):
+    """
+    Downloads object, sharing one in-flight request between concurrent callers
+    Errors are raised to every caller waiting on the same object.
+    :param Context context: Thumbor's context
+    :param string bucket: Bucket name
+    :param string key: Key of the object
+    :param list loaders: Buckets to download from, the loader bucket then its replicas
+    :return: A tuple with the object's content and its metadata
+    :rtype: tuple
+    """
+    flight_key = (bucket, key)
+    flight = _inflight_fetches.get(flight_key)
+
+    if flight is None:
+        flight = asyncio.ensure_future(_fetch_object(context, bucket, key, loaders))
+        _inflight_fetches[flight_key] = flight
+        flight.add_done_callback(partial(_end_flight, flight_key))
+
+    # A cancelled caller must not cancel the download for the other ones
+    return await asyncio.shield(flight)
+
+
+def _end_flight(flight_key, flight):
+    """
+    Forgets a finished in-flight download
+    :param tuple flight_key: Bucket and key of the download
+    :param Future flight: The finished download
+    """
+    if _inflight_fetches.get(flight_key) is flight:
+        del _inflight_fetches[flight_key]
+
+    if not flight.cancelled():
+        # Waiters get the exception themselves, avoid 'never retrieved' warnings
+        flight.exception()
+
+
+def _get_targets(context, bucket):
+    """
+    Returns the buckets objects of a bucket can be loaded from, the bucket itself then its replicas
+    :param Context context: Thumbor's context
+    :param string bucket: Bucket name
+    :return: Bucket, region and endpoint of each target
+    :rtype: list
+    """
+    region = context.config.get('TC_AWS_REGION')
+    endpoint = context.config.get('TC_AWS_ENDPOINT')
+    targets = [(bucket, region, endpoint)]
+
+    for replica in context.config.get('TC_AWS_LOADER_REPLICAS', default=None) or []:
+        targets.append((
+            replica.get('bucket', bucket),
+            replica.get('region', region),
+            replica.get('endpoint', endpoint),
+        ))
+
+    return targets
 
 
 def _get_bucket_and_key(context, url):
@@ -3,9 +3,12 @@
 # Copyright (c) 2015-2016, thumbor-community
 # Use of this source code is governed by the MIT license that can be
 # found in the LICENSE file.
+from urllib.parse import quote
+
 from botocore.exceptions import BotoCoreError, ClientError
 from thumbor.result_storages import BaseStorage, ResultStorageResult
 
+from ..aws.body import read_body
 from ..aws.storage import AwsStorage
 
 from thumbor.utils import logger
@@ -50,18 +53,32 @@ class Storage(AwsStorage, BaseStorage):
         if path is None:
             path = self.context.request.url
 
+        if self.context.config.get('TC_AWS_RESULT_STORAGE_REDIRECT'):
+            return await self._redirect(path)
+
+        return await self._download(path)
 
+    async def _download(self, path):
+        """
+        Downloads a fresh result
+        :param string path: Path to load data
+        :return: The result, None if missing or expired
+        :rtype: ResultStorageResult
+        """
         try:
-            key = await super(Storage, self).get(path)
+            key = await super(Storage, self).get(path, if_modified_since=self._get_expiration_limit())
         except ClientError:
+            # Includes 304 responses for expired results
+            return None
+        except BotoCoreError:
+            # Open circuit or exceeded deadline included
             return None
 
         if key is None or self.is_expired(key):
             return None
 
         result = ResultStorageResult()
-        async with key['Body'] as stream:
-            result.buffer = await stream.read()
+        result.buffer = await read_body(key)
         result.successful = True
 
         result.metadata = {
@@ -75,3 +92,71 @@ class Storage(AwsStorage, BaseStorage):
         logger.debug(str(result.metadata))
 
         return result
+
+    async def _redirect(self, path):
+        """
+        Redirects the client to a fresh result instead of downloading it
+        Freshness is checked with a HEAD request. The returned result is empty, thumbor sending it
+        with the redirect status and location set here. Results smaller than
+        TC_AWS_RESULT_STORAGE_REDIRECT_MIN_BYTES, or whose URL could not be signed, are downloaded.
+        :param string path: Path to load data
+        :return: The result, None if missing or expired
+        :rtype: ResultStorageResult
+        """
+        handler = getattr(self.context, 'request_handler', None)
+        if handler is None:
+            return await self._download(path)
+
+        file_abspath = self._normalize_path(path)
+
+        try:
+            head = await self.storage.head(file_abspath)
+        except (ClientError, BotoCoreError):
+            return None
+
+        if self.is_expired(head):
+            return None
+
+        if head.get('ContentLength', 0) < self.context.config.get('TC_AWS_RESULT_STORAGE_REDIRECT_MIN_BYTES', 0):
+            return await self._download(path)
+
+        try:
+            url, expiry = await self._get_redirect_url(file_abspath)
+        except BotoCoreError as err:
+            logger.warning('Unable to sign result URL, serving it instead: %s', err)
+            return await self._download(path)
+
+        if expiry is not None:
+            # Clients and CDNs must not keep the redirect once the URL has expired
+            max_age = self.context.request.max_age
+            if max_age is None:
+                max_age = self.context.config.MAX_AGE
+            self.context.request.max_age = min(max_age, expiry)
+
+        handler.set_status(302)
+        handler.set_header('Location', url)
+
+        result = ResultStorageResult()
+        result.buffer = b''
+        result.successful = True
+        result.metadata = {
+            "LastModified": head.get('LastModified'),
+            "ContentType": head.get('ContentType'),
+        }
+
+        return result
+
+    async def _get_redirect_url(self, file_abspath):
+        """
+        Builds the URL clients are redirected to
+        :param string file_abspath: Key of the result
+        :return: URL under TC_AWS_RESULT_STORAGE_REDIRECT_BASE_URL if set, a presigned URL otherwise,
+                 and the minimum number of seconds it stays valid, None if it does not expire
+        :rtype: tuple
+        """
+        base_url = self.context.config.get('TC_AWS_RESULT_STORAGE_REDIRECT_BASE_URL')
+        if base_url:
+            return '%s/%s' % (base_url.rstrip('/'), quote(file_abspath.lstrip('/'))), None
+
+        expiry = self.context.config.get('TC_AWS_RESULT_STORAGE_REDIRECT_EXPIRY', 3600)
+        return await self.storage.get_url(file_abspath, expiry=expiry), expiry
@@ -0,0 +1,338 @@
+# coding: utf-8
+
+# Copyright (c) 2015-2016, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+"""
+Deletes expired results from the result storage bucket
+
+Expiration is otherwise only checked when results are read, so expired results pile up in the bucket:
+
+    tc-aws-sweep-results --conf thumbor.conf --concurrency 4 --rate 1000 --checkpoint sweep.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from time import monotonic
+
+from dateutil.tz import tzutc
+from thumbor.server import get_config
+from thumbor.utils import logger
+
+import tc_aws  # noqa, defines TC_AWS_* settings
+from ..aws.bucket import DELETE_BATCH_SIZE, HEX_SHARDS, Bucket, split_keyspace
+from ..aws.keys import clean_key
+from ..aws.settings import get_bucket_options
+
+# Length of the digest randomized keys start with, its slash included
+DIGEST_LENGTH = 41
+
+
+class RateLimiter(object):
+    """
+    Spaces out operations so that at most rate of them are performed per second
+    """
+    def __init__(self, rate):
+        """
+        Constructor
+        :param float rate: Maximum number of operations per second, no limit if None or 0
+        """
+        self.rate = rate
+        self._next_at = monotonic()
+
+    async def wait(self, count=1):
+        """
+        Waits until count operations can be performed
+        :param int count: Number of operations
+        """
+        if not self.rate:
+            return
+
+        now = monotonic()
+        start_at = max(now, self._next_at)
+        self._next_at = start_at + count / self.rate
+
+        if start_at > now:
+            await asyncio.sleep(start_at - now)
+
+
+class Checkpoint(object):
+    """
+    Progress of a sweep, saved to a file so that an interrupted sweep resumes where it stopped
+    For each range of the keyspace, the last key up to which all keys were handled is remembered.
+    Progress of dry runs is kept apart, a sweep resuming from it would not delete skipped results.
+    """
+    def __init__(self, path, prefix, shards, dry_run=False):
+        """
+        Constructor
+        :param string path: File the progress is saved to, nothing is saved if None
+        :param string prefix: Prefix of the swept keys
+        :param string shards: Shards the keyspace is split by
+        :param bool dry_run: Whether the sweep only counts expired results
+        """
+        self.path = path
+        self.prefix = prefix
+        self.shards = shards
+        self.dry_run = dry_run
+        self.ranges = {}
+
+        if path is not None and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+
+            if (saved['prefix'], saved['shards']) != (prefix, shards):
+                raise RuntimeError('Checkpoint %s was saved by a sweep of other keys' % path)
+
+            if saved.get('dry_run', False) != dry_run:
+                raise RuntimeError('Checkpoint %s was saved by a %s' % (path, 'sweep' if dry_run else 'dry run'))
+
+            self.ranges = saved['ranges']
+
+    def resume(self, start_after):
+        """
+        Returns where to resume sweeping a range
+        :param string start_after: Key after which the range starts
+        :return: Key after which to resume, and whether the range was already swept
+        :rtype: tuple
+        """
+        progress = self.ranges.get(start_after or '', {})
+        return progress.get('after', start_after), progress.get('done', False)
+
+    def advance(self, start_after, after, done=False):
+        """
+        Records the progress of a range and saves it
+        :param string start_after: Key after which the range starts
+        :param string after: Last key up to which all keys were handled
+        :param bool done: Whether the range was entirely swept
+        """
+        self.ranges[start_after or ''] = dict(after=after, done=done)
+
+        if self.path is None:
+            return
+
+        # Written aside then renamed, so that an interruption never leaves a partial file
+        temporary_path = '%s.tmp' % self.path
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump(dict(prefix=self.prefix, shards=self.shards, dry_run=self.dry_run, ranges=self.ranges),
+                      checkpoint_file)
+        os.replace(temporary_path, self.path)
+
+
+class Sweeper(object):
+    """
+    Lists the result storage bucket, deleting results older than the expiration
+    Ranges of the keyspace are swept concurrently, expired keys being deleted in batches
+    of DELETE_BATCH_SIZE keys as they are found.
+    """
+    def __init__(self, config, expiration, concurrency=4, list_concurrency=8, rate=None, dry_run=False,
+                 checkpoint=None, shards=None):
+        """
+        Constructor
+        :param Config config: Thumbor's configuration
+        :param int expiration: Seconds after which results are expired
+        :param int concurrency: Maximum number of DeleteObjects requests sent at once
+        :param int list_concurrency: Maximum number of ranges listed at once
+        :param float rate: Maximum number of keys deleted per second, no limit if None or 0
+        :param bool dry_run: Only count expired results, without deleting them
+        :param string checkpoint: File the progress is saved to, to resume an interrupted sweep
+        :param string shards: Leading characters the keyspace is split before, HEX_SHARDS for randomized keys if None
+        """
+        self.expiration = expiration
+        self.list_concurrency = list_concurrency
+        self.dry_run = dry_run
+        self.bucket = Bucket(
+            config.TC_AWS_RESULT_STORAGE_BUCKET,
+            config.get('TC_AWS_REGION'),
+            config.get('TC_AWS_ENDPOINT'),
+            **get_bucket_options(config, 'TC_AWS_RESULT_STORAGE')
+        )
+
+        root_path = clean_key(config.TC_AWS_RESULT_STORAGE_ROOT_PATH or '').strip('/')
+        self.root_prefix = '%s/' % root_path if root_path else ''
+
+        shared = config.TC_AWS_RESULT_STORAGE_BUCKET in (config.TC_AWS_STORAGE_BUCKET, config.TC_AWS_LOADER_BUCKET)
+        if shared and not self.root_prefix:
+            raise RuntimeError('Results are not told apart from other objects of bucket %s, '
+                               'TC_AWS_RESULT_STORAGE_ROOT_PATH is not set' % config.TC_AWS_RESULT_STORAGE_BUCKET)
+
+        self.randomized = config.TC_AWS_RANDOMIZE_KEYS
+        if self.randomized:
+            # Keys start with a digest of their path, the root path comes next
+            self.prefix = ''
+            self.shards = HEX_SHARDS if shards is None else shards
+        else:
+            self.prefix = self.root_prefix
+            self.shards = shards or ''
+
+        self.checkpoint = Checkpoint(checkpoint, self.prefix, self.shards, dry_run)
+        self._rate_limiter = RateLimiter(rate)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.listed = 0
+        self.expired = 0
+        self.deleted = 0
+        self.failed = 0
+
+    async def sweep(self):
+        """
+        Sweeps the whole keyspace
+        :return: Statistics of the sweep
+        :rtype: dict
+        """
+        expires_before = datetime.now(tzutc()) - timedelta(seconds=self.expiration)
+        semaphore = asyncio.Semaphore(self.list_concurrency)
+
+        async def sweep_range(start_after, stop_after):
+            async with semaphore:
+                await self._sweep_range(start_after, stop_after, expires_before)
+
+        if self.shards:
+            ranges = split_keyspace(self.prefix, self.shards)
+        else:
+            ranges = [(None, None)]
+
+        await asyncio.gather(*[sweep_range(start_after, stop_after) for start_after, stop_after in ranges])
+        return self.stats()
+
+    def stats(self):
+        """
+        Returns statistics of the sweep
+        :rtype: dict
+        """
+        return dict(
+            listed=self.listed,
+            expired=self.expired,
+            deleted=self.deleted,
+            failed=self.failed,
+            dry_run=self.dry_run,
+        )
+
+    async def _sweep_range(self, start_after, stop_after, expires_before):
+        """
+        Sweeps a range of the keyspace, in key order
+        :param string start_after: Key after which the range starts, from the first key if None
+        :param string stop_after: Key after which the range stops, until the last key if None
+        :param datetime expires_before: Date results must have been modified after to be fresh
+        """
+        resume_after, done = self.checkpoint.resume(start_after)
+        if done:
+            return
+
+        batch = []
+        listed = 0
+        last_key = resume_after
+
+        async for listed_object in self.bucket.iter_objects(self.prefix, start_after=resume_after,
+                                                            stop_after=stop_after):
+            self.listed += 1
+            listed += 1
+            last_key = listed_object['Key']
+
+            if self._is_result(last_key) and listed_object['LastModified'] < expires_before:
+                batch.append(last_key)
+
+            if len(batch) >= DELETE_BATCH_SIZE:
+                await self._delete(batch)
+                self.checkpoint.advance(start_after, last_key)
+                batch = []
+            elif not batch and listed % DELETE_BATCH_SIZE == 0:
+                # Fresh results only so far
+                self.checkpoint.advance(start_after, last_key)
+
+        if batch:
+            await self._delete(batch)
+
+        self.checkpoint.advance(start_after, last_key, done=True)
+
+    def _is_result(self, key):
+        """
+        Tells whether a listed key is a result, keys of randomized buckets not being listed by root path
+        :param string key: Listed key
+        :rtype: bool
+        """
+        if not self.randomized:
+            return True
+
+        return key[DIGEST_LENGTH:].startswith(self.root_prefix)
+
+    async def _delete(self, keys):
+        """
+        Deletes a batch of expired keys, within the rate limit
+        :param list keys: Expired keys
+        """
+        self.expired += len(keys)
+
+        if self.dry_run:
+            logger.info('Would delete %d expired results, up to %s', len(keys), keys[-1])
+            return
+
+        await self._rate_limiter.wait(len(keys))
+
+        async with self._semaphore:
+            failures = await self.bucket.delete_many(keys, concurrency=1)
+
+        for key, message in failures.items():
+            logger.warning('Unable to delete expired result %s: %s', key, message)
+
+        self.deleted += len(keys) - len(failures)
+        self.failed += len(failures)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Deletes expired results from the result storage bucket')
+    parser.add_argument('-c', '--conf', help='Thumbor configuration file, looked up as thumbor does if omitted')
+    parser.add_argument('--expiration', type=int,
+                        help='Seconds after which results are expired, RESULT_STORAGE_EXPIRATION_SECONDS if omitted')
+    parser.add_argument('--concurrency', type=int,
+                        help='DeleteObjects requests sent at once, TC_AWS_DELETE_CONCURRENCY if omitted')
+    parser.add_argument('--list-concurrency', type=int, default=8, help='Ranges of keys listed at once')
+    parser.add_argument('--shards', help='Leading characters of keys the listing is split before, '
+                                         'hexadecimal digits for randomized keys if omitted')
+    parser.add_argument('--rate', type=float, default=0, help='Maximum number of keys deleted per second, 0 for none')
+    parser.add_argument('--dry-run', action='store_true', help='Only count expired results')
+    parser.add_argument('--checkpoint', help='File progress is saved to, an interrupted sweep resumes from it')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    config = get_config(args.conf)
+    expiration = args.expiration
+    if expiration is None:
+        expiration = config.get('RESULT_STORAGE_EXPIRATION_SECONDS')
+
+    if not expiration:
+        parser.error('Results never expire, RESULT_STORAGE_EXPIRATION_SECONDS is not set')
+
+    try:
+        sweeper = Sweeper(
+            config,
+            expiration,
+            concurrency=args.concurrency or config.get('TC_AWS_DELETE_CONCURRENCY'),
+            list_concurrency=args.list_concurrency,
+            rate=args.rate,
+            dry_run=args.dry_run,
+            checkpoint=args.checkpoint,
+            shards=args.shards,
+        )
+    except RuntimeError as err:
+        parser.error(str(err))
+
+    stats = asyncio.get_event_loop().run_until_complete(run(sweeper))
+    print(json.dumps(stats))
+
+
+async def run(sweeper):
+    try:
+        return await sweeper.sweep()
+    finally:
+        for client in Bucket._clients.values():
+            await client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@
 # Copyright (c) 2015-2016, thumbor-community
 # Use of this source code is governed by the MIT license that can be
 # found in the LICENSE file.
+from functools import partial
 from os.path import splitext
 
 from json import dumps, loads
@@ -12,7 +13,16 @@ from botocore.exceptions import BotoCoreError, ClientError
 from thumbor.storages import BaseStorage
 from thumbor.utils import logger
 
+from ..aws.body import read_body
 from ..aws.storage import AwsStorage
+from ..aws.write_behind import WriteBehindQueue
+
+CRYPTO_METADATA = 'thumbor-crypto'
+DETECTORS_METADATA = 'thumbor-detectors'
+SIDECAR_METADATA = 'thumbor-sidecar'
+
+# S3 limits the size of user metadata, keys and values included
+MAX_METADATA_SIZE = 2048
 
 class Storage(AwsStorage, BaseStorage):
     """
@@ -26,7 +36,33 @@ class Storage(AwsStorage, BaseStorage):
         BaseStorage.__init__(self, context)
         AwsStorage.__init__(self, context, 'TC_AWS_STORAGE')
         self.storage_expiration_seconds = context.config.get('STORAGE_EXPIRATION_SECONDS', 3600)
+        self._sidecars = {}
+
+    @property
+    def write_behind(self):
+        """
+        Instantiates write-behind queue based on configuration
+        :return: The queue, None if writes are performed synchronously
+        :rtype: WriteBehindQueue
+        """
+        config = self.context.config
+        if not config.get('TC_AWS_STORAGE_WRITE_BEHIND', False):
+            return None
 
+        return WriteBehindQueue(
+            config.get('TC_AWS_STORAGE_WRITE_BEHIND_QUEUE_SIZE'),
+            config.get('TC_AWS_STORAGE_WRITE_BEHIND_WORKERS'),
+            config.get('TC_AWS_STORAGE_WRITE_BEHIND_OVERFLOW'),
+            config.get('TC_AWS_STORAGE_WRITE_BEHIND_FLUSH_TIMEOUT'),
+        )
+
+    @property
+    def sidecars_in_metadata(self):
+        """
+        Tells whether crypto and detector data are stored as metadata of the image
+        :rtype: bool
+        """
+        return self.context.config.get('TC_AWS_STORAGE_SIDECARS_IN_METADATA', False)
 
     async def put(self, path, file_bytes):
         """
@@ -35,14 +71,35 @@ class Storage(AwsStorage, BaseStorage):
         :param bytes bytes: Data to store
         :rtype: string
         """
-        try:
-            await self._put_object(file_bytes, self._normalize_path(path))
-        except BotoCoreError as err:
-            logger.exception('Unable to store object: %s', err)
+        file_abspath = self._normalize_path(path)
+        self._sidecars.pop(file_abspath, None)
+
+        metadata = None
+        security_key = self.context.server.security_key if self.context.server else None
+        if self.sidecars_in_metadata and self.context.config.STORES_CRYPTO_KEY_FOR_EACH_IMAGE and security_key:
+            # Saves a request to put_crypto, which then only writes the combined sidecar if needed
+            metadata, _ = self._fold_sidecars({CRYPTO_METADATA: security_key})
+
+        write = partial(self._put_image, file_bytes, file_abspath, metadata)
+        if not await self._store(file_abspath, file_bytes, write, 'object'):
             return None
 
         return path
 
+    async def _put_image(self, file_bytes, file_abspath, metadata):
+        """
+        Writes an image, then caches it on disk
+        The disk cache is only filled once the image is in S3, background writes may fail or be dropped.
+        :param bytes file_bytes: Data to store
+        :param string file_abspath: Normalized path to store data at
+        :param dict metadata: Metadata of the image
+        """
+        await self._put_object(file_bytes, file_abspath, metadata)
+
+        disk_cache = self.disk_cache
+        if disk_cache is not None:
+            await disk_cache.put(self._get_config('BUCKET'), file_abspath, file_bytes)
+
     async def put_crypto(self, path):
         """
         Stores crypto data at given path
@@ -59,12 +116,20 @@ class Storage(AwsStorage, BaseStorage):
             )
 
         file_abspath = self._normalize_path(path)
+
+        if self.sidecars_in_metadata:
+            # The security key was stored as metadata of the image by put
+            _, sidecar = self._fold_sidecars({CRYPTO_METADATA: self.context.server.security_key})
+            if sidecar is not None and not await self._store_sidecar(file_abspath, sidecar, 'crypto object'):
+                return None
+
+            return file_abspath
+
         crypto_path = '%s.txt' % splitext(file_abspath)[0]
+        crypto_data = self.context.server.security_key.encode('utf-8')
 
-        try:
-            await self._put_object(self.context.server.security_key.encode('utf-8'), crypto_path)
-        except BotoCoreError as err:
-            logger.exception('Unable to store crypto object: %s', err)
+        write = partial(self._put_object, crypto_data, crypto_path)
+        if not await self._store(crypto_path, crypto_data, write, 'crypto object'):
             return None
 
         logger.debug(
@@ -85,12 +150,48 @@ class Storage(AwsStorage, BaseStorage):
         """
         file_abspath = self._normalize_path(path)
 
+        if self.sidecars_in_metadata:
+            return await self._put_detector_metadata(file_abspath, data)
+
         path = '%s.detectors.txt' % splitext(file_abspath)[0]
+        detector_data = dumps(data).encode('utf-8')
 
-        try:
-            await self._put_object(dumps(data).encode('utf-8'), path)
-        except BotoCoreError as err:
-            logger.exception('Unable to store detector data: %s', err)
+        write = partial(self._put_object, detector_data, path)
+        if not await self._store(path, detector_data, write, 'detector data'):
+            return None
+
+        return file_abspath
+
+    async def _put_detector_metadata(self, file_abspath, data):
+        """
+        Stores detector data, along with the security key, as metadata of the image
+        or in the combined sidecar if too large
+        :param string file_abspath: Normalized path of the image
+        :param data: Data to store
+        :return: Path where the data is stored
+        :rtype: string
+        """
+        self._sidecars.pop(file_abspath, None)
+
+        sidecars = {DETECTORS_METADATA: dumps(data)}
+        security_key = self.context.server.security_key if self.context.server else None
+        if self.context.config.STORES_CRYPTO_KEY_FOR_EACH_IMAGE and security_key:
+            sidecars[CRYPTO_METADATA] = security_key
+
+        metadata, sidecar = self._fold_sidecars(sidecars)
+        if sidecar is not None and not await self._store_sidecar(file_abspath, sidecar, 'detector data'):
+            return None
+
+        update = partial(
+            self.storage.update_metadata,
+            file_abspath,
+            metadata,
+            reduced_redundancy=self.context.config.get('TC_AWS_STORAGE_RRS', False),
+            encrypt_key=self.context.config.get('TC_AWS_STORAGE_SSE', False),
+        )
+
+        # Queued behind the pending write of the image, if any
+        if not await self._store(file_abspath, self._get_pending(file_abspath), update, 'detector data'):
             return None
 
         return file_abspath
@@ -101,18 +202,27 @@ class Storage(AwsStorage, BaseStorage):
         :param string path: Path to search for crypto data
         """
         file_abspath = self._normalize_path(path)
+
+        if self.sidecars_in_metadata:
+            _, sidecars = await self._get_sidecars(file_abspath)
+            return sidecars.get(CRYPTO_METADATA)
+
         crypto_path = "%s.txt" % (splitext(file_abspath)[0])
 
+        pending = self._get_pending(crypto_path)
+        if pending is not None:
+            return pending.decode('utf-8')
+
         try:
             file_key = await self.storage.get(crypto_path)
         except ClientError as err:
             logger.warning("[STORAGE] s3 key not found at %s" % crypto_path)
             return None
+        except BotoCoreError:
+            # Open circuit or exceeded deadline included
+            return None
 
-        async with file_key['Body'] as stream:
-            file_key = await stream.read()
-
-        return file_key.decode('utf-8')
+        return (await read_body(file_key)).decode('utf-8')
 
     async def get_detector_data(self, path):
         """
@@ -120,27 +230,49 @@ class Storage(AwsStorage, BaseStorage):
         :param string path: Path where the data is stored
         """
         file_abspath = self._normalize_path(path)
+
+        if self.sidecars_in_metadata:
+            head, sidecars = await self._get_sidecars(file_abspath)
+            if DETECTORS_METADATA not in sidecars or self.is_expired(head):
+                return None
+
+            return loads(sidecars[DETECTORS_METADATA])
+
         path = '%s.detectors.txt' % splitext(file_abspath)[0]
 
+        pending = self._get_pending(path)
+        if pending is not None:
+            return loads(pending)
+
         try:
-            file_key = await self.storage.get(path)
-        except ClientError:
+            file_key = await self.storage.get(path, if_modified_since=self._get_expiration_limit())
+        except (BotoCoreError, ClientError):
             return None
 
         if not file_key or self.is_expired(file_key) or 'Body' not in file_key:
             return None
 
-        async with file_key['Body'] as stream:
-            return loads(await stream.read())
+        return loads(await read_body(file_key))
 
     async def get(self, path):
         """
         Gets data at path
         :param string path: Path for data
         """
+        file_abspath = self._normalize_path(path)
+
+        pending = self._get_pending(file_abspath)
+        if pending is not None:
+            return pending
+
+        disk_cache = self.disk_cache
+        if disk_cache is not None:
+            cached = await disk_cache.get(self._get_config('BUCKET'), file_abspath)
+            if cached is not None and cached[2]:
+                return cached[0]
 
         try:
-            file = await super(Storage, self).get(path)
+            file = await self.storage.get(file_abspath)
         except BotoCoreError:
             return None
         except ClientError as e:
@@ -151,8 +283,12 @@ class Storage(AwsStorage, BaseStorage):
             else:
                 raise e
 
-        async with file['Body'] as stream:
-            return await stream.read()
+        buffer = await read_body(file)
+
+        if disk_cache is not None:
+            await disk_cache.put(self._get_config('BUCKET'), file_abspath, buffer, file['LastModified'])
+
+        return buffer
 
     async def exists(self, path):
         """
@@ -160,6 +296,10 @@ class Storage(AwsStorage, BaseStorage):
         :param string path: Path to check
         """
         file_abspath = self._normalize_path(path)
+
+        if self._get_pending(file_abspath) is not None:
+            return True
+
         return await self.storage.exists(file_abspath)
 
     async def remove(self, path):
@@ -167,5 +307,143 @@ class Storage(AwsStorage, BaseStorage):
         Deletes data at path
         :param string path: Path to delete
         """
-        return await self.storage.delete(self._normalize_path(path))
+        file_abspath = self._normalize_path(path)
+        self._sidecars.pop(file_abspath, None)
+
+        disk_cache = self.disk_cache
+        if disk_cache is not None:
+            await disk_cache.delete(self._get_config('BUCKET'), file_abspath)
+
+        return await self.storage.delete(file_abspath)
+
+    async def remove_many(self, paths):
+        """
+        Deletes data at given paths along with their crypto and detector data
+        :param list paths: Paths to delete
+        :return: Error message of each key which could not be deleted, empty if all were
+        :rtype: dict
+        """
+        bucket = self._get_config('BUCKET')
+        disk_cache = self.disk_cache
+        keys = []
+
+        for path in paths:
+            file_abspath = self._normalize_path(path)
+            root = splitext(file_abspath)[0]
+            keys.extend([file_abspath, '%s.txt' % root, '%s.detectors.txt' % root])
+            if self.sidecars_in_metadata:
+                keys.append(self._get_sidecar_path(file_abspath))
+            self._sidecars.pop(file_abspath, None)
+
+            if disk_cache is not None:
+                await disk_cache.delete(bucket, file_abspath)
+
+        failures = await self.storage.delete_many(
+            keys,
+            concurrency=self.context.config.get('TC_AWS_DELETE_CONCURRENCY', 4),
+        )
+
+        for key, message in failures.items():
+            logger.warning('[STORAGE] Unable to delete %s: %s', key, message)
+
+        return failures
+
+    async def _store(self, path, object_data, write, description):
+        """
+        Performs a write, in background if write-behind is enabled
+        :param string path: Path the data is stored at
+        :param bytes object_data: Data readable at path until written in background
+        :param callable write: Coroutine function performing the write
+        :param string description: Kind of data, for logging purposes
+        :return: Whether data was stored or queued
+        :rtype: bool
+        """
+        write_behind = self.write_behind
+        if write_behind is not None:
+            return await write_behind.put((self._get_config('BUCKET'), path), object_data, write)
+
+        try:
+            await write()
+        except (BotoCoreError, ClientError) as err:
+            logger.exception('Unable to store %s: %s', description, err)
+            return False
+
+        return True
+
+    async def _store_sidecar(self, file_abspath, sidecar, description):
+        """
+        Stores crypto and detector data too large for metadata in the combined sidecar of an image
+        :param string file_abspath: Normalized path of the image
+        :param dict sidecar: Sidecar values by metadata name
+        :param string description: Kind of data, for logging purposes
+        :return: Whether data was stored or queued
+        :rtype: bool
+        """
+        path = self._get_sidecar_path(file_abspath)
+        sidecar_data = dumps(sidecar).encode('utf-8')
+
+        return await self._store(path, sidecar_data, partial(self._put_object, sidecar_data, path), description)
+
+    async def _get_sidecars(self, file_abspath):
+        """
+        Retrieves crypto and detector data stored with an image
+        The image's metadata is read once per request, the combined sidecar only if it was used.
+        :param string file_abspath: Normalized path of the image
+        :return: The image's HeadObject response (None if missing) and sidecar values by metadata name
+        :rtype: tuple
+        """
+        if file_abspath in self._sidecars:
+            return self._sidecars[file_abspath]
+
+        try:
+            head = await self.storage.head(file_abspath)
+        except (BotoCoreError, ClientError):
+            head, sidecars = None, {}
+        else:
+            sidecars = head.get('Metadata', {})
+
+            if sidecars.get(SIDECAR_METADATA):
+                sidecar_path = self._get_sidecar_path(file_abspath)
+                pending = self._get_pending(sidecar_path)
+
+                try:
+                    sidecars = loads(pending if pending is not None else await read_body(await self.storage.get(sidecar_path)))
+                except (BotoCoreError, ClientError):
+                    logger.warning("[STORAGE] s3 key not found at %s" % sidecar_path)
+                    sidecars = {}
+
+        self._sidecars[file_abspath] = (head, sidecars)
+        return head, sidecars
+
+    @staticmethod
+    def _fold_sidecars(sidecars):
+        """
+        Splits crypto and detector data between the image's metadata and its combined sidecar
+        :param dict sidecars: Sidecar values by metadata name
+        :return: Metadata of the image, and the combined sidecar's values if they don't fit in it
+        :rtype: tuple
+        """
+        size = sum(len(name) + len(value.encode('utf-8')) for name, value in sidecars.items())
+
+        # Metadata travels as HTTP headers, which only carry ASCII
+        if size <= MAX_METADATA_SIZE and all(value.isascii() for value in sidecars.values()):
+            return dict(sidecars), None
+
+        return {SIDECAR_METADATA: 'true'}, dict(sidecars)
+
+    @staticmethod
+    def _get_sidecar_path(file_abspath):
+        return '%s.sidecars.json' % splitext(file_abspath)[0]
+
+    def _get_pending(self, path):
+        """
+        Retrieves data queued for writing at path, so that it can be read before being written
+        :param string path: Normalized path
+        :return: The data, None if no write is pending
+        :rtype: bytes
+        """
+        write_behind = self.write_behind
+        if write_behind is None:
+            return None
 
+        return write_behind.get_pending((self._get_config('BUCKET'), path))
@@ -17,7 +17,13 @@ import requests
 from aiobotocore.session import AioSession
 from tornado.testing import AsyncTestCase
 
+from tc_aws.aws.breaker import CircuitBreaker
 from tc_aws.aws.bucket import Bucket
+from tc_aws.aws.cache import LRUCache
+from tc_aws.aws.disk_cache import DiskCache
+from tc_aws.aws.keys import KeyBuilder
+from tc_aws.aws.replicas import ReplicaSet
+from tc_aws.aws.write_behind import WriteBehindQueue
 from tests.fixtures.storage_fixture import s3_bucket
 
 logging.basicConfig(level=logging.CRITICAL)
@@ -111,3 +117,11 @@ class S3MockedAsyncTestCase(AsyncTestCase):
         # singleton Bucket holds old IOLoop instance which closed after each test
         # this cleans singleton
         Bucket._instances = {}
+        Bucket._clients = {}
+        Bucket._session = None
+        LRUCache._instances = {}
+        DiskCache._instances = {}
+        WriteBehindQueue._instances = {}
+        KeyBuilder._instances = {}
+        CircuitBreaker._instances = {}
+        ReplicaSet._instances = {}
@@ -0,0 +1,73 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from unittest import TestCase
+
+from botocore.exceptions import IncompleteReadError
+from pytest import raises
+from tornado.testing import AsyncTestCase, gen_test
+
+from tc_aws.aws.body import MemoryBody, read_body
+
+
+class FakeStream(object):
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def readany(self):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    async def read(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ReadBodyTestCase(AsyncTestCase):
+
+    @gen_test
+    async def test_reads_chunks_into_single_buffer(self):
+        topic = await read_body({'Body': FakeStream([b'foo', b'bar', b'baz']), 'ContentLength': 9})
+
+        self.assertIsInstance(topic, bytes)
+        self.assertEqual(topic, b'foobarbaz')
+
+    @gen_test
+    async def test_reads_body_without_content_length(self):
+        topic = await read_body({'Body': FakeStream([b'foo', b'bar'])})
+
+        self.assertEqual(topic, b'foobar')
+
+    @gen_test
+    async def test_raises_on_truncated_body(self):
+        with raises(IncompleteReadError):
+            await read_body({'Body': FakeStream([b'foo']), 'ContentLength': 9})
+
+    @gen_test
+    async def test_raises_on_oversized_body(self):
+        with raises(IncompleteReadError):
+            await read_body({'Body': FakeStream([b'foo', b'bar']), 'ContentLength': 4})
+
+
+class MemoryBodyTestCase(TestCase):
+
+    def test_reads_slice_of_buffer(self):
+        body = MemoryBody(memoryview(b'0123456789')[2:8])
+
+        self.assertEqual(len(body), 6)
+        self.assertEqual(body.read(4), b'2345')
+        self.assertEqual(body.read(), b'67')
+
+        # Rewound before being sent again
+        body.seek(0)
+        self.assertEqual(body.read(), b'234567')
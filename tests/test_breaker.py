@@ -0,0 +1,175 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from unittest import TestCase
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import patch
+from pytest import raises
+from tornado.testing import gen_test
+
+from tc_aws.aws.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from tc_aws.aws.bucket import Bucket
+from tc_aws.aws.retry import decorrelated_jitter, is_retryable
+from tests import S3MockedAsyncTestCase
+from tests.fixtures.storage_fixture import s3_bucket
+
+
+def client_error(status_code, code='Error'):
+    return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status_code}}, 'GetObject')
+
+
+class CircuitBreakerTestCase(TestCase):
+
+    def tearDown(self):
+        CircuitBreaker._instances = {}
+
+    def test_opens_on_error_rate(self):
+        breaker = CircuitBreaker('bucket', 0.5, min_calls=4)
+
+        for failed in (False, True, False):
+            breaker.before_call()
+            breaker.record(failed, 0.01)
+        self.assertEqual(breaker.state, CLOSED)
+
+        breaker.record(True, 0.01)
+        self.assertEqual(breaker.state, OPEN)
+
+        with raises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_counts_slow_calls_as_failing(self):
+        breaker = CircuitBreaker('bucket', 1, slow_call_seconds=1, min_calls=1)
+
+        breaker.record(False, 2)
+
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_forgets_calls_out_of_window(self):
+        breaker = CircuitBreaker('bucket', 0.5, window=10, min_calls=2)
+
+        with patch('tc_aws.aws.breaker.monotonic', return_value=100):
+            breaker.record(True, 0.01)
+        with patch('tc_aws.aws.breaker.monotonic', return_value=120):
+            breaker.record(False, 0.01)
+
+        self.assertEqual(breaker.stats(), dict(state=CLOSED, calls=1, failures=0))
+
+    def test_lets_a_single_probe_through_when_half_open(self):
+        breaker = CircuitBreaker('bucket', 0.5, min_calls=1, open_seconds=10)
+
+        with patch('tc_aws.aws.breaker.monotonic', return_value=100):
+            breaker.record(True, 0.01)
+
+        with patch('tc_aws.aws.breaker.monotonic', return_value=110):
+            self.assertEqual(breaker.state, HALF_OPEN)
+            probe = breaker.before_call()
+
+            with raises(CircuitOpenError):
+                breaker.before_call()
+
+            breaker.record(False, 0.01, probe)
+
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_reopens_when_probe_fails(self):
+        breaker = CircuitBreaker('bucket', 0.5, min_calls=1, open_seconds=10)
+
+        with patch('tc_aws.aws.breaker.monotonic', return_value=100):
+            breaker.record(True, 0.01)
+
+        with patch('tc_aws.aws.breaker.monotonic', return_value=110):
+            probe = breaker.before_call()
+            breaker.record(True, 0.01, probe)
+            self.assertEqual(breaker.state, OPEN)
+
+    def test_ignores_calls_other_than_the_probe_when_half_open(self):
+        breaker = CircuitBreaker('bucket', 0.5, min_calls=1, open_seconds=10)
+
+        with patch('tc_aws.aws.breaker.monotonic', return_value=100):
+            self.assertIsNone(breaker.before_call())
+            breaker.record(True, 0.01)
+
+        with patch('tc_aws.aws.breaker.monotonic', return_value=110):
+            probe = breaker.before_call()
+
+            # Let through before the circuit opened
+            breaker.record(False, 0.01)
+            breaker.cancelled()
+            self.assertEqual(breaker.state, HALF_OPEN)
+            with raises(CircuitOpenError):
+                breaker.before_call()
+
+            breaker.cancelled(probe)
+            probe = breaker.before_call()
+            breaker.record(True, 0.01, probe)
+            self.assertEqual(breaker.state, OPEN)
+
+
+class RetryTestCase(TestCase):
+
+    def test_retries_throttling_server_and_connection_errors(self):
+        self.assertTrue(is_retryable(client_error(503, 'SlowDown')))
+        self.assertTrue(is_retryable(client_error(500)))
+        self.assertTrue(is_retryable(client_error(400, 'RequestTimeout')))
+        self.assertTrue(is_retryable(EndpointConnectionError(endpoint_url='http://localhost')))
+
+    def test_does_not_retry_client_errors(self):
+        self.assertFalse(is_retryable(client_error(404, 'NoSuchKey')))
+        self.assertFalse(is_retryable(client_error(304)))
+        self.assertFalse(is_retryable(ValueError()))
+
+    def test_jitter_stays_between_base_and_cap(self):
+        delay = 0.1
+        for _ in range(100):
+            delay = decorrelated_jitter(0.1, 1, delay)
+            self.assertTrue(0.1 <= delay <= 1)
+
+
+class BucketRetryTestCase(S3MockedAsyncTestCase):
+
+    @gen_test
+    async def test_retries_transient_errors_with_jitter(self):
+        bucket = Bucket(s3_bucket, 'us-east-1', None, max_retry=3, retry_base_delay=0.001, retry_max_delay=0.01)
+        errors = [client_error(503, 'SlowDown'), client_error(500)]
+
+        async def method(**kwargs):
+            if errors:
+                raise errors.pop(0)
+            return dict(ResponseMetadata=dict(RetryAttempts=0))
+
+        response = await bucket._call(method, Key='key')
+
+        self.assertEqual(response['ResponseMetadata']['RetryAttempts'], 2)
+
+    @gen_test
+    async def test_does_not_retry_missing_keys(self):
+        bucket = Bucket(s3_bucket, 'us-east-1', None, max_retry=3, retry_base_delay=0.001, retry_max_delay=0.01)
+        calls = []
+
+        async def method(**kwargs):
+            calls.append(kwargs)
+            raise client_error(404, 'NoSuchKey')
+
+        with raises(ClientError):
+            await bucket._call(method, Key='key')
+
+        self.assertEqual(len(calls), 1)
+
+    @gen_test
+    async def test_gives_up_after_max_retry(self):
+        bucket = Bucket(s3_bucket, 'us-east-1', None, max_retry=2, retry_base_delay=0.001, retry_max_delay=0.01)
+        calls = []
+
+        async def method(**kwargs):
+            calls.append(kwargs)
+            raise client_error(503, 'SlowDown')
+
+        with raises(ClientError) as err:
+            await bucket._call(method, Key='key')
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(err.value.response['ResponseMetadata']['RetryAttempts'], 2)
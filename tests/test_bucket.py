@@ -0,0 +1,106 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from hashlib import sha1
+
+import botocore.session
+from mock import patch
+from tornado.testing import gen_test
+
+from tc_aws.aws.bucket import HEX_SHARDS, Bucket
+from tests import S3MockedAsyncTestCase
+from tests.fixtures.storage_fixture import s3_bucket
+
+
+class BucketListingTestCase(S3MockedAsyncTestCase):
+
+    def _put_objects(self, keys):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        for key in keys:
+            client.put_object(Bucket=s3_bucket, Key=key, Body=b'data')
+
+    def _bucket(self):
+        return Bucket(s3_bucket, 'us-east-1', None)
+
+    @gen_test
+    async def test_iterates_over_objects_by_pages(self):
+        keys = ['results/%03d.jpg' % index for index in range(25)]
+        self._put_objects(keys + ['other/1.jpg'])
+
+        listed = [listed_object['Key'] async for listed_object in self._bucket().iter_objects('results/', page_size=10)]
+
+        self.assertEqual(listed, keys)
+
+    @gen_test
+    async def test_lists_shards_concurrently(self):
+        keys = ['results/%s/image.jpg' % sha1(str(index).encode('utf-8')).hexdigest() for index in range(50)]
+        # Exactly on a shard boundary, and outside of all shards
+        keys += ['results/1', 'results/z/image.jpg', 'results/']
+        self._put_objects(keys + ['other/1.jpg'])
+
+        listed = [
+            listed_object['Key']
+            async for listed_object in self._bucket().iter_objects('results/', HEX_SHARDS, 4, page_size=3)
+        ]
+
+        self.assertEqual(sorted(listed), sorted(keys))
+
+    @gen_test
+    async def test_stops_listing_when_iteration_stops(self):
+        self._put_objects(['results/%s.jpg' % shard for shard in HEX_SHARDS])
+
+        iterator = self._bucket().iter_objects('results/', HEX_SHARDS, 2, page_size=1)
+        listed_object = await iterator.__anext__()
+        await iterator.aclose()
+
+        self.assertTrue(listed_object['Key'].startswith('results/'))
+
+
+class BucketPresignTestCase(S3MockedAsyncTestCase):
+
+    def _bucket(self, window):
+        bucket = Bucket(s3_bucket, 'us-east-1', None, presign_cache_window=window, presign_cache_size=10)
+        self.sign = patch.object(bucket._client, 'generate_presigned_url', wraps=bucket._client.generate_presigned_url)
+        self.addCleanup(self.sign.stop)
+        self.signer = self.sign.start()
+        return bucket
+
+    def _signed_expiries(self):
+        return [call[1]['ExpiresIn'] for call in self.signer.call_args_list]
+
+    @gen_test
+    async def test_reuses_urls_within_window(self):
+        bucket = self._bucket(600)
+
+        with patch('tc_aws.aws.bucket.time', return_value=1200.0):
+            url = await bucket.get_url('my-image.jpg', expiry=3600)
+
+        with patch('tc_aws.aws.bucket.time', return_value=1799.5):
+            self.assertEqual(await bucket.get_url('my-image.jpg', expiry=3600), url)
+            self.assertNotEqual(await bucket.get_url('other-image.jpg', expiry=3600), url)
+
+        self.assertEqual(self._signed_expiries(), [3600 + 600, 3600 + 1])
+
+    @gen_test
+    async def test_signs_again_in_next_window(self):
+        bucket = self._bucket(600)
+
+        with patch('tc_aws.aws.bucket.time', return_value=1500.0):
+            await bucket.get_url('my-image.jpg', expiry=3600)
+
+        with patch('tc_aws.aws.bucket.time', return_value=1800.0):
+            await bucket.get_url('my-image.jpg', expiry=3600)
+
+        self.assertEqual(self._signed_expiries(), [3600 + 300, 3600 + 600])
+
+    @gen_test
+    async def test_signs_each_call_without_window(self):
+        bucket = self._bucket(None)
+
+        await bucket.get_url('my-image.jpg', expiry=60)
+        await bucket.get_url('my-image.jpg', expiry=60)
+
+        self.assertEqual(self._signed_expiries(), [60, 60])
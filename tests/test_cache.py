@@ -0,0 +1,54 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from unittest import TestCase
+
+from mock import patch
+
+from tc_aws.aws.cache import LRUCache
+
+
+class LRUCacheTestCase(TestCase):
+
+    def tearDown(self):
+        LRUCache._instances = {}
+
+    def test_is_shared_per_name_and_settings(self):
+        self.assertIs(LRUCache('loader', 10), LRUCache('loader', 10))
+        self.assertIsNot(LRUCache('loader', 10), LRUCache('loader', 20))
+
+    def test_evicts_least_recently_used_to_stay_within_budget(self):
+        cache = LRUCache('test', 10)
+        cache.set('a', b'aaaa', 4)
+        cache.set('b', b'bbbb', 4)
+        cache.get('a')
+        cache.set('c', b'cccc', 4)
+
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), b'cccc')
+        self.assertEqual(cache.stats(), dict(hits=3, misses=1, evictions=1, entries=2, resident_bytes=8))
+
+    def test_does_not_cache_values_over_budget(self):
+        cache = LRUCache('test', 10)
+        cache.set('a', b'a' * 11, 11)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['resident_bytes'], 0)
+
+    def test_expires_entries_after_ttl(self):
+        cache = LRUCache('test', 10, ttl=60)
+
+        with patch('tc_aws.aws.cache.monotonic', return_value=100):
+            cache.set('a', b'aaaa', 4)
+
+        with patch('tc_aws.aws.cache.monotonic', return_value=159):
+            self.assertEqual(cache.get('a'), b'aaaa')
+
+        with patch('tc_aws.aws.cache.monotonic', return_value=160):
+            self.assertIsNone(cache.get('a'))
+
+        self.assertEqual(cache.stats()['resident_bytes'], 0)
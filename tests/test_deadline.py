@@ -0,0 +1,49 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+
+from pytest import raises
+from tornado.testing import AsyncTestCase, gen_test
+
+from tc_aws.aws.deadline import DeadlineExceededError, within_deadline
+
+
+class WithinDeadlineTestCase(AsyncTestCase):
+
+    @gen_test
+    async def test_returns_result_of_operations_in_time(self):
+        async def operation():
+            return 'result'
+
+        self.assertEqual(await within_deadline(operation(), 1, 'get'), 'result')
+        self.assertEqual(await within_deadline(operation(), None, 'get'), 'result')
+
+    @gen_test
+    async def test_cancels_operations_exceeding_deadline(self):
+        cancelled = []
+
+        async def operation():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        with raises(DeadlineExceededError):
+            await within_deadline(operation(), 0.01, 'get')
+
+        self.assertEqual(cancelled, [True])
+
+    @gen_test
+    async def test_raises_timeouts_of_operations_as_is(self):
+        async def operation():
+            raise asyncio.TimeoutError()
+
+        with raises(asyncio.TimeoutError) as err:
+            await within_deadline(operation(), 1, 'get')
+
+        self.assertNotIsInstance(err.value, DeadlineExceededError)
@@ -0,0 +1,104 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import os
+from datetime import datetime
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from dateutil.tz import tzutc
+from mock import patch
+from tornado.testing import AsyncTestCase, gen_test
+
+from tc_aws.aws.disk_cache import DiskCache
+
+
+class DiskCacheTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(DiskCacheTestCase, self).setUp()
+        self.path = mkdtemp()
+
+    def tearDown(self):
+        super(DiskCacheTestCase, self).tearDown()
+        DiskCache._instances = {}
+        rmtree(self.path)
+
+    @gen_test
+    async def test_can_get_cached_object(self):
+        cache = DiskCache(self.path, 100)
+        last_modified = datetime(2020, 1, 2, 3, 4, 5, tzinfo=tzutc())
+        await cache.put('bucket', 'some/key.jpg', b'some-data', last_modified)
+
+        self.assertEqual(await cache.get('bucket', 'some/key.jpg'), (b'some-data', last_modified, True))
+        self.assertIsNone(await cache.get('other-bucket', 'some/key.jpg'))
+
+    @gen_test
+    async def test_evicts_least_recently_used_files(self):
+        cache = DiskCache(self.path, 10)
+        await cache.put('bucket', 'a', b'aaaa')
+        await cache.put('bucket', 'b', b'bbbb')
+        await cache.get('bucket', 'a')
+        await cache.put('bucket', 'c', b'cccc')
+
+        self.assertIsNotNone(await cache.get('bucket', 'a'))
+        self.assertIsNone(await cache.get('bucket', 'b'))
+        self.assertIsNotNone(await cache.get('bucket', 'c'))
+
+    @gen_test
+    async def test_can_delete_object(self):
+        cache = DiskCache(self.path, 100)
+        await cache.put('bucket', 'a', b'aaaa')
+        await cache.delete('bucket', 'a')
+
+        self.assertIsNone(await cache.get('bucket', 'a'))
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(self.path)), 0)
+
+    @gen_test
+    async def test_rebuilds_index_on_restart(self):
+        await DiskCache(self.path, 100).put('bucket', 'a', b'aaaa')
+        shard = os.listdir(self.path)[0]
+        open(os.path.join(self.path, shard, '.tmp-interrupted'), 'wb').close()
+
+        DiskCache._instances = {}
+        cache = DiskCache(self.path, 100)
+
+        self.assertEqual((await cache.get('bucket', 'a'))[0], b'aaaa')
+        self.assertEqual(os.listdir(os.path.join(self.path, shard)), [DiskCache._digest('bucket', 'a')])
+
+    @gen_test
+    async def test_does_not_block_ioloop(self):
+        cache = DiskCache(self.path, 100)
+
+        with patch.object(DiskCache, '_run', wraps=DiskCache._run) as run:
+            await cache.put('bucket', 'a', b'aaaa')
+            await cache.get('bucket', 'a')
+
+        self.assertEqual([call[0][0].__name__ for call in run.call_args_list], ['_scan', '_write_file', '_read_file'])
+
+    @gen_test
+    async def test_tells_stale_objects(self):
+        cache = DiskCache(self.path, 100, ttl=60)
+        await cache.put('bucket', 'a', b'aaaa', datetime(2020, 1, 2, tzinfo=tzutc()))
+
+        self.assertTrue((await cache.get('bucket', 'a'))[2])
+
+        with patch('tc_aws.aws.disk_cache.time', return_value=time() + 120):
+            self.assertEqual(await cache.get('bucket', 'a'), (b'aaaa', datetime(2020, 1, 2, tzinfo=tzutc()), False))
+
+    @gen_test
+    async def test_refreshes_change_time_only(self):
+        cache = DiskCache(self.path, 100, ttl=60)
+        await cache.put('bucket', 'a', b'aaaa', datetime(2020, 1, 2, tzinfo=tzutc()))
+        file_path = cache._file_path(DiskCache._digest('bucket', 'a'))
+        before = os.stat(file_path)
+
+        await cache.refresh('bucket', 'a')
+
+        after = os.stat(file_path)
+        self.assertEqual(after.st_mtime_ns, before.st_mtime_ns)
+        self.assertGreaterEqual(after.st_ctime_ns, before.st_ctime_ns)
@@ -0,0 +1,106 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import Mock
+from pytest import raises
+from tornado.testing import AsyncTestCase, gen_test
+
+from tc_aws.aws.hedge import PERCENTILE_REFRESH, Hedger
+from tc_aws.aws.metrics import Measure
+
+
+class HedgerTestCase(AsyncTestCase):
+
+    def _requests(self, *delays):
+        """
+        Returns a request function whose successive calls answer after the given delays
+        """
+        calls = []
+
+        async def request():
+            index = len(calls)
+            body = Mock()
+            calls.append(body)
+            await asyncio.sleep(delays[index])
+            return dict(Body=body, index=index)
+
+        return request, calls
+
+    @gen_test
+    async def test_does_not_hedge_fast_requests(self):
+        hedger = Hedger(0.1)
+        request, calls = self._requests(0)
+
+        response = await hedger.run(request)
+
+        self.assertEqual(response['index'], 0)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(hedger.stats()['issued'], 0)
+
+    @gen_test
+    async def test_uses_hedge_answering_first(self):
+        hedger = Hedger(0.01, max_rate=1)
+        request, calls = self._requests(1, 0)
+        measure = Measure(None, 's3.loader.bucket', 'get')
+
+        response = await hedger.run(request, measure)
+
+        self.assertEqual(response['index'], 1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(measure.hedge, 'won')
+        self.assertEqual(hedger.stats(), dict(requests=1, issued=1, won=1, delay=0.01))
+
+    @gen_test
+    async def test_caps_hedge_rate(self):
+        hedger = Hedger(0.001, max_rate=0)
+
+        for _ in range(3):
+            request, _ = self._requests(0.01)
+            await hedger.run(request)
+
+        # The initial budget allows a single hedge
+        self.assertEqual(hedger.stats()['issued'], 1)
+
+    @gen_test
+    async def test_waits_for_other_request_on_connection_error(self):
+        hedger = Hedger(0.01, max_rate=1)
+        calls = []
+
+        async def request():
+            calls.append(None)
+            if len(calls) == 1:
+                await asyncio.sleep(0.02)
+                raise EndpointConnectionError(endpoint_url='http://localhost')
+            await asyncio.sleep(0.05)
+            return dict(Body=Mock())
+
+        response = await hedger.run(request)
+
+        self.assertIn('Body', response)
+        self.assertEqual(hedger.stats()['won'], 1)
+
+    @gen_test
+    async def test_raises_error_responses(self):
+        hedger = Hedger(0.01, max_rate=1)
+
+        async def request():
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, 'GetObject')
+
+        with raises(ClientError):
+            await hedger.run(request)
+
+    @gen_test
+    async def test_hedges_after_observed_percentile(self):
+        hedger = Hedger(1, percentile=50)
+
+        for _ in range(PERCENTILE_REFRESH):
+            request, _ = self._requests(0)
+            await hedger.run(request)
+
+        self.assertLess(hedger.current_delay, 1)
@@ -0,0 +1,58 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from hashlib import sha1
+from unittest import TestCase
+
+from thumbor.config import Config
+
+import tc_aws  # noqa, defines TC_AWS_* settings
+from tc_aws.aws.keys import KeyBuilder, clean_key
+
+
+class KeyBuilderTestCase(TestCase):
+
+    def tearDown(self):
+        KeyBuilder._instances = {}
+
+    def test_builds_keys_under_root_path(self):
+        builder = KeyBuilder('root', False, 'root_image')
+
+        self.assertEqual(builder.build('/some/image.jpg'), 'root/some/image.jpg')
+        self.assertEqual(builder.build('some/image.jpg', webp=True), 'root/some/image.jpg/webp')
+        self.assertEqual(builder.build('some/'), 'root/some/root_image')
+
+    def test_builds_randomized_keys(self):
+        builder = KeyBuilder('root', True, 'root_image')
+        digest = sha1('root.some/image.jpg'.encode('utf-8')).hexdigest()
+
+        self.assertEqual(builder.build('some/image.jpg'), '%s/root/some/image.jpg' % digest)
+
+    def test_builds_keys_without_root_path(self):
+        builder = KeyBuilder('', False, 'root_image')
+
+        self.assertEqual(builder.build('//some//image.jpg'), 'some/image.jpg')
+
+    def test_is_compiled_once_per_configuration(self):
+        config = Config(TC_AWS_STORAGE_ROOT_PATH='storage', TC_AWS_RESULT_STORAGE_ROOT_PATH='result', AUTO_WEBP=True)
+
+        builder = KeyBuilder.from_config(config, 'TC_AWS_STORAGE')
+
+        self.assertIs(KeyBuilder.from_config(config, 'TC_AWS_STORAGE'), builder)
+        self.assertTrue(builder.auto_webp)
+        self.assertEqual(builder.root_path, 'storage')
+        self.assertEqual(KeyBuilder.from_config(config, 'TC_AWS_RESULT_STORAGE').root_path, 'result')
+        self.assertIsNot(KeyBuilder.from_config(Config(), 'TC_AWS_STORAGE'), builder)
+
+
+class CleanKeyTestCase(TestCase):
+
+    def test_removes_duplicate_and_leading_slashes(self):
+        self.assertEqual(clean_key('/a//b///c.jpg'), 'a/b/c.jpg')
+
+    def test_returns_clean_keys_as_is(self):
+        key = 'a/b/c.jpg'
+        self.assertIs(clean_key(key), key)
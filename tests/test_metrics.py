@@ -0,0 +1,53 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+from unittest import TestCase
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import Mock
+from pytest import raises
+
+from tc_aws.aws.metrics import Measure
+
+
+class MeasureTestCase(TestCase):
+
+    def test_records_time_status_retries_and_bytes(self):
+        metrics = Mock()
+
+        with Measure(metrics, 's3.loader.bucket', 'get') as measure:
+            measure.response = dict(ResponseMetadata=dict(HTTPStatusCode=200, RetryAttempts=2))
+            measure.bytes_in = 10
+
+        self.assertEqual(metrics.timing.call_args[0][0], 's3.loader.bucket.get.time')
+        metrics.incr.assert_any_call('s3.loader.bucket.get.2xx')
+        metrics.incr.assert_any_call('s3.loader.bucket.get.retries', 2)
+        metrics.incr.assert_any_call('s3.loader.bucket.bytes_in', 10)
+
+    def test_records_status_class_of_client_errors(self):
+        metrics = Mock()
+        error = ClientError({'Error': {'Code': '503'}, 'ResponseMetadata': {'HTTPStatusCode': 503}}, 'GetObject')
+
+        with raises(ClientError):
+            with Measure(metrics, 's3.loader.bucket', 'get'):
+                raise error
+
+        metrics.incr.assert_called_once_with('s3.loader.bucket.get.5xx')
+
+    def test_records_errors_without_response(self):
+        metrics = Mock()
+
+        with raises(EndpointConnectionError):
+            with Measure(metrics, 's3.loader.bucket', 'get'):
+                raise EndpointConnectionError(endpoint_url='')
+
+        metrics.incr.assert_called_once_with('s3.loader.bucket.get.error')
+
+    def test_records_nothing_without_metrics(self):
+        with Measure(None, 's3.loader.bucket', 'get_url') as measure:
+            pass
+
+        self.assertEqual(measure.status, 'ok')
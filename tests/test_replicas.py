@@ -0,0 +1,134 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import patch
+from pytest import raises
+from tornado.testing import AsyncTestCase, gen_test
+
+from tc_aws.aws.replicas import FAILURE_COOLDOWN, ReplicaSet
+
+TARGETS = [('images', 'eu-west-1', None), ('images-replica', 'us-west-2', None), ('images-dr', 'us-east-1', None)]
+
+
+def not_found():
+    return ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, 'GetObject')
+
+
+class ReplicaSetTestCase(AsyncTestCase):
+
+    def tearDown(self):
+        super(ReplicaSetTestCase, self).tearDown()
+        ReplicaSet._instances = {}
+
+    def _fetch(self, **answers):
+        """
+        Returns a fetch function answering for each bucket after a delay, or raising an error
+        """
+        calls = []
+
+        async def fetch(bucket):
+            calls.append(bucket)
+            answer = answers.get(bucket, 0)
+            if isinstance(answer, Exception):
+                raise answer
+
+            await asyncio.sleep(answer)
+            return bucket
+
+        return fetch, calls
+
+    @gen_test
+    async def test_reads_from_nearest_replica(self):
+        fetch, calls = self._fetch()
+
+        self.assertEqual(await ReplicaSet(TARGETS).fetch(['images', 'images-replica', 'images-dr'], fetch), 'images')
+        self.assertEqual(calls, ['images'])
+
+    @gen_test
+    async def test_fails_over_to_next_replica(self):
+        replicas = ReplicaSet(TARGETS)
+        fetch, calls = self._fetch(images=EndpointConnectionError(endpoint_url='http://s3'))
+
+        self.assertEqual(await replicas.fetch(['images', 'images-replica', 'images-dr'], fetch), 'images-replica')
+        self.assertEqual(calls, ['images', 'images-replica'])
+
+        # The failing replica is then tried last
+        self.assertEqual(replicas.ordered(), [1, 2, 0])
+        self.assertFalse(replicas.is_healthy(0))
+
+        with patch('tc_aws.aws.replicas.monotonic', return_value=replicas._failed_at[0] + FAILURE_COOLDOWN):
+            self.assertTrue(replicas.is_healthy(0))
+
+    @gen_test
+    async def test_missing_object_does_not_make_replica_unhealthy(self):
+        replicas = ReplicaSet(TARGETS)
+        fetch, calls = self._fetch(images=not_found())
+
+        self.assertEqual(await replicas.fetch(['images', 'images-replica', 'images-dr'], fetch), 'images-replica')
+        self.assertTrue(replicas.is_healthy(0))
+
+    @gen_test
+    async def test_prefers_fastest_replica(self):
+        replicas = ReplicaSet(TARGETS)
+        buckets = ['images', 'images-replica', 'images-dr']
+
+        for index, latency in enumerate([0.05, 0.01, 0.03]):
+            await replicas._fetch_one(buckets, self._fetch(**{buckets[index]: latency})[0], index)
+
+        self.assertEqual(replicas.ordered(), [1, 2, 0])
+
+    @gen_test
+    async def test_probes_replicas_not_read_from_yet_on_a_share_of_reads(self):
+        replicas = ReplicaSet(TARGETS)
+        buckets = ['images', 'images-replica', 'images-dr']
+        fetch, calls = self._fetch(images=0.01, **{'images-replica': 0.05, 'images-dr': 0.03})
+
+        with patch('tc_aws.aws.replicas.PROBE_RATE', 0.5):
+            for _ in range(6):
+                await replicas.fetch(buckets, fetch)
+
+        self.assertEqual(calls, ['images', 'images-replica', 'images', 'images-dr', 'images', 'images'])
+        self.assertEqual(replicas.ordered(), [0, 2, 1])
+
+    @gen_test
+    async def test_keeps_reading_from_nearest_replica_when_others_miss_objects(self):
+        replicas = ReplicaSet(TARGETS)
+        buckets = ['images', 'images-replica', 'images-dr']
+        fetch, calls = self._fetch(**{'images-replica': not_found(), 'images-dr': not_found()})
+
+        for _ in range(300):
+            self.assertEqual(await replicas.fetch(buckets, fetch), 'images')
+
+        # Probing replicas missing objects costs one more read on PROBE_RATE of the reads
+        self.assertEqual(calls.count('images'), 300)
+        self.assertEqual(calls.count('images-replica'), 2)
+        self.assertEqual(calls.count('images-dr'), 1)
+
+    @gen_test
+    async def test_reports_missing_only_if_missing_everywhere(self):
+        buckets = ['images', 'images-replica', 'images-dr']
+        timeout = EndpointConnectionError(endpoint_url='http://s3')
+
+        fetch, _ = self._fetch(images=not_found(), **{'images-replica': timeout, 'images-dr': not_found()})
+        with raises(EndpointConnectionError):
+            await ReplicaSet(TARGETS).fetch(buckets, fetch)
+
+        fetch, _ = self._fetch(**{bucket: not_found() for bucket in buckets})
+        with raises(ClientError):
+            await ReplicaSet(TARGETS).fetch(buckets, fetch)
+
+    @gen_test
+    async def test_races_replicas(self):
+        replicas = ReplicaSet(TARGETS)
+        fetch, calls = self._fetch(images=1, **{'images-replica': not_found(), 'images-dr': 0.01})
+
+        self.assertEqual(await replicas.fetch(['images', 'images-replica', 'images-dr'], fetch, race=True),
+                         'images-dr')
+        self.assertEqual(sorted(calls), ['images', 'images-dr', 'images-replica'])
+        self.assertEqual([stats['reads'] for stats in replicas.stats()], [1, 1, 1])
@@ -4,13 +4,18 @@
 # Use of this source code is governed by the MIT license that can be
 # found in the LICENSE file.
 
+import asyncio
 from datetime import datetime, timedelta
 from unittest import TestCase
 
+import botocore.session
 from dateutil.tz import tzutc
+from mock import Mock, patch
+from thumbor.app import ThumborServiceApp
 from thumbor.config import Config
 from thumbor.context import Context
-from tornado.testing import gen_test
+from thumbor.importer import Importer
+from tornado.testing import AsyncHTTPTestCase, gen_test
 
 from .fixtures.storage_fixture import IMAGE_BYTES, get_server, s3_bucket
 from tc_aws.result_storages.s3_storage import Storage
@@ -19,6 +24,7 @@ from tests import S3MockedAsyncTestCase
 
 class Request(object):
     url = None
+    max_age = None
 
 
 class S3StorageTestCase(S3MockedAsyncTestCase):
@@ -69,6 +75,86 @@ class S3StorageTestCase(S3MockedAsyncTestCase):
         self.assertEqual(topic.buffer, IMAGE_BYTES)
 
 
+    @gen_test
+    async def test_does_not_download_expired_image_with_conditional_check(self):
+        config = Config(TC_AWS_RESULT_STORAGE_BUCKET=s3_bucket, TC_AWS_CONDITIONAL_EXPIRATION_CHECK=True,
+                        RESULT_STORAGE_EXPIRATION_SECONDS=3600)
+        ctx = Context(config=config, server=get_server('ACME-SEC'))
+        ctx.request = Request
+        ctx.request.url = 'my-image-expired.jpg'
+
+        storage = Storage(ctx)
+        await storage.put(IMAGE_BYTES)
+
+        topic = await storage.get()
+        self.assertEqual(topic.buffer, IMAGE_BYTES)
+
+        with patch('tc_aws.aws.storage.datetime') as datetime_mock:
+            datetime_mock.now.return_value = datetime.now(tzutc()) + timedelta(seconds=7200)
+            with patch.object(storage, 'is_expired', return_value=False):
+                topic = await storage.get()
+
+        self.assertIsNone(topic)
+
+    def _get_redirect_storage(self, url, **settings):
+        config = Config(TC_AWS_RESULT_STORAGE_BUCKET=s3_bucket, TC_AWS_RESULT_STORAGE_ROOT_PATH='results',
+                        TC_AWS_RESULT_STORAGE_REDIRECT=True, **settings)
+        handler = Mock()
+        ctx = Context(config=config, server=get_server('ACME-SEC'), request_handler=handler)
+        ctx.request = Request()
+        ctx.request.url = url
+
+        return Storage(ctx), handler
+
+    @gen_test
+    async def test_redirects_to_presigned_url(self):
+        storage, handler = self._get_redirect_storage('my-image-redirect.jpg')
+        await storage.put(IMAGE_BYTES)
+
+        topic = await storage.get()
+
+        self.assertEqual(topic.buffer, b'')
+        self.assertEqual(topic.mime, 'image/jpeg')
+        handler.set_status.assert_called_once_with(302)
+        location = handler.set_header.call_args[0][1]
+        self.assertIn('/results/my-image-redirect.jpg?', location)
+        self.assertIn('Signature=', location)
+        self.assertEqual(storage.context.request.max_age, 3600)
+
+    @gen_test
+    async def test_redirects_to_base_url(self):
+        storage, handler = self._get_redirect_storage('my image.jpg',
+                                                      TC_AWS_RESULT_STORAGE_REDIRECT_BASE_URL='https://cdn.test/')
+        await storage.put(IMAGE_BYTES)
+
+        await storage.get()
+
+        handler.set_header.assert_called_once_with('Location', 'https://cdn.test/results/my%20image.jpg')
+        self.assertIsNone(storage.context.request.max_age)
+
+    @gen_test
+    async def test_serves_small_results_instead_of_redirecting(self):
+        storage, handler = self._get_redirect_storage('my-image-small.jpg',
+                                                      TC_AWS_RESULT_STORAGE_REDIRECT_MIN_BYTES=len(IMAGE_BYTES) + 1)
+        await storage.put(IMAGE_BYTES)
+
+        topic = await storage.get()
+
+        self.assertEqual(topic.buffer, IMAGE_BYTES)
+        handler.set_status.assert_not_called()
+
+    @gen_test
+    async def test_does_not_redirect_to_missing_or_expired_results(self):
+        storage, handler = self._get_redirect_storage('my-image-missing.jpg')
+        self.assertIsNone(await storage.get())
+
+        await storage.put(IMAGE_BYTES)
+        with patch.object(storage, 'is_expired', return_value=True):
+            self.assertIsNone(await storage.get())
+
+        handler.set_status.assert_not_called()
+
+
 class ExpiredTestCase(TestCase):
 
     @property
@@ -115,3 +201,46 @@ class PrefixTestCase(TestCase):
         topic = storage._normalize_path('toto')
 
         self.assertEqual(topic, "tata/toto")
+
+
+class RedirectHandlerTestCase(S3MockedAsyncTestCase, AsyncHTTPTestCase):
+
+    def get_app(self):
+        config = Config(
+            LOADER='tc_aws.loaders.s3_loader',
+            RESULT_STORAGE='tc_aws.result_storages.s3_storage',
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_RESULT_STORAGE_BUCKET=s3_bucket,
+            TC_AWS_RESULT_STORAGE_ROOT_PATH='results',
+            TC_AWS_RESULT_STORAGE_REDIRECT=True,
+            TC_AWS_RESULT_STORAGE_REDIRECT_EXPIRY=600,
+            RESULT_STORAGE_STORES_UNSAFE=True,
+            MAX_AGE=86400,
+        )
+        importer = Importer(config)
+        importer.import_modules()
+
+        return ThumborServiceApp(Context(get_server('ACME-SEC'), config, importer))
+
+    @gen_test
+    async def test_caches_redirect_no_longer_than_presigned_url(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.put_object(Bucket=s3_bucket, Key='image.jpg', Body=IMAGE_BYTES)
+
+        response = await self.http_client.fetch(self.get_url('/unsafe/image.jpg'), raise_error=False)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'max-age=86400,public')
+
+        # The result is stored once the response is sent
+        for _ in range(50):
+            if client.list_objects_v2(Bucket=s3_bucket, Prefix='results/').get('KeyCount'):
+                break
+            await asyncio.sleep(0.1)
+
+        response = await self.http_client.fetch(self.get_url('/unsafe/image.jpg'), follow_redirects=False,
+                                                raise_error=False)
+
+        self.assertEqual(response.code, 302)
+        self.assertIn('/results/unsafe/image.jpg?', response.headers['Location'])
+        self.assertEqual(response.headers['Cache-Control'], 'max-age=600,public')
+        self.assertEqual(response.body, b'')
@@ -4,7 +4,16 @@
 # Use of this source code is governed by the MIT license that can be
 # found in the LICENSE file.
 
+import asyncio
+from datetime import datetime, timedelta
+from functools import partial
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
 import botocore.session
+from botocore.exceptions import ClientError, IncompleteReadError
+from dateutil.tz import tzutc
 from derpconf.config import Config
 from mock import patch
 from thumbor.context import Context
@@ -12,6 +21,7 @@ from thumbor.loaders import LoaderResult
 from tornado.testing import gen_test
 
 from .fixtures.storage_fixture import IMAGE_PATH, IMAGE_BYTES, s3_bucket
+from tc_aws.aws.bucket import Bucket
 from tc_aws.loaders import s3_loader
 from tests import S3MockedAsyncTestCase
 
@@ -51,6 +61,390 @@ class S3LoaderTestCase(S3MockedAsyncTestCase):
         self.assertIsNone(loader_result.buffer)
         self.assertEqual(loader_result.error, LoaderResult.ERROR_NOT_FOUND)
 
+    @gen_test
+    async def test_records_metrics(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.put_object(Bucket=s3_bucket, Key=''.join(['root_path', IMAGE_PATH]), Body=IMAGE_BYTES)
+
+        conf = Config(TC_AWS_LOADER_BUCKET=s3_bucket, TC_AWS_LOADER_ROOT_PATH='root_path')
+        context = Context(config=conf)
+
+        with patch.object(context, 'metrics') as metrics:
+            await s3_loader.load(context, IMAGE_PATH)
+            await s3_loader.load(context, 'foo-bar.jpg')
+
+        timings = [call[0][0] for call in metrics.timing.call_args_list]
+        self.assertEqual(timings, ['s3.loader.thumbor-images-test.get.time'] * 2)
+        metrics.incr.assert_any_call('s3.loader.thumbor-images-test.get.2xx')
+        metrics.incr.assert_any_call('s3.loader.thumbor-images-test.get.4xx')
+        metrics.incr.assert_any_call('s3.loader.thumbor-images-test.bytes_in', len(IMAGE_BYTES))
+
+    @gen_test
+    async def test_can_load_image_by_ranges(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+
+        client.put_object(
+            Bucket=s3_bucket,
+            Key=''.join(['root_path', IMAGE_PATH]),
+            Body=IMAGE_BYTES,
+            ContentType='image/jpeg', )
+
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_LOADER_RANGED_GET_THRESHOLD=1000,
+            TC_AWS_LOADER_RANGED_GET_PART_SIZE=len(IMAGE_BYTES) // 3,
+            TC_AWS_LOADER_RANGED_GET_CONCURRENCY=2,
+        )
+
+        loader_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+        self.assertTrue(loader_result.successful)
+        self.assertEqual(loader_result.buffer, IMAGE_BYTES)
+        self.assertEqual(loader_result.metadata['size'], len(IMAGE_BYTES))
+
+    @gen_test
+    async def test_can_load_small_image_by_ranges(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+
+        client.put_object(
+            Bucket=s3_bucket,
+            Key=''.join(['root_path', IMAGE_PATH]),
+            Body=IMAGE_BYTES,
+            ContentType='image/jpeg', )
+
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_LOADER_RANGED_GET_THRESHOLD=len(IMAGE_BYTES) * 2,
+        )
+
+        loader_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+        self.assertTrue(loader_result.successful)
+        self.assertEqual(loader_result.buffer, IMAGE_BYTES)
+
+    @gen_test
+    async def test_can_load_empty_image_by_ranges(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+
+        client.put_object(
+            Bucket=s3_bucket,
+            Key=''.join(['root_path', IMAGE_PATH]),
+            Body=b'', )
+
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_LOADER_RANGED_GET_THRESHOLD=1000,
+        )
+
+        loader_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+        self.assertTrue(loader_result.successful)
+        self.assertEqual(loader_result.buffer, b'')
+
+    @gen_test
+    async def test_concurrent_loads_share_one_request(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+
+        client.put_object(
+            Bucket=s3_bucket,
+            Key=''.join(['root_path', IMAGE_PATH]),
+            Body=IMAGE_BYTES,
+            ContentType='image/jpeg', )
+
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path'
+        )
+
+        requested_keys = []
+        bucket_get = Bucket.get
+
+        async def counting_get(bucket, path):
+            requested_keys.append(path)
+            return await bucket_get(bucket, path)
+
+        with patch.object(Bucket, 'get', counting_get):
+            results = await asyncio.gather(*[
+                s3_loader.load(Context(config=conf), IMAGE_PATH) for _ in range(5)
+            ])
+
+        self.assertEqual(len(requested_keys), 1)
+        for loader_result in results:
+            self.assertTrue(loader_result.successful)
+            self.assertEqual(loader_result.buffer, IMAGE_BYTES)
+
+    @gen_test
+    async def test_concurrent_loads_share_not_found_error(self):
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path'
+        )
+
+        results = await asyncio.gather(*[
+            s3_loader.load(Context(config=conf), 'foo-bar.jpg') for _ in range(3)
+        ])
+
+        for loader_result in results:
+            self.assertFalse(loader_result.successful)
+            self.assertEqual(loader_result.error, LoaderResult.ERROR_NOT_FOUND)
+
+    @gen_test
+    async def test_serves_repeated_loads_from_memory_cache(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+
+        client.put_object(
+            Bucket=s3_bucket,
+            Key=''.join(['root_path', IMAGE_PATH]),
+            Body=IMAGE_BYTES,
+            ContentType='image/jpeg', )
+
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_LOADER_CACHE_MAX_BYTES=len(IMAGE_BYTES) * 2,
+        )
+
+        await s3_loader.load(Context(config=conf), IMAGE_PATH)
+        client.delete_object(Bucket=s3_bucket, Key=''.join(['root_path', IMAGE_PATH]))
+        loader_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+
+        self.assertTrue(loader_result.successful)
+        self.assertEqual(loader_result.buffer, IMAGE_BYTES)
+        self.assertEqual(loader_result.metadata['size'], len(IMAGE_BYTES))
+
+        stats = s3_loader.get_cache_stats(Context(config=conf))
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['resident_bytes'], len(IMAGE_BYTES))
+
+    @gen_test
+    async def test_remembers_missing_image(self):
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_NEGATIVE_CACHE_TTL=60,
+        )
+
+        await s3_loader.load(Context(config=conf), IMAGE_PATH)
+
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.put_object(Bucket=s3_bucket, Key=''.join(['root_path', IMAGE_PATH]), Body=IMAGE_BYTES)
+
+        loader_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+        self.assertFalse(loader_result.successful)
+        self.assertEqual(loader_result.error, LoaderResult.ERROR_NOT_FOUND)
+
+    @gen_test
+    async def test_returns_upstream_error_on_truncated_body(self):
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path'
+        )
+
+        with patch('tc_aws.loaders.s3_loader.read_body', side_effect=IncompleteReadError(actual_bytes=1,
+                                                                                        expected_bytes=2)):
+            with patch.object(Bucket, 'get'):
+                loader_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+
+        self.assertFalse(loader_result.successful)
+        self.assertEqual(loader_result.error, LoaderResult.ERROR_UPSTREAM)
+
+    @gen_test
+    async def test_can_load_image_with_hedged_requests(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.put_object(Bucket=s3_bucket, Key=''.join(['root_path', IMAGE_PATH]), Body=IMAGE_BYTES)
+
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_HEDGE_DELAY=0.000001,
+            TC_AWS_HEDGE_MAX_RATE=1,
+        )
+        context = Context(config=conf)
+
+        with patch.object(context, 'metrics') as metrics:
+            loader_result = await s3_loader.load(context, IMAGE_PATH)
+
+        self.assertTrue(loader_result.successful)
+        self.assertEqual(loader_result.buffer, IMAGE_BYTES)
+        metrics.incr.assert_any_call('s3.loader.thumbor-images-test.get.hedge.issued')
+
+    @gen_test
+    async def test_returns_timeout_error_when_deadline_is_exceeded(self):
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_LOADER_GET_DEADLINE=0.01,
+        )
+
+        async def call(bucket, method, **kwargs):
+            await asyncio.sleep(10)
+
+        with patch.object(Bucket, '_call', call):
+            loader_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+
+        self.assertFalse(loader_result.successful)
+        self.assertEqual(loader_result.error, LoaderResult.ERROR_TIMEOUT)
+
+    @gen_test
+    async def test_fails_fast_when_circuit_is_open(self):
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_CIRCUIT_BREAKER_ERROR_RATE=0.5,
+            TC_AWS_CIRCUIT_BREAKER_MIN_CALLS=1,
+        )
+        calls = []
+
+        async def call(bucket, method, **kwargs):
+            calls.append(kwargs)
+            raise ClientError({'Error': {'Code': 'SlowDown'}, 'ResponseMetadata': {'HTTPStatusCode': 503}}, 'GetObject')
+
+        with patch.object(Bucket, '_call', call):
+            first_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+            second_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+
+        self.assertEqual(first_result.error, LoaderResult.ERROR_UPSTREAM)
+        self.assertEqual(second_result.error, LoaderResult.ERROR_UPSTREAM)
+        self.assertEqual(len(calls), 1)
+
+    def _stale_disk_cache(self, content, last_modified, **settings):
+        cache_path = mkdtemp()
+        self.addCleanup(rmtree, cache_path)
+        context = Context(config=Config(TC_AWS_LOADER_BUCKET=s3_bucket, TC_AWS_LOADER_ROOT_PATH='root_path',
+                                        TC_AWS_DISK_CACHE_PATH=cache_path, TC_AWS_DISK_CACHE_TTL=60, **settings))
+        bucket, key = s3_loader._get_bucket_and_key(context, IMAGE_PATH)
+        disk_cache = s3_loader._get_disk_cache(context)
+
+        return context, disk_cache, partial(disk_cache.put, bucket, key, content, last_modified), \
+            partial(disk_cache.get, bucket, key)
+
+    @gen_test
+    async def test_revalidates_stale_disk_cache_entry(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.put_object(Bucket=s3_bucket, Key=''.join(['root_path', IMAGE_PATH]), Body=IMAGE_BYTES)
+
+        # Cached after the object was last modified
+        context, disk_cache, put, get = self._stale_disk_cache(b'cached', datetime.now(tzutc()) + timedelta(hours=1))
+        await put()
+
+        with patch('tc_aws.aws.disk_cache.time', return_value=time() + 120):
+            loader_result = await s3_loader.load(context, IMAGE_PATH)
+
+        self.assertEqual(loader_result.buffer, b'cached')
+        self.assertTrue((await get())[2])
+
+    @gen_test
+    async def test_replaces_disk_cache_entry_modified_in_s3(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.put_object(Bucket=s3_bucket, Key=''.join(['root_path', IMAGE_PATH]), Body=IMAGE_BYTES)
+
+        context, disk_cache, put, get = self._stale_disk_cache(b'outdated', datetime(2020, 1, 2, tzinfo=tzutc()))
+        await put()
+
+        with patch('tc_aws.aws.disk_cache.time', return_value=time() + 120):
+            loader_result = await s3_loader.load(context, IMAGE_PATH)
+
+        self.assertEqual(loader_result.buffer, IMAGE_BYTES)
+        self.assertEqual((await get())[0], IMAGE_BYTES)
+
+    @gen_test
+    async def test_forgets_disk_cache_entry_deleted_from_s3(self):
+        context, disk_cache, put, get = self._stale_disk_cache(b'deleted', datetime(2020, 1, 2, tzinfo=tzutc()))
+        await put()
+
+        with patch('tc_aws.aws.disk_cache.time', return_value=time() + 120):
+            loader_result = await s3_loader.load(context, IMAGE_PATH)
+
+        self.assertEqual(loader_result.error, LoaderResult.ERROR_NOT_FOUND)
+        self.assertIsNone(await get())
+
+    @gen_test
+    async def test_fails_over_to_replica(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.create_bucket(Bucket='thumbor-images-replica')
+        client.put_object(Bucket='thumbor-images-replica', Key=''.join(['root_path', IMAGE_PATH]), Body=IMAGE_BYTES)
+
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_LOADER_REPLICAS=[dict(bucket='thumbor-images-replica', region='us-west-2')],
+        )
+
+        loader_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+
+        self.assertTrue(loader_result.successful)
+        self.assertEqual(loader_result.buffer, IMAGE_BYTES)
+        self.assertEqual([stats['reads'] for stats in s3_loader.get_replica_stats(Context(config=conf))], [1, 1])
+
+    @gen_test
+    async def test_races_replicas(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.create_bucket(Bucket='thumbor-images-replica')
+        client.put_object(Bucket='thumbor-images-replica', Key=''.join(['root_path', IMAGE_PATH]), Body=IMAGE_BYTES)
+
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_LOADER_REPLICAS=[dict(bucket='thumbor-images-replica')],
+            TC_AWS_LOADER_REPLICAS_RACE=True,
+        )
+
+        loader_result = await s3_loader.load(Context(config=conf), IMAGE_PATH)
+
+        self.assertTrue(loader_result.successful)
+        self.assertEqual(loader_result.buffer, IMAGE_BYTES)
+
+    @gen_test
+    async def test_missing_in_same_named_replica_is_not_missing_in_bucket(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.put_object(Bucket=s3_bucket, Key=''.join(['root_path', IMAGE_PATH]), Body=IMAGE_BYTES)
+
+        regions = []
+        call = Bucket._call
+
+        async def lagging_replica_call(bucket, method, **kwargs):
+            region = bucket._client.meta.region_name
+            regions.append(region)
+            if region == 'us-west-2':
+                raise ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}},
+                                  'GetObject')
+
+            return await call(bucket, method, **kwargs)
+
+        conf = dict(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_ROOT_PATH='root_path',
+            TC_AWS_NEGATIVE_CACHE_TTL=60,
+            TC_AWS_LOADER_REPLICAS=[dict(region='us-west-2')],
+        )
+
+        with patch.object(Bucket, '_call', lagging_replica_call):
+            loader_result = await s3_loader.load(Context(config=Config(TC_AWS_LOADER_REPLICAS_RACE=True, **conf)),
+                                                 IMAGE_PATH)
+            self.assertTrue(loader_result.successful)
+            self.assertIn('us-west-2', regions)
+
+            loader_result = await s3_loader.load(Context(config=Config(**conf)), IMAGE_PATH)
+
+        self.assertTrue(loader_result.successful)
+        self.assertEqual(loader_result.buffer, IMAGE_BYTES)
+
+    @gen_test
+    async def test_returns_404_when_missing_from_all_replicas(self):
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.create_bucket(Bucket='thumbor-images-replica')
+
+        conf = Config(
+            TC_AWS_LOADER_BUCKET=s3_bucket,
+            TC_AWS_LOADER_REPLICAS=[dict(bucket='thumbor-images-replica')],
+        )
+
+        loader_result = await s3_loader.load(Context(config=conf), 'foo-bar.jpg')
+
+        self.assertFalse(loader_result.successful)
+        self.assertEqual(loader_result.error, LoaderResult.ERROR_NOT_FOUND)
+
     @gen_test
     async def test_can_validate_buckets(self):
         conf = Config(
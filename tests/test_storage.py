@@ -6,16 +6,24 @@
 # Use of this source code is governed by the MIT license that can be
 # found in the LICENSE file.
 
+import asyncio
 from datetime import datetime, timedelta
+from shutil import rmtree
+from tempfile import mkdtemp
 from unittest import TestCase
+from mock import patch
 from pytest import raises
 
+import botocore.session
+from botocore.exceptions import EndpointConnectionError
 from dateutil.tz import tzutc
 from thumbor.config import Config
 from thumbor.context import Context, RequestParameters
 from tornado.testing import gen_test
 
 from .fixtures.storage_fixture import IMAGE_URL, IMAGE_BYTES, get_server, s3_bucket
+from tc_aws.aws.bucket import Bucket
+from tc_aws.aws.settings import get_bucket_options
 from tc_aws.storages.s3_storage import Storage
 from tests import S3MockedAsyncTestCase
 
@@ -78,6 +86,291 @@ class S3StorageTestCase(S3MockedAsyncTestCase):
         exists = await storage.exists(IMAGE_URL % '5')
         self.assertTrue(exists)
 
+    @gen_test
+    async def test_can_get_image_from_disk_cache(self):
+        cache_path = mkdtemp()
+        self.addCleanup(rmtree, cache_path)
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_DISK_CACHE_PATH=cache_path)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+
+        await storage.put(IMAGE_URL % '10', IMAGE_BYTES)
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.delete_object(Bucket=s3_bucket, Key=storage._normalize_path(IMAGE_URL % '10'))
+        topic = await storage.get(IMAGE_URL % '10')
+
+        self.assertEqual(topic, IMAGE_BYTES)
+
+        await storage.remove(IMAGE_URL % '10')
+        topic = await storage.get(IMAGE_URL % '10')
+
+        self.assertIsNone(topic)
+
+    @gen_test
+    async def test_uses_component_connection_settings(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_MAX_POOL_CONNECTIONS=20,
+                        TC_AWS_STORAGE_MAX_POOL_CONNECTIONS=50, TC_AWS_READ_TIMEOUT=5)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+
+        client_config = storage.storage._client.meta.config
+
+        self.assertEqual(client_config.max_pool_connections, 50)
+        self.assertEqual(client_config.read_timeout, 5)
+
+    @gen_test
+    async def test_shares_client_with_loader_buckets(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+
+        loader_bucket = Bucket('other-bucket', config.TC_AWS_REGION, config.TC_AWS_ENDPOINT,
+                               **get_bucket_options(config, 'TC_AWS_LOADER'))
+
+        self.assertIsNot(loader_bucket, storage.storage)
+        self.assertIs(loader_bucket._client, storage.storage._client)
+
+    @gen_test
+    async def test_can_store_large_image_in_parts(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_MULTIPART_UPLOAD_THRESHOLD=5 * 1024 * 1024,
+                        TC_AWS_MULTIPART_UPLOAD_PART_SIZE=5 * 1024 * 1024)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        large_bytes = IMAGE_BYTES * (11 * 1024 * 1024 // len(IMAGE_BYTES))
+
+        await storage.put(IMAGE_URL % '11', large_bytes)
+        topic = await storage.get(IMAGE_URL % '11')
+
+        self.assertEqual(topic, large_bytes)
+
+    @gen_test
+    async def test_aborts_failed_multipart_upload(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_MULTIPART_UPLOAD_THRESHOLD=5 * 1024 * 1024,
+                        TC_AWS_MULTIPART_UPLOAD_PART_SIZE=5 * 1024 * 1024)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        client = storage.storage._client
+        large_bytes = IMAGE_BYTES * (11 * 1024 * 1024 // len(IMAGE_BYTES))
+
+        with patch.object(client, 'upload_part', side_effect=EndpointConnectionError(endpoint_url='')):
+            topic = await storage.put(IMAGE_URL % '12', large_bytes)
+
+        self.assertIsNone(topic)
+        uploads = await client.list_multipart_uploads(Bucket=s3_bucket)
+        self.assertEqual(uploads.get('Uploads', []), [])
+
+    @gen_test
+    async def test_aborts_multipart_upload_failing_to_complete(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_MULTIPART_UPLOAD_THRESHOLD=5 * 1024 * 1024,
+                        TC_AWS_MULTIPART_UPLOAD_PART_SIZE=5 * 1024 * 1024)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        client = storage.storage._client
+        large_bytes = IMAGE_BYTES * (11 * 1024 * 1024 // len(IMAGE_BYTES))
+
+        with patch.object(client, 'complete_multipart_upload', side_effect=EndpointConnectionError(endpoint_url='')):
+            topic = await storage.put(IMAGE_URL % '14', large_bytes)
+
+        self.assertIsNone(topic)
+        uploads = await client.list_multipart_uploads(Bucket=s3_bucket)
+        self.assertEqual(uploads.get('Uploads', []), [])
+
+    @gen_test
+    async def test_raises_multipart_part_size_to_minimum(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_MULTIPART_UPLOAD_THRESHOLD=1024 * 1024,
+                        TC_AWS_MULTIPART_UPLOAD_PART_SIZE=1024 * 1024)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        large_bytes = IMAGE_BYTES * (6 * 1024 * 1024 // len(IMAGE_BYTES))
+
+        with patch.object(storage.storage._client, 'upload_part',
+                          wraps=storage.storage._client.upload_part) as upload_part:
+            await storage.put(IMAGE_URL % '15', large_bytes)
+
+        self.assertEqual(upload_part.call_count, 2)
+        self.assertEqual(await storage.get(IMAGE_URL % '15'), large_bytes)
+
+    @gen_test
+    async def test_remembers_missing_images_until_stored(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_NEGATIVE_CACHE_TTL=60)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+
+        self.assertFalse(await storage.exists(IMAGE_URL % '13'))
+
+        client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        client.put_object(Bucket=s3_bucket, Key=storage._normalize_path(IMAGE_URL % '13'), Body=IMAGE_BYTES)
+
+        self.assertFalse(await storage.exists(IMAGE_URL % '13'))
+        self.assertIsNone(await storage.get(IMAGE_URL % '13'))
+
+        await storage.put(IMAGE_URL % '13', IMAGE_BYTES)
+
+        self.assertTrue(await storage.exists(IMAGE_URL % '13'))
+
+    @gen_test
+    async def test_answers_exists_from_cached_metadata_until_removed(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_HEAD_CACHE_TTL=60)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        await storage.put(IMAGE_URL % '22', IMAGE_BYTES)
+
+        client = storage.storage._client
+        with patch.object(client, 'head_object', wraps=client.head_object) as head_object:
+            self.assertEqual(await storage.get(IMAGE_URL % '22'), IMAGE_BYTES)
+            self.assertTrue(await storage.exists(IMAGE_URL % '22'))
+            self.assertTrue(await storage.exists(IMAGE_URL % '22'))
+
+            self.assertEqual(head_object.call_count, 0)
+            self.assertEqual((await storage.storage.head(storage._normalize_path(IMAGE_URL % '22')))['ContentLength'],
+                             len(IMAGE_BYTES))
+
+            await storage.remove(IMAGE_URL % '22')
+            self.assertFalse(await storage.exists(IMAGE_URL % '22'))
+            self.assertEqual(head_object.call_count, 1)
+
+    @gen_test
+    async def test_records_metrics(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket)
+        context = Context(config=config, server=get_server('ACME-SEC'))
+        storage = Storage(context)
+
+        with patch.object(context, 'metrics') as metrics:
+            await storage.put(IMAGE_URL % '23', IMAGE_BYTES)
+            await storage.exists(IMAGE_URL % '9999')
+            await storage.remove(IMAGE_URL % '23')
+
+        timings = [call[0][0] for call in metrics.timing.call_args_list]
+        self.assertEqual(timings, ['s3.storage.thumbor-images-test.put.time',
+                                   's3.storage.thumbor-images-test.exists.time',
+                                   's3.storage.thumbor-images-test.delete.time'])
+        metrics.incr.assert_any_call('s3.storage.thumbor-images-test.put.2xx')
+        metrics.incr.assert_any_call('s3.storage.thumbor-images-test.bytes_out', len(IMAGE_BYTES))
+        metrics.incr.assert_any_call('s3.storage.thumbor-images-test.exists.4xx')
+        metrics.incr.assert_any_call('s3.storage.thumbor-images-test.delete.2xx')
+
+    @gen_test
+    async def test_records_metrics_of_background_writes(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_STORAGE_WRITE_BEHIND=True)
+        context = Context(config=config, server=get_server('ACME-SEC'))
+        storage = Storage(context)
+
+        with patch.object(context, 'metrics') as metrics:
+            await storage.exists(IMAGE_URL % '28')
+            await storage.put(IMAGE_URL % '28', IMAGE_BYTES)
+
+            # Dropped by thumbor once the request is responded to
+            context.metrics = None
+            await storage.write_behind.close()
+
+        metrics.incr.assert_any_call('s3.storage.thumbor-images-test.put.2xx')
+
+    @gen_test
+    async def test_returns_none_when_circuit_is_open(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_CIRCUIT_BREAKER_ERROR_RATE=0.5,
+                        TC_AWS_CIRCUIT_BREAKER_MIN_CALLS=1)
+        context = Context(config=config, server=get_server('ACME-SEC'))
+        calls = []
+
+        async def call(bucket, method, **kwargs):
+            calls.append(kwargs)
+            raise EndpointConnectionError(endpoint_url='http://localhost:5000')
+
+        with patch.object(Bucket, '_call', call), patch.object(context, 'metrics') as metrics:
+            self.assertIsNone(await Storage(context).get(IMAGE_URL % '24'))
+            self.assertIsNone(await Storage(context).get(IMAGE_URL % '24'))
+            self.assertFalse(await Storage(context).exists(IMAGE_URL % '24'))
+
+        self.assertEqual(len(calls), 1)
+        metrics.incr.assert_any_call('s3.storage.thumbor-images-test.get.circuit_open')
+
+    @gen_test
+    async def test_returns_none_when_deadline_is_exceeded(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_GET_DEADLINE=10, TC_AWS_STORAGE_GET_DEADLINE=0.01)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        await storage.put(IMAGE_URL % '25', IMAGE_BYTES)
+
+        async def call(bucket, method, **kwargs):
+            await asyncio.sleep(10)
+
+        with patch.object(Bucket, '_call', call):
+            self.assertIsNone(await storage.get(IMAGE_URL % '25'))
+
+    @gen_test
+    async def test_reads_body_within_deadline(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_STORAGE_GET_DEADLINE=10)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        await storage.put(IMAGE_URL % '26', IMAGE_BYTES)
+
+        self.assertEqual(await storage.get(IMAGE_URL % '26'), IMAGE_BYTES)
+
+    @gen_test
+    async def test_can_store_image_in_background(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_STORAGE_WRITE_BEHIND=True)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+
+        topic = await storage.put(IMAGE_URL % '14', IMAGE_BYTES)
+
+        self.assertEqual(topic, IMAGE_URL % '14')
+        self.assertTrue(await storage.exists(IMAGE_URL % '14'))
+        self.assertEqual(await storage.get(IMAGE_URL % '14'), IMAGE_BYTES)
+
+        await storage.write_behind.close()
+
+        self.assertEqual(storage.write_behind.stats()['written'], 1)
+        self.assertEqual(await storage.get(IMAGE_URL % '14'), IMAGE_BYTES)
+
+    @gen_test
+    async def test_only_caches_image_on_disk_once_written_in_background(self):
+        cache_path = mkdtemp()
+        self.addCleanup(rmtree, cache_path)
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_STORAGE_WRITE_BEHIND=True,
+                        TC_AWS_DISK_CACHE_PATH=cache_path)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        file_abspath = storage._normalize_path(IMAGE_URL % '27')
+
+        with patch.object(Storage, '_put_object', side_effect=EndpointConnectionError(endpoint_url='')):
+            await storage.put(IMAGE_URL % '27', IMAGE_BYTES)
+            self.assertIsNone(await storage.disk_cache.get(s3_bucket, file_abspath))
+            await storage.write_behind.close()
+
+        self.assertEqual(storage.write_behind.stats()['failures'], 1)
+        self.assertIsNone(await storage.disk_cache.get(s3_bucket, file_abspath))
+        self.assertIsNone(await storage.get(IMAGE_URL % '27'))
+
+        await storage.put(IMAGE_URL % '27', IMAGE_BYTES)
+        await storage.write_behind.close()
+
+        self.assertEqual((await storage.disk_cache.get(s3_bucket, file_abspath))[0], IMAGE_BYTES)
+
+    @gen_test
+    async def test_can_remove_many_images_with_their_sidecars(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, STORES_CRYPTO_KEY_FOR_EACH_IMAGE=True)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        paths = [IMAGE_URL % index for index in range(15, 18)]
+
+        for path in paths:
+            await storage.put(path, IMAGE_BYTES)
+            await storage.put_crypto(path)
+            await storage.put_detector_data(path, 'some-data')
+
+        client = storage.storage._client
+        with patch('tc_aws.aws.bucket.DELETE_BATCH_SIZE', 2), \
+                patch.object(client, 'delete_objects', wraps=client.delete_objects) as delete_objects:
+            topic = await storage.remove_many(paths)
+
+        self.assertEqual(topic, {})
+        self.assertEqual(delete_objects.call_count, 5)
+        for path in paths:
+            self.assertFalse(await storage.exists(path))
+            self.assertIsNone(await storage.get_crypto(path))
+            self.assertIsNone(await storage.get_detector_data(path))
+
+    @gen_test
+    async def test_reports_keys_which_could_not_be_removed(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket)
+        storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
+        await storage.put(IMAGE_URL % '18', IMAGE_BYTES)
+
+        client = storage.storage._client
+        with patch.object(client, 'delete_objects', side_effect=EndpointConnectionError(endpoint_url='')):
+            topic = await storage.remove_many([IMAGE_URL % '18'])
+
+        file_abspath = storage._normalize_path(IMAGE_URL % '18')
+        self.assertEqual(set(topic), {file_abspath, file_abspath[:-4] + '.txt', file_abspath[:-4] + '.detectors.txt'})
+        self.assertTrue(await storage.exists(IMAGE_URL % '18'))
+
     def test_should_return_storage_prefix(self):
         config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, TC_AWS_STORAGE_ROOT_PATH='tata')
         storage = Storage(Context(config=config, server=get_server('ACME-SEC')))
@@ -154,6 +447,61 @@ class DetectorS3StorageTestCase(S3MockedAsyncTestCase):
         self.assertIsNone(topic)
 
 
+class MetadataSidecarsS3StorageTestCase(S3MockedAsyncTestCase):
+
+    def _get_storage(self):
+        config = Config(TC_AWS_STORAGE_BUCKET=s3_bucket, STORES_CRYPTO_KEY_FOR_EACH_IMAGE=True,
+                        TC_AWS_STORAGE_SIDECARS_IN_METADATA=True)
+        return Storage(Context(config=config, server=get_server('ACME-SEC')))
+
+    @gen_test
+    async def test_reads_crypto_and_detector_data_from_a_single_head(self):
+        storage = self._get_storage()
+        await storage.put(IMAGE_URL % '19', IMAGE_BYTES)
+        await storage.put_crypto(IMAGE_URL % '19')
+        await storage.put_detector_data(IMAGE_URL % '19', [{'x': 1, 'y': 2}])
+
+        storage = self._get_storage()
+        client = storage.storage._client
+        with patch.object(client, 'head_object', wraps=client.head_object) as head_object, \
+                patch.object(client, 'get_object', wraps=client.get_object) as get_object:
+            self.assertEqual(await storage.get_crypto(IMAGE_URL % '19'), 'ACME-SEC')
+            self.assertEqual(await storage.get_detector_data(IMAGE_URL % '19'), [{'x': 1, 'y': 2}])
+
+        self.assertEqual(head_object.call_count, 1)
+        self.assertEqual(get_object.call_count, 0)
+        self.assertEqual(await storage.get(IMAGE_URL % '19'), IMAGE_BYTES)
+
+        listed = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000') \
+            .list_objects_v2(Bucket=s3_bucket)
+        self.assertEqual([item['Key'] for item in listed['Contents']], [storage._normalize_path(IMAGE_URL % '19')])
+
+    @gen_test
+    async def test_stores_large_detector_data_in_combined_sidecar(self):
+        storage = self._get_storage()
+        detector_data = [{'x': index, 'y': index} for index in range(200)]
+        await storage.put(IMAGE_URL % '20', IMAGE_BYTES)
+        await storage.put_crypto(IMAGE_URL % '20')
+        await storage.put_detector_data(IMAGE_URL % '20', detector_data)
+
+        storage = self._get_storage()
+        self.assertEqual(await storage.get_crypto(IMAGE_URL % '20'), 'ACME-SEC')
+        self.assertEqual(await storage.get_detector_data(IMAGE_URL % '20'), detector_data)
+
+        await storage.remove_many([IMAGE_URL % '20'])
+        listed = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000') \
+            .list_objects_v2(Bucket=s3_bucket)
+        self.assertNotIn('Contents', listed)
+
+    @gen_test
+    async def test_returns_none_if_no_detector_data(self):
+        storage = self._get_storage()
+        await storage.put(IMAGE_URL % '21', IMAGE_BYTES)
+
+        self.assertIsNone(await storage.get_detector_data(IMAGE_URL % '21'))
+        self.assertIsNone(await storage.get_crypto(IMAGE_URL % '9999'))
+
+
 class WebpS3StorageTestCase(TestCase):
 
     def test_has_config_request(self):
@@ -0,0 +1,131 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import json
+import os
+from datetime import datetime, timedelta
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import botocore.session
+from dateutil.tz import tzutc
+from mock import patch
+from pytest import raises
+from thumbor.config import Config
+from tornado.testing import gen_test
+
+from tc_aws.result_storages.sweeper import Sweeper
+from tests import S3MockedAsyncTestCase
+from tests.fixtures.storage_fixture import s3_bucket
+
+
+class SweeperTestCase(S3MockedAsyncTestCase):
+
+    def setUp(self):
+        super(SweeperTestCase, self).setUp()
+        self.client = botocore.session.get_session().create_client('s3', endpoint_url='http://localhost:5000')
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        super(SweeperTestCase, self).tearDown()
+        rmtree(self.directory)
+
+    def _put_objects(self, keys):
+        for key in keys:
+            self.client.put_object(Bucket=s3_bucket, Key=key, Body=b'data')
+
+    def _keys(self):
+        return sorted(item['Key'] for item in self.client.list_objects_v2(Bucket=s3_bucket).get('Contents', []))
+
+    def _config(self, **settings):
+        return Config(TC_AWS_RESULT_STORAGE_BUCKET=s3_bucket, TC_AWS_RESULT_STORAGE_ROOT_PATH='results', **settings)
+
+    async def _sweep(self, sweeper, hours_later=2):
+        with patch('tc_aws.result_storages.sweeper.datetime') as now:
+            now.now.return_value = datetime.now(tzutc()) + timedelta(hours=hours_later)
+            return await sweeper.sweep()
+
+    @gen_test
+    async def test_deletes_expired_results_only(self):
+        self._put_objects(['results/%d.jpg' % index for index in range(5)] + ['originals/1.jpg'])
+
+        stats = await self._sweep(Sweeper(self._config(), 3600))
+
+        self.assertEqual(stats, dict(listed=5, expired=5, deleted=5, failed=0, dry_run=False))
+        self.assertEqual(self._keys(), ['originals/1.jpg'])
+
+    @gen_test
+    async def test_keeps_fresh_results(self):
+        self._put_objects(['results/1.jpg'])
+
+        stats = await self._sweep(Sweeper(self._config(), 3 * 3600))
+
+        self.assertEqual(stats['expired'], 0)
+        self.assertEqual(self._keys(), ['results/1.jpg'])
+
+    @gen_test
+    async def test_only_counts_in_dry_run(self):
+        self._put_objects(['results/1.jpg', 'results/2.jpg'])
+
+        stats = await self._sweep(Sweeper(self._config(), 3600, dry_run=True))
+
+        self.assertEqual((stats['expired'], stats['deleted']), (2, 0))
+        self.assertEqual(len(self._keys()), 2)
+
+    @gen_test
+    async def test_sweeps_randomized_keys_by_shards(self):
+        self._put_objects([
+            'd5f1c2b3a4e5f60718293a4b5c6d7e8f90a1b2c3/results/1.jpg',
+            '0a1b2c3d4e5f60718293a4b5c6d7e8f90a1b2c3d/results/2.jpg',
+            '0a1b2c3d4e5f60718293a4b5c6d7e8f90a1b2c3d/originals/1.jpg',
+        ])
+
+        stats = await self._sweep(Sweeper(self._config(TC_AWS_RANDOMIZE_KEYS=True), 3600, list_concurrency=4))
+
+        self.assertEqual((stats['listed'], stats['deleted']), (3, 2))
+        self.assertEqual(self._keys(), ['0a1b2c3d4e5f60718293a4b5c6d7e8f90a1b2c3d/originals/1.jpg'])
+
+    @gen_test
+    async def test_resumes_from_checkpoint(self):
+        checkpoint = os.path.join(self.directory, 'sweep.json')
+        self._put_objects(['results/1.jpg', 'results/2.jpg', 'results/3.jpg'])
+
+        with open(checkpoint, 'w') as checkpoint_file:
+            json.dump(dict(prefix='results/', shards='', ranges={'': dict(after='results/2.jpg', done=False)}),
+                      checkpoint_file)
+
+        stats = await self._sweep(Sweeper(self._config(), 3600, checkpoint=checkpoint))
+
+        self.assertEqual(stats['deleted'], 1)
+        self.assertEqual(self._keys(), ['results/1.jpg', 'results/2.jpg'])
+
+        with open(checkpoint) as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)['ranges'], {'': dict(after='results/3.jpg', done=True)})
+
+        # Swept ranges are not listed again
+        stats = await self._sweep(Sweeper(self._config(), 3600, checkpoint=checkpoint))
+        self.assertEqual(stats['listed'], 0)
+
+    @gen_test
+    async def test_does_not_resume_sweep_from_dry_run_checkpoint(self):
+        checkpoint = os.path.join(self.directory, 'sweep.json')
+        self._put_objects(['results/1.jpg', 'results/2.jpg'])
+
+        await self._sweep(Sweeper(self._config(), 3600, dry_run=True, checkpoint=checkpoint))
+
+        with raises(RuntimeError):
+            Sweeper(self._config(), 3600, checkpoint=checkpoint)
+
+        stats = await self._sweep(Sweeper(self._config(), 3600, checkpoint=os.path.join(self.directory, 'real.json')))
+
+        self.assertEqual(stats['deleted'], 2)
+        self.assertEqual(self._keys(), [])
+
+    def test_refuses_to_sweep_shared_bucket_without_root_path(self):
+        config = Config(TC_AWS_RESULT_STORAGE_BUCKET=s3_bucket, TC_AWS_STORAGE_BUCKET=s3_bucket)
+
+        with raises(RuntimeError):
+            Sweeper(config, 3600)
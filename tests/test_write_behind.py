@@ -0,0 +1,117 @@
+# coding: utf-8
+
+# Copyright (c) 2015, thumbor-community
+# Use of this source code is governed by the MIT license that can be
+# found in the LICENSE file.
+
+import asyncio
+
+from pytest import raises
+from tornado.testing import AsyncTestCase, gen_test
+
+from tc_aws.aws.write_behind import WriteBehindQueue
+
+
+class WriteBehindQueueTestCase(AsyncTestCase):
+
+    def tearDown(self):
+        super(WriteBehindQueueTestCase, self).tearDown()
+        WriteBehindQueue._instances = {}
+
+    def _writer(self, written, key, release=None):
+        async def write():
+            if release is not None:
+                await release.wait()
+            written.append(key)
+        return write
+
+    def test_is_shared_per_settings(self):
+        self.assertIs(WriteBehindQueue(10, 2), WriteBehindQueue(10, 2))
+        self.assertIsNot(WriteBehindQueue(10, 2), WriteBehindQueue(10, 2, 'drop_new'))
+
+    def test_should_raise_on_invalid_overflow_policy(self):
+        with raises(RuntimeError):
+            WriteBehindQueue(10, 2, 'drop_everything')
+
+    @gen_test
+    async def test_serves_pending_writes_until_flushed(self):
+        queue = WriteBehindQueue(10, 2)
+        written = []
+        release = asyncio.Event()
+
+        self.assertTrue(await queue.put(('bucket', 'a'), b'aaaa', self._writer(written, 'a', release)))
+        self.assertEqual(queue.get_pending(('bucket', 'a')), b'aaaa')
+
+        release.set()
+        await queue.flush()
+
+        self.assertEqual(written, ['a'])
+        self.assertIsNone(queue.get_pending(('bucket', 'a')))
+        self.assertEqual(queue.stats()['written'], 1)
+        await queue.close()
+
+    @gen_test
+    async def test_performs_writes_to_the_same_key_in_order(self):
+        queue = WriteBehindQueue(10, 2)
+        written = []
+        release = asyncio.Event()
+
+        await queue.put('a', b'a', self._writer(written, 'first', release))
+        await queue.put('a', b'a', self._writer(written, 'second'))
+        await asyncio.sleep(0.01)
+        release.set()
+        await queue.close()
+
+        self.assertEqual(written, ['first', 'second'])
+
+    @gen_test
+    async def test_drops_new_writes_when_full(self):
+        queue = WriteBehindQueue(1, 1, 'drop_new')
+        written = []
+        release = asyncio.Event()
+
+        await queue.put('a', b'a', self._writer(written, 'a', release))
+        await asyncio.sleep(0)
+        await queue.put('b', b'b', self._writer(written, 'b'))
+
+        self.assertFalse(await queue.put('c', b'c', self._writer(written, 'c')))
+        self.assertIsNone(queue.get_pending('c'))
+
+        release.set()
+        await queue.close()
+
+        self.assertEqual(written, ['a', 'b'])
+        self.assertEqual(queue.stats()['dropped'], 1)
+
+    @gen_test
+    async def test_drops_oldest_writes_when_full(self):
+        queue = WriteBehindQueue(1, 1, 'drop_oldest')
+        written = []
+        release = asyncio.Event()
+
+        await queue.put('a', b'a', self._writer(written, 'a', release))
+        await asyncio.sleep(0)
+        await queue.put('b', b'b', self._writer(written, 'b'))
+
+        self.assertTrue(await queue.put('c', b'c', self._writer(written, 'c')))
+        self.assertIsNone(queue.get_pending('b'))
+
+        release.set()
+        await queue.close()
+
+        self.assertEqual(written, ['a', 'c'])
+        self.assertEqual(queue.stats()['dropped'], 1)
+
+    @gen_test
+    async def test_counts_failed_writes(self):
+        queue = WriteBehindQueue(10, 1)
+
+        async def fail():
+            raise RuntimeError('S3 is down')
+
+        await queue.put('a', b'a', fail)
+        await queue.close()
+
+        stats = queue.stats()
+        self.assertEqual((stats['depth'], stats['written'], stats['failures']), (0, 0, 1))
+        self.assertIsNone(queue.get_pending('a'))